@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+DMD Benchmarks
+
+Times the parser, the transpiler and project validation on synthetic
+documents of growing size and compares the results with a stored baseline.
+
+    python benchmarks/run.py                     # Run and compare with baseline.json
+    python benchmarks/run.py --sizes 10 1000     # Selected sizes only
+    python benchmarks/run.py --update-baseline   # Record this machine's numbers
+
+Throughput is the best of several runs; peak memory is measured in a
+separate run under tracemalloc, which would otherwise distort the timings.
+
+Absolute throughput depends on the machine, so it is compared relative to
+a fixed pure-Python calibration loop timed in the same process: a stage
+regresses when its calibrated throughput, averaged over the sizes measured
+in both runs, falls by more than the throughput tolerance. That tolerance
+is loose, since the stages and the loop do not slow down alike on every
+machine. Each stage's scaling exponent is also fitted to those sizes: time
+grows as size ** exponent, so 1.0 is linear. A stage regresses when its
+exponent exceeds the baseline's by more than the exponent tolerance, i.e.
+when it scales worse. Peak memory, which does not depend on the machine's
+speed, regresses when it grows by more than the tolerance.
+"""
+
+import argparse
+import json
+import math
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.generate import generate_document, write_project
+from dmd.fscache import DirectoryCache
+from dmd.parser import DMDParser
+from dmd.transpile import DMDTranspiler
+from dmd.validator import DMDValidator
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+BASELINE = Path(__file__).parent / 'baseline.json'
+
+# Repeat small runs until this much time was spent, to get stable timings
+MIN_TIME = 0.2
+MAX_REPEATS = 20
+
+# Allowed growth of a stage's scaling exponent; repeated runs of the full
+# suite on one machine vary by about 0.05
+EXPONENT_TOLERANCE = 0.15
+
+# Allowed slowdown relative to the calibration loop (0.5: 1.5x the time)
+THROUGHPUT_TOLERANCE = 0.5
+
+
+@dataclass
+class Measurement:
+    """Result of one stage on one document size"""
+    stage: str
+    size: int        # Requested element count, the key in the baseline
+    elements: int    # Elements actually generated
+    megabytes: float
+    seconds: float
+    peak_mb: float
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.megabytes / self.seconds
+
+    @property
+    def elements_per_s(self) -> float:
+        return self.elements / self.seconds
+
+
+def measure(run: Callable[[], object]) -> Tuple[float, float]:
+    """Best wall time of `run` and its peak traced memory in MB"""
+    best = float('inf')
+    spent = 0.0
+    repeats = 0
+    while repeats < MAX_REPEATS and (repeats < 1 or spent < MIN_TIME):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        repeats += 1
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak / 1e6
+
+
+def calibration_loop() -> Dict[str, int]:
+    """Fixed pure-Python work (string splitting and dict updates) to measure the machine's speed"""
+    text = 'See @fig[plot] and @tbl[results] in the chapter. ' * 20
+    counts: Dict[str, int] = {}
+    for i in range(1000):
+        for word in text.split():
+            counts[word] = counts.get(word, 0) + i
+    return counts
+
+
+def calibrate() -> float:
+    """Best wall time of the calibration loop"""
+    best = float('inf')
+    spent = 0.0
+    repeats = 0
+    while repeats < MAX_REPEATS and (repeats < 3 or spent < MIN_TIME):
+        start = time.perf_counter()
+        calibration_loop()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        repeats += 1
+    return best
+
+
+def run_stages(size: int, workdir: Path) -> List[Measurement]:
+    """Measure every stage on documents of `size` elements"""
+    text, count = generate_document(size)
+    megabytes = len(text.encode('utf-8')) / 1e6
+    results = []
+
+    seconds, peak = measure(lambda: DMDParser(text).tokenize())
+    results.append(Measurement('parse', size, count, megabytes, seconds, peak))
+
+    seconds, peak = measure(lambda: DMDTranspiler().transpile_content(text))
+    results.append(Measurement('transpile', size, count, megabytes, seconds, peak))
+
+    root = workdir / f'project-{size}'
+    files, total = write_project(root, size)
+    project_mb = sum(f.stat().st_size for f in files) / 1e6
+
+    def validate():
+        validator = DMDValidator(root, fs_cache=DirectoryCache())
+        validator.validate_all(files, jobs=1)
+        if validator.has_errors():
+            raise RuntimeError(f"Benchmark project does not validate: {validator.errors[0].message}")
+
+    seconds, peak = measure(validate)
+    results.append(Measurement('validate', size, total, project_mb, seconds, peak))
+
+    return results
+
+
+def scaling_exponent(throughput: Dict[int, float]) -> float:
+    """
+    Least-squares exponent of time against size, from elements/s per size.
+
+    Time is size / throughput, so this is one minus the slope of log
+    throughput against log size. Fitting every size at once evens out the
+    noise of single timings, which on a busy machine can be tens of percent.
+    """
+    xs = [math.log(size) for size in throughput]
+    ys = [math.log(size / rate) for size, rate in throughput.items()]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+            / sum((x - mean_x) ** 2 for x in xs))
+
+
+def compare(results: List[Measurement], baseline: Dict, tolerance: float,
+            exponent_tolerance: float = EXPONENT_TOLERANCE, calibration: Optional[float] = None,
+            throughput_tolerance: float = THROUGHPUT_TOLERANCE) -> List[str]:
+    """
+    Regressions of `results` relative to `baseline`, as messages.
+
+    Throughput is only compared given the `calibration` time of this run,
+    and for sizes whose baseline has a calibrated throughput.
+    """
+    problems = []
+    tracked = [r for r in results if str(r.size) in baseline.get(r.stage, {})]
+
+    stages: Dict[str, List[Measurement]] = {}
+    for result in tracked:
+        stages.setdefault(result.stage, []).append(result)
+
+    for stage, measured in stages.items():
+        calibrated = [r for r in measured if 'elements_per_calibration' in baseline[stage][str(r.size)]]
+        if calibration and calibrated:
+            # Geometric mean of the slowdowns, so no single noisy size decides
+            slowdown = math.exp(sum(math.log(baseline[stage][str(r.size)]['elements_per_calibration']
+                                             / (r.elements_per_s * calibration)) for r in calibrated)
+                                / len(calibrated))
+            if slowdown > 1 + throughput_tolerance:
+                problems.append(f"{stage}: {slowdown:.1f}x slower than the baseline "
+                                f"relative to the calibration loop")
+
+        if len(measured) < 2:
+            continue
+        exponent = scaling_exponent({r.size: r.elements_per_s for r in measured})
+        base = scaling_exponent({r.size: baseline[stage][str(r.size)]['elements_per_s'] for r in measured})
+        if exponent > base + exponent_tolerance:
+            problems.append(f"{stage}: time grows as size^{exponent:.2f} over "
+                            f"{min(r.size for r in measured)}-{max(r.size for r in measured)} elements, "
+                            f"baseline size^{base:.2f}")
+
+    for result in tracked:
+        base = baseline[result.stage][str(result.size)]
+        if result.peak_mb > base['peak_mb'] * (1 + tolerance) + 0.1:
+            problems.append(f"{result.stage} at {result.size} elements: "
+                            f"peak {result.peak_mb:.1f} MB, baseline {base['peak_mb']:.1f} MB")
+    return problems
+
+
+def to_baseline(results: List[Measurement], calibration: float) -> Dict:
+    baseline: Dict[str, Dict] = {}
+    for result in results:
+        baseline.setdefault(result.stage, {})[str(result.size)] = {
+            # Elements processed in the time of one calibration loop
+            'elements_per_calibration': round(result.elements_per_s * calibration, 2),
+            'elements_per_s': round(result.elements_per_s),
+            'mb_per_s': round(result.mb_per_s, 2),
+            'peak_mb': round(result.peak_mb, 2),
+        }
+    return baseline
+
+
+def print_row(r: Measurement):
+    print(f"{r.stage:<10} {r.elements:>9} {r.megabytes:>8.2f} {r.seconds:>9.4f} "
+          f"{r.mb_per_s:>8.1f} {r.elements_per_s:>12,.0f} {r.peak_mb:>9.2f}", flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the DMD parser, transpiler and validator')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help=f"Element counts to benchmark (default: {' '.join(map(str, DEFAULT_SIZES))})")
+    parser.add_argument('--baseline', type=Path, default=BASELINE,
+                        help='Baseline to compare with (default: benchmarks/baseline.json)')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed relative growth of peak memory (default: 0.3)')
+    parser.add_argument('--exponent-tolerance', type=float, default=EXPONENT_TOLERANCE,
+                        help=f'Allowed growth of the scaling exponent, where 1.0 is linear '
+                             f'(default: {EXPONENT_TOLERANCE})')
+    parser.add_argument('--throughput-tolerance', type=float, default=THROUGHPUT_TOLERANCE,
+                        help=f'Allowed relative growth of the time per element, measured against a '
+                             f'calibration loop (default: {THROUGHPUT_TOLERANCE})')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--json', type=Path, help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    print(f"{'stage':<10} {'elements':>9} {'MB':>8} {'seconds':>9} {'MB/s':>8} {'elements/s':>12} {'peak MB':>9}")
+    results = []
+    calibration = calibrate()
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for measurement in run_stages(size, Path(workdir)):
+                print_row(measurement)
+                results.append(measurement)
+    # Calibrate before and after, in case the machine got busier meanwhile
+    calibration = min(calibration, calibrate())
+    print(f"calibration loop: {calibration * 1000:.2f} ms")
+
+    for stage in dict.fromkeys(r.stage for r in results):
+        throughput = {r.size: r.elements_per_s for r in results if r.stage == stage}
+        if len(throughput) > 1:
+            print(f"{stage:<10} time grows as size^{scaling_exponent(throughput):.2f}")
+
+    if args.json:
+        args.json.write_text(json.dumps([dict(asdict(r), mb_per_s=r.mb_per_s, elements_per_s=r.elements_per_s)
+                                         for r in results], indent=2) + '\n')
+
+    if args.update_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        for stage, sizes in to_baseline(results, calibration).items():
+            baseline.setdefault(stage, {}).update(sizes)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f"✓ Baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; record one with --update-baseline")
+        return 0
+
+    problems = compare(results, json.loads(args.baseline.read_text()), args.tolerance, args.exponent_tolerance,
+                       calibration, args.throughput_tolerance)
+    for problem in problems:
+        print(f"✗ Regression: {problem}", file=sys.stderr)
+    if not problems:
+        print(f"✓ No regressions against {args.baseline}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
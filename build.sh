@@ -47,13 +47,15 @@ fi
 
 # Step 1: Generate frontmatter from template
 echo -e "${YELLOW}Step 1/3: Generating frontmatter...${NC}"
+STEP_START=$SECONDS
 pandoc --wrap=preserve --template="templates/frontmatter.tex" ${META_FILE} -o ${FRONTMATTER_TEX}
-echo -e "${GREEN}✓ Frontmatter generated${NC}\n"
+echo -e "${GREEN}✓ Frontmatter generated ($((SECONDS - STEP_START))s)${NC}\n"
 
 # Step 2: Generate backmatter from template
 echo -e "${YELLOW}Step 2/3: Generating backmatter...${NC}"
+STEP_START=$SECONDS
 pandoc --wrap=preserve --template="templates/backmatter.tex" ${META_FILE} -o ${BACKMATTER_TEX}
-echo -e "${GREEN}✓ Backmatter generated${NC}\n"
+echo -e "${GREEN}✓ Backmatter generated ($((SECONDS - STEP_START))s)${NC}\n"
 
 # Define thesis content files in compilation order
 THESIS_CONTENT_FILES=(
@@ -69,6 +71,7 @@ THESIS_CONTENT_FILES=(
 echo -e "${GREEN}Building from: ${THESIS_CONTENT_FILES[*]}${NC}\n"
 
 # Step 3: Compile thesis
+STEP_START=$SECONDS
 if [[ "$1" == "--tex" ]]; then
     # Generate LaTeX file only (for debugging)
     echo -e "${YELLOW}Step 3/3: Generating LaTeX file...${NC}"
@@ -78,7 +81,7 @@ if [[ "$1" == "--tex" ]]; then
            ${THESIS_CONTENT_FILES[*]} \
            ${META_FILE} \
            -o thesis.tex
-    echo -e "${GREEN}✓ LaTeX generated: thesis.tex${NC}"
+    echo -e "${GREEN}✓ LaTeX generated: thesis.tex ($((SECONDS - STEP_START))s)${NC}"
 else
     # Generate PDF (default)
     echo -e "${YELLOW}Step 3/3: Compiling to PDF (this may take 1-2 minutes)...${NC}"
@@ -88,7 +91,7 @@ else
            ${THESIS_CONTENT_FILES[*]} \
            ${META_FILE} \
            -o thesis.pdf
-    echo -e "${GREEN}✓ PDF generated: thesis.pdf${NC}"
+    echo -e "${GREEN}✓ PDF generated: thesis.pdf ($((SECONDS - STEP_START))s)${NC}"
 fi
 
-echo -e "\n${GREEN}=== Build Complete ===${NC}"
+echo -e "\n${GREEN}=== Build Complete (${SECONDS}s) ===${NC}"
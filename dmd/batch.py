@@ -0,0 +1,120 @@
+"""
+DMD Batch Transpilation
+
+Expands file, directory and glob arguments into transpile jobs and runs
+them on a process pool, collecting per-file stats and errors.
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .cache import TranspileCache
+from .transpile import DMDTranspiler
+
+
+@dataclass
+class FileResult:
+    """Outcome of transpiling one file"""
+    input_file: Path
+    output_file: Optional[Path]
+    stats: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+    output: Optional[str] = None  # Transpiled text, only kept for dry runs
+
+
+def collect_inputs(patterns: Iterable[str]) -> List[Path]:
+    """
+    Expand command line arguments into input files.
+
+    Files are taken as-is, directories contribute every .dmd file below
+    them, and anything else is treated as a glob. Duplicates are dropped
+    and the first-seen order is kept. Raises FileNotFoundError naming the
+    arguments that are neither a file or directory nor match any file.
+    """
+    files: List[Path] = []
+    seen = set()
+    unmatched = []
+
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = sorted(path.rglob('*.dmd'))
+        elif path.exists():
+            matches = [path]
+        else:
+            matches = sorted(Path(p) for p in glob.glob(pattern, recursive=True))
+            if not matches:
+                unmatched.append(pattern)
+
+        for match in matches:
+            key = match.resolve()
+            if key not in seen:
+                seen.add(key)
+                files.append(match)
+
+    if unmatched:
+        raise FileNotFoundError(f"No such file or no match: {', '.join(unmatched)}")
+    return files
+
+
+def default_output(input_file: Path) -> Path:
+    """Replace .dmd with .md, or add .transpiled.md"""
+    if input_file.suffix == '.dmd':
+        return input_file.with_suffix('.md')
+    return input_file.with_suffix('.transpiled.md')
+
+
+def transpile_one(input_file: Path, output_file: Optional[Path], stream: bool = False,
+                  cache_dir: Optional[Path] = None, target: str = 'markdown') -> FileResult:
+    """
+    Transpile a single file, capturing errors instead of raising.
+
+    With no output file the transpiled text is returned in the result.
+    Files are looked up in the cache at `cache_dir` if one is given;
+    streamed files are never cached.
+    """
+    cache = TranspileCache(cache_dir) if cache_dir is not None else None
+    transpiler = DMDTranspiler(cache=cache, target=target)
+    result = FileResult(input_file=input_file, output_file=output_file)
+
+    try:
+        if stream and output_file:
+            with open(input_file, encoding='utf-8') as reader, \
+                    open(output_file, 'w', encoding='utf-8') as writer:
+                transpiler.transpile_stream(reader, writer)
+        else:
+            text = transpiler.transpile_file(input_file, output_file)
+            if output_file is None:
+                result.output = text
+        result.stats = dict(transpiler.stats)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+    return result
+
+
+def transpile_many(jobs: List[Tuple[Path, Optional[Path]]], workers: Optional[int] = None,
+                   stream: bool = False, cache_dir: Optional[Path] = None,
+                   target: str = 'markdown') -> List[FileResult]:
+    """
+    Transpile (input, output) pairs, in parallel when more than one worker is used.
+
+    Results are returned in the order of `jobs`. `workers` defaults to the
+    number of CPUs.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    if workers == 1:
+        return [transpile_one(src, dst, stream, cache_dir, target) for src, dst in jobs]
+
+    inputs = [src for src, _ in jobs]
+    outputs = [dst for _, dst in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(transpile_one, inputs, outputs,
+                                 [stream] * len(jobs), [cache_dir] * len(jobs), [target] * len(jobs)))
@@ -0,0 +1,254 @@
+"""
+DMD Bibliography Filtering
+
+Collects citation keys straight from markdown/DMD sources and copies the
+cited entries of a BibTeX database into a smaller file, reading the
+database once as a stream. Entries are delimited by matching braces, so
+nested braces, '@' inside field values and entries that do not end in
+"}\\n" are all handled.
+"""
+
+import mmap
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator, List, Optional, Set
+
+from .parser import DMDParser
+
+if TYPE_CHECKING:
+    from .bibindex import BibIndex
+
+
+# Pandoc citation syntax: @key or @{key}, not preceded by a word character
+# (e-mail addresses). Punctuation is only allowed inside a key, so the
+# full stop in "shown by @smith2020." is not part of it.
+CITATION_PATTERN = re.compile(
+    r'(?<![\w@])-?@(?:\{(?P<braced>[^{}\s]+)\}|(?P<key>\w+(?:[:.#$%&\-+?<>~/]\w+)*))'
+)
+
+# Code is not scanned for citations
+CODE_PATTERN = re.compile(r'^(```|~~~).*?^\1[^\n]*$|`[^`\n]+`', re.MULTILINE | re.DOTALL)
+
+# pandoc-crossref and DMD references share the citation syntax
+CROSS_REF_PREFIXES = ('fig:', 'tbl:', 'eq:', 'sec:', 'lst:')
+
+# Entry types that are copied regardless of citations, since cited
+# entries may depend on them
+MACRO_TYPES = {b'string', b'preamble'}
+
+ENTRY_HEADER = re.compile(rb'@[ \t]*([A-Za-z][\w-]*)[ \t\r\n]*([{(])')
+ENTRY_KEY = re.compile(rb'@[^{(]*[{(]\s*([^\s,{}()"=]+)\s*,')
+
+
+def _braced(depth: int) -> bytes:
+    """Pattern for a {...} group with at most `depth` levels of nested braces"""
+    if depth == 0:
+        return rb'\{[^{}]*\}'
+    return rb'\{[^{}]*(?:' + _braced(depth - 1) + rb'[^{}]*)*\}'
+
+
+# A complete entry, as long as its braces nest no deeper than this;
+# anything deeper is delimited by counting braces instead
+ENTRY_PATTERN = re.compile(
+    rb'@[ \t]*([A-Za-z][\w-]*)[ \t\r\n]*(?:' + _braced(6)
+    + rb'|\([^{})]*(?:' + _braced(6) + rb'[^{})]*)*\))'
+)
+
+CHUNK_SIZE = 1 << 20
+
+
+def extract_citations(text: str) -> Set[str]:
+    """Citation keys used in a markdown/DMD document"""
+    text = CODE_PATTERN.sub('', text)
+    keys = set()
+
+    for match in CITATION_PATTERN.finditer(text):
+        key = match.group('braced') or match.group('key')
+        if key.startswith(CROSS_REF_PREFIXES):
+            continue
+        at = match.start('key') - 1
+        if match.group('key') and (DMDParser.CROSS_REF_PATTERN.match(text, at)
+                                   or DMDParser.CALLOUT_PATTERN.match(text, at)):
+            # @fig[label], @note{...}: DMD syntax, not a citation. A
+            # callout body is still scanned for the citations inside it,
+            # and @key[p. 3] is a citation with a locator.
+            continue
+        keys.add(key)
+
+    return keys
+
+
+def citations_in_file(file_path: Path) -> Set[str]:
+    return extract_citations(file_path.read_text(encoding='utf-8'))
+
+
+def collect_citations(files: List[Path], jobs: Optional[int] = None) -> Set[str]:
+    """Citation keys used across `files`, read on a process pool"""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(files)))
+
+    if jobs == 1:
+        results = [citations_in_file(f) for f in files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(citations_in_file, files))
+
+    return set().union(*results)
+
+
+@dataclass
+class BibEntry:
+    """One '@type{...}' block of a BibTeX file"""
+    kind: str             # Lowercased entry type, e.g. 'article' or 'string'
+    key: Optional[str]    # Citation key, None for @string, @preamble and @comment
+    offset: int           # Byte offset of the '@' in the file
+    text: bytes           # Raw entry, from '@' to the closing delimiter
+
+
+def iter_entries(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[BibEntry]:
+    """
+    Yield the entries of a BibTeX file opened in binary mode.
+
+    The file is read in chunks, and each entry is matched as a whole by
+    ENTRY_PATTERN. Entries cut off by the end of a chunk are completed
+    from the next one.
+    """
+    buffer = b''
+    base = 0  # File offset of buffer[0]
+    pos = 0
+    eof = False
+
+    while True:
+        at = buffer.find(b'@', pos)
+        end = None
+        if at >= 0:
+            match = ENTRY_PATTERN.match(buffer, at)
+            if match:
+                kind, end = match.group(1), match.end()
+            else:
+                header = ENTRY_HEADER.match(buffer, at)
+                if header:
+                    kind = header.group(1)
+                    end = _entry_end(buffer, header.end(), header.group(2) == b'(')
+                elif eof or len(buffer) - at > 256:
+                    # An '@' outside of any entry
+                    pos = at + 1
+                    continue
+
+        if end is None:
+            if eof:
+                return
+            # Keep the partial entry (or nothing) and read on
+            keep = at if at >= 0 else len(buffer)
+            base += keep
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[keep:] + chunk
+            pos = 0
+            continue
+
+        text = buffer[at:end]
+        pos = end
+
+        kind = kind.lower()
+        key = None
+        if kind not in MACRO_TYPES and kind != b'comment':
+            match = ENTRY_KEY.match(text)
+            if match:
+                key = match.group(1).decode('utf-8', errors='replace')
+        yield BibEntry(kind=kind.decode('ascii'), key=key, offset=base + at, text=text)
+
+
+def _entry_end(buffer: bytes, pos: int, paren: bool) -> Optional[int]:
+    """
+    End of the entry whose body starts at `pos`, by counting braces.
+
+    Returns None if the entry is not complete within `buffer`.
+    """
+    depth = 0 if paren else 1
+    for i in range(pos, len(buffer)):
+        char = buffer[i]
+        if char == 0x7B:  # {
+            depth += 1
+        elif char == 0x7D:  # }
+            depth -= 1
+            if depth == 0 and not paren:
+                return i + 1
+        elif char == 0x29 and paren and depth == 0:  # )
+            return i + 1
+    return None
+
+
+def normalize_entry(text: bytes) -> bytes:
+    """Undo URL-encoded underscores, common in some export formats"""
+    return text.replace(b'\\%5F', b'_')
+
+
+def entry_key(entry: BibEntry) -> Optional[str]:
+    """Citation key of an entry as it is cited, after normalize_entry()"""
+    if entry.key is None:
+        return None
+    return normalize_entry(entry.key.encode('utf-8')).decode('utf-8')
+
+
+def filter_bib(bib_path: Path, keys: Iterable[str], output_path: Path,
+               index: Optional['BibIndex'] = None) -> Set[str]:
+    """
+    Write the entries of `bib_path` cited by `keys` to `output_path`.
+
+    @string and @preamble entries are always kept, and entries keep their
+    order in the database. Without an index the database is scanned; with
+    one, only the cited entries are read, by offset. The output is written
+    to a temporary file and moved into place, so a failed run leaves the
+    previous file intact. Returns the keys that were found.
+    """
+    wanted = set(keys)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=output_path.parent, prefix=output_path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if index is None:
+                found = _copy_scanned(bib_path, wanted, out)
+            else:
+                found = _copy_indexed(bib_path, wanted, out, index)
+        os.replace(tmp, output_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return found
+
+
+def _copy_scanned(bib_path: Path, wanted: Set[str], out: BinaryIO) -> Set[str]:
+    found: Set[str] = set()
+    with open(bib_path, 'rb') as stream:
+        for entry in iter_entries(stream):
+            if entry.kind.encode('ascii') in MACRO_TYPES:
+                out.write(entry.text + b'\n\n')
+                continue
+
+            key = entry_key(entry)
+            if key in wanted and key not in found:
+                found.add(key)
+                out.write(normalize_entry(entry.text) + b'\n\n')
+    return found
+
+
+def _copy_indexed(bib_path: Path, wanted: Set[str], out: BinaryIO, index: 'BibIndex') -> Set[str]:
+    spans = index.lookup(bib_path, wanted)
+    macros = index.macros(bib_path)
+    if not spans and not macros:
+        return set()
+
+    with open(bib_path, 'rb') as stream, mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for offset, length, is_macro in sorted([(o, n, True) for o, n in macros]
+                                               + [(o, n, False) for o, n in spans.values()]):
+            text = data[offset:offset + length]
+            out.write((text if is_macro else normalize_entry(text)) + b'\n\n')
+    return set(spans)
@@ -0,0 +1,109 @@
+"""
+DMD Bibliography Index
+
+Persistent SQLite index of where each entry of a BibTeX database starts
+and how long it is. With it, filtering reads just the cited entries
+instead of scanning the whole database, and the set of known keys is
+available for checking citations. The index for a database is rebuilt
+when its size or mtime changes.
+"""
+
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .bib import MACRO_TYPES, entry_key, iter_entries
+
+
+class BibIndex:
+    """Key to (byte offset, length) map for BibTeX files"""
+
+    DEFAULT_PATH = Path('.dmd-cache') / 'bib.sqlite'
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            path TEXT NOT NULL,
+            key TEXT,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_key ON entries (path, key);
+    '''
+
+    # Keys per lookup query, below SQLite's bound parameter limit
+    BATCH = 500
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or self.DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(self.SCHEMA)
+
+    def refresh(self, bib_path: Path) -> bool:
+        """Re-index `bib_path` if it changed since it was indexed. Returns True if it was."""
+        source = self._key(bib_path)
+        st = bib_path.stat()
+        row = self.db.execute('SELECT size, mtime_ns FROM sources WHERE path = ?', (source,)).fetchone()
+        if row == (st.st_size, st.st_mtime_ns):
+            return False
+
+        rows = []
+        seen = set()
+        with open(bib_path, 'rb') as stream:
+            for entry in iter_entries(stream):
+                if entry.kind.encode('ascii') in MACRO_TYPES:
+                    rows.append((source, None, entry.offset, len(entry.text)))
+                    continue
+                key = entry_key(entry)
+                # The first of duplicate entries wins, as when filtering without an index
+                if key is not None and key not in seen:
+                    seen.add(key)
+                    rows.append((source, key, entry.offset, len(entry.text)))
+
+        # `st` is from before the scan, so a file edited meanwhile is re-indexed next time
+        with self.db:
+            self.db.execute('DELETE FROM entries WHERE path = ?', (source,))
+            self.db.executemany('INSERT INTO entries (path, key, offset, length) VALUES (?, ?, ?, ?)', rows)
+            self.db.execute('INSERT OR REPLACE INTO sources (path, size, mtime_ns) VALUES (?, ?, ?)',
+                            (source, st.st_size, st.st_mtime_ns))
+        return True
+
+    def lookup(self, bib_path: Path, keys: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+        """(offset, length) of each of `keys` found in `bib_path`"""
+        self.refresh(bib_path)
+        source = self._key(bib_path)
+        keys = list(keys)
+        spans = {}
+
+        for i in range(0, len(keys), self.BATCH):
+            batch = keys[i:i + self.BATCH]
+            rows = self.db.execute(
+                f'SELECT key, offset, length FROM entries WHERE path = ? AND key IN ({",".join("?" * len(batch))})',
+                [source, *batch]
+            )
+            spans.update((key, (offset, length)) for key, offset, length in rows)
+
+        return spans
+
+    def macros(self, bib_path: Path) -> List[Tuple[int, int]]:
+        """(offset, length) of the @string and @preamble entries of `bib_path`"""
+        self.refresh(bib_path)
+        return self.db.execute('SELECT offset, length FROM entries WHERE path = ? AND key IS NULL',
+                               (self._key(bib_path),)).fetchall()
+
+    def keys(self, bib_path: Path) -> List[str]:
+        """All citation keys defined in `bib_path`"""
+        self.refresh(bib_path)
+        return [key for key, in self.db.execute('SELECT key FROM entries WHERE path = ? AND key IS NOT NULL',
+                                                (self._key(bib_path),))]
+
+    def close(self):
+        self.db.close()
+
+    def _key(self, bib_path: Path) -> str:
+        return str(bib_path.resolve())
@@ -0,0 +1,747 @@
+"""
+DMD Build Orchestrator
+
+Reads dmd.yaml and turns it into a graph of build tasks: validate and
+transpile DMD sources, filter the bibliography, render the front- and
+backmatter, compile papers and compile the thesis. A task runs only when
+its command or the content of one of its inputs changed since it last
+succeeded, or an output is missing. Tasks whose inputs are ready run in
+parallel.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import __version__, trace
+from .bib import collect_citations, filter_bib
+from .bibindex import BibIndex
+from .cache import TranspileCache
+from .fscache import DirectoryCache
+from .index import ProjectIndex
+from .transpile import DMDTranspiler
+from .validator import DMDValidator
+
+
+CACHE_DIR = Path('.dmd-cache')
+FILTERED_BIB = 'filtered.bib'
+
+# Files that stand in for `structure.backmatter` items in the thesis
+BACKMATTER_FILES = {
+    'bibliography': 'config/references.md',
+    'appendix': 'appendix/appendix.md',
+}
+
+# Generated LaTeX included by the pandoc defaults, and their templates
+MATTER_TEMPLATES = {
+    'frontmatter': ('templates/frontmatter.tex', '__frontmatter.filled.tex'),
+    'backmatter': ('templates/backmatter.tex', '__backmatter.filled.tex'),
+}
+
+# Pandoc defaults that turn a conversion into a complete document. A
+# fragment is converted without them; the master document keeps them.
+STANDALONE_DEFAULTS = ('standalone', 'template', 'include-in-header', 'include-before-body',
+                       'include-after-body', 'toc', 'table-of-contents', 'lof', 'lot', 'output-file')
+
+# The DMD Lua filters, with a pattern for the markdown each one rewrites.
+# In chapters lowered to LaTeX (build.transpiler.target: latex) only
+# hand-written markdown and figures whose caption has markup are left for
+# them, so a filter is skipped when its pattern does not occur.
+LOWERED_FILTERS = {
+    'short-captions.lua': re.compile(r'short-caption='),
+    'short-captions-table.lua': re.compile(r'short-caption='),
+    'filterboxes.lua': re.compile(r'^:{3,}.*\b(?:bluebox|yellowbox|redbox|greenbox|graybox|blackbox)\b',
+                                  re.MULTILINE),
+}
+
+
+class BuildError(Exception):
+    """A build step or the configuration failed"""
+    pass
+
+
+@dataclass
+class Task:
+    """One node of the build graph"""
+    name: str
+    action: Callable[[], None]
+    inputs: List[Path] = field(default_factory=list)
+    outputs: List[Path] = field(default_factory=list)
+    signature: Any = None   # Command or options, JSON-serializable; a change makes the task stale
+    deps: Set[str] = field(default_factory=set)  # Extra dependencies besides producers of inputs
+
+
+@dataclass
+class TaskResult:
+    """Outcome of one task: 'built', 'up-to-date', 'would build', 'failed' or 'skipped'"""
+    name: str
+    status: str
+    duration: float = 0.0
+    message: Optional[str] = None
+
+
+def load_config(config_path: Path) -> dict:
+    """Read dmd.yaml. PyYAML is only needed for builds, so it is imported here."""
+    try:
+        import yaml
+    except ImportError:
+        raise BuildError("Reading dmd.yaml requires PyYAML (pip install pyyaml)")
+
+    try:
+        with open(config_path, encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    except OSError as e:
+        raise BuildError(f"Cannot read {config_path}: {e.strerror}")
+    except yaml.YAMLError as e:
+        raise BuildError(f"Invalid {config_path}: {e}")
+
+
+class BuildState:
+    """
+    Fingerprints of successfully built tasks, kept between runs.
+
+    Input files are identified by a hash of their content, which is
+    recomputed only when their size or mtime changed.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.tasks: Dict[str, str] = {}
+        self.files: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+
+        if path is not None:
+            try:
+                data = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                data = {}
+            self.tasks = data.get('tasks', {})
+            self.files = {p: tuple(v) for p, v in data.get('files', {}).items()}
+
+    def digest(self, file_path: Path) -> str:
+        """Content hash of a file, or 'missing'"""
+        key = str(file_path)
+        try:
+            st = file_path.stat()
+        except OSError:
+            return 'missing'
+
+        with self._lock:
+            known = self.files.get(key)
+        if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        # `st` is from before the read, so an edit made meanwhile is seen next time
+        with self._lock:
+            self.files[key] = (st.st_size, st.st_mtime_ns, digest.hexdigest())
+        return digest.hexdigest()
+
+    def fingerprint(self, task: Task) -> str:
+        """Hash of a task's command and the content of its inputs"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([__version__, task.signature], sort_keys=True, default=str).encode('utf-8'))
+        for input_file in task.inputs:
+            digest.update(f'\0{input_file}\0{self.digest(input_file)}'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_current(self, task: Task, fingerprint: str) -> bool:
+        return (self.tasks.get(task.name) == fingerprint
+                and all(output.exists() for output in task.outputs))
+
+    def record(self, task: Task, fingerprint: str):
+        self.tasks[task.name] = fingerprint
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'tasks': self.tasks, 'files': self.files}), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+
+def resolve_dependencies(tasks: List[Task]) -> Dict[str, Set[str]]:
+    """
+    Dependencies of each task: its explicit ones plus the producers of its inputs.
+
+    Raises BuildError on a cycle or on two tasks producing the same file.
+    """
+    producers: Dict[Path, str] = {}
+    for task in tasks:
+        for output in task.outputs:
+            if output in producers:
+                raise BuildError(f"{output} is produced by both {producers[output]} and {task.name}")
+            producers[output] = task.name
+
+    names = {task.name for task in tasks}
+    deps = {}
+    for task in tasks:
+        deps[task.name] = {d for d in task.deps if d in names}
+        deps[task.name].update(producers[i] for i in task.inputs if i in producers)
+        deps[task.name].discard(task.name)
+
+    # Kahn's algorithm, only to detect cycles
+    remaining = {name: set(d) for name, d in deps.items()}
+    while remaining:
+        ready = [name for name, d in remaining.items() if not d]
+        if not ready:
+            raise BuildError(f"Dependency cycle between: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(ready)
+
+    return deps
+
+
+def select_tasks(tasks: List[Task], targets: Iterable[str]) -> List[Task]:
+    """Tasks whose names match any of the `targets` globs, with everything they depend on"""
+    targets = list(targets)
+    if not targets:
+        return tasks
+
+    deps = resolve_dependencies(tasks)
+    stack = [t.name for t in tasks if any(fnmatch.fnmatchcase(t.name, pattern) for pattern in targets)]
+    if not stack:
+        raise BuildError(f"No task matches {', '.join(targets)}")
+
+    selected = set()
+    while stack:
+        name = stack.pop()
+        if name not in selected:
+            selected.add(name)
+            stack.extend(deps[name])
+    return [t for t in tasks if t.name in selected]
+
+
+def run_tasks(tasks: List[Task], state: BuildState, jobs: Optional[int] = None,
+              force: bool = False, dry_run: bool = False) -> List[TaskResult]:
+    """
+    Run the stale tasks of the graph, up to `jobs` at a time.
+
+    A task is started as soon as everything it depends on has finished.
+    When a task fails, the tasks depending on it are skipped, but
+    unrelated ones still run. Returns a result per task, in the order of
+    `tasks`.
+    """
+    by_name = {task.name: task for task in tasks}
+    deps = resolve_dependencies(tasks)
+    dependents = defaultdict(list)
+    for name, task_deps in deps.items():
+        for d in task_deps:
+            dependents[d].append(name)
+
+    waiting = {name: len(task_deps) for name, task_deps in deps.items()}
+    results: Dict[str, TaskResult] = {}
+    ran: Set[str] = set()  # Built, or would be built in a dry run
+
+    def execute(task: Task) -> Tuple[TaskResult, Optional[str]]:
+        started = time.monotonic()
+        try:
+            # Taken before running, so inputs changed during the run are seen next time
+            fingerprint = state.fingerprint(task)
+            # A dry run builds nothing, so what depends on a stale task is stale too
+            stale_deps = dry_run and deps[task.name] & ran
+            if not force and not stale_deps and state.is_current(task, fingerprint):
+                return TaskResult(task.name, 'up-to-date'), None
+            if dry_run:
+                return TaskResult(task.name, 'would build'), None
+            with trace.span(task.name, 'task'):
+                task.action()
+        except BuildError as e:
+            return TaskResult(task.name, 'failed', time.monotonic() - started, str(e)), None
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}"
+            return TaskResult(task.name, 'failed', time.monotonic() - started, message), None
+        return TaskResult(task.name, 'built', time.monotonic() - started), fingerprint
+
+    def skip_dependents(name: str):
+        stack = list(dependents[name])
+        while stack:
+            dependent = stack.pop()
+            if dependent not in results:
+                results[dependent] = TaskResult(dependent, 'skipped', message=f"{name} failed")
+                stack.extend(dependents[dependent])
+
+    ready = [task.name for task in tasks if waiting[task.name] == 0]
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        while ready or running:
+            for name in ready:
+                running[executor.submit(execute, by_name[name])] = name
+            ready = []
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, fingerprint = future.result()
+                results[name] = result
+
+                if result.status == 'failed':
+                    skip_dependents(name)
+                    continue
+                if result.status == 'built':
+                    state.record(by_name[name], fingerprint)
+                if result.status in ('built', 'would build'):
+                    ran.add(name)
+
+                for dependent in dependents[name]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0 and dependent not in results:
+                        ready.append(dependent)
+
+    if not dry_run:
+        state.save()
+
+    return [results[task.name] for task in tasks]
+
+
+def run_pandoc(root: Path, args: List[str], output: Path):
+    """
+    Run pandoc in `root`, writing `output` only if it succeeds.
+
+    pandoc writes to a temporary file next to the output (keeping the
+    extension, which selects the output format) that is then moved into
+    place, so a failed run leaves the previous output intact.
+    """
+    if shutil.which('pandoc') is None:
+        raise BuildError("pandoc not found (install from https://pandoc.org)")
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=output.parent, prefix=f'.{output.stem}.', suffix=output.suffix)
+    os.close(fd)
+    try:
+        result = trace.run(['pandoc', *args, '-o', tmp], cwd=root, text=True)
+        if result.returncode != 0:
+            tail = '\n'.join(result.stderr.strip().splitlines()[-10:])
+            raise BuildError(f"pandoc exited with code {result.returncode}\n{tail}")
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def pandoc_task(name: str, root: Path, args: List[str], inputs: List[str], output: str,
+                files: Optional[Dict[str, str]] = None) -> Task:
+    """
+    Task running pandoc with `args` (relative to `root`) to produce `output`.
+
+    `files` maps paths of generated inputs to their content; they are
+    written before pandoc runs.
+    """
+    files = files or {}
+
+    def action():
+        for path, text in files.items():
+            write_file(root / path, text)
+        run_pandoc(root, args, root / output)
+
+    return Task(
+        name=name,
+        action=action,
+        inputs=[root / i for i in inputs],
+        outputs=[root / output],
+        signature=['pandoc', *args, '-o', output, files],
+    )
+
+
+def lowered_task(name: str, root: Path, args: List[str], inputs: List[str], output: str,
+                 defaults: dict, defaults_path: str, sources: List[str],
+                 files: Optional[Dict[str, str]] = None) -> Task:
+    """
+    pandoc_task() for content lowered to LaTeX.
+
+    When the task runs, `defaults` is written to `defaults_path` (which
+    `args` pass to pandoc) without the LOWERED_FILTERS that have nothing
+    to rewrite in `sources`.
+    """
+    files = files or {}
+
+    def action():
+        texts = [(root / source).read_text(encoding='utf-8') for source in sources]
+        filters = [f for f in defaults.get('filters') or []
+                   if not (isinstance(f, str) and Path(f).name in LOWERED_FILTERS)
+                   or any(LOWERED_FILTERS[Path(f).name].search(text) for text in texts)]
+        write_file(root / defaults_path, defaults_text(dict(defaults, filters=filters)))
+        for path, text in files.items():
+            write_file(root / path, text)
+        run_pandoc(root, args, root / output)
+
+    return Task(
+        name=name,
+        action=action,
+        inputs=[root / i for i in inputs],
+        outputs=[root / output],
+        signature=['pandoc', *args, '-o', output, files, defaults],
+    )
+
+
+def defaults_text(defaults: dict) -> str:
+    """
+    A generated pandoc defaults file.
+
+    JSON is valid YAML, and pandoc resolves the relative paths in it
+    against the working directory, as for the file it was derived from.
+    """
+    return json.dumps(defaults, indent=2, sort_keys=True, default=str) + '\n'
+
+
+def defaults_files(root: Path, defaults: str, includes: bool = True) -> List[str]:
+    """Filters and (unless `includes` is False) included files named in a pandoc defaults file"""
+    config = load_config(root / defaults)
+    files = [f for f in config.get('filters') or [] if isinstance(f, str) and f.endswith('.lua')]
+    if includes:
+        for key in ('include-in-header', 'include-before-body', 'include-after-body'):
+            value = config.get(key) or []
+            files.extend([value] if isinstance(value, str) else value)
+    return files
+
+
+def content_files(config: dict) -> List[str]:
+    """Thesis content files in document order: parts, then backmatter"""
+    structure = config.get('structure') or {}
+    files = []
+
+    for part in structure.get('parts') or []:
+        files.extend(part.get('chapters') or [])
+        if part.get('file'):
+            files.append(part['file'])
+
+    for item in structure.get('backmatter') or []:
+        if item in BACKMATTER_FILES:
+            files.append(BACKMATTER_FILES[item])
+
+    return files
+
+
+def paper_sources(config: dict, root: Path) -> List[Tuple[str, str]]:
+    """(markdown source, pdf) of each paper written in markdown"""
+    papers = []
+    for part in (config.get('structure') or {}).get('parts') or []:
+        for paper in part.get('papers') or []:
+            pdf = paper.get('file')
+            if not pdf:
+                continue
+            source = paper.get('source') or str(Path(pdf).with_suffix('.md'))
+            if source != pdf and ((root / source).exists() or (root / source).with_suffix('.dmd').exists()):
+                papers.append((source, pdf))
+    return papers
+
+
+def plan_build(config: dict, root: Path, tex: bool = False, fragments: Optional[bool] = None) -> List[Task]:
+    """
+    Build graph for the project described by a parsed dmd.yaml.
+
+    With `fragments` (default: `build.fragments`), each content file is
+    converted to its own LaTeX fragment and the thesis is assembled from
+    them; see plan_fragments().
+    """
+    build = config.get('build') or {}
+    transpiler = build.get('transpiler') or {}
+    validation = config.get('validation') or {}
+
+    defaults = build.get('pandoc_defaults', 'config/config.yaml')
+    paper_defaults = build.get('paper_defaults', 'config/config_paper.yaml')
+    csl = build.get('csl', 'config/acl.csl')
+    bibliography = build.get('bibliography', 'references.bib')
+    meta = build.get('metadata', 'meta.yaml')
+    output = build.get('output', 'thesis.pdf')
+    if tex:
+        output = str(Path(output).with_suffix('.tex'))
+
+    content = content_files(config)
+    papers = paper_sources(config, root)
+    markdown = content + [source for source, _ in papers]
+    tasks = []
+
+    # DMD sources: validate them all first, then transpile each
+    dmd_sources = [f for f in markdown if Path(f).suffix == '.md' and (root / f).with_suffix('.dmd').exists()]
+    if not transpiler.get('enabled', True):
+        dmd_sources = []
+
+    if dmd_sources and transpiler.get('validate_before_build', True):
+        strict = transpiler.get('strict', False)
+        sources = [(root / f).with_suffix('.dmd') for f in dmd_sources]
+        tasks.append(Task(
+            name='validate',
+            action=lambda: validate(root, sources, strict),
+            inputs=sources,
+            signature={'strict': strict},
+        ))
+
+    # Papers are compiled without the thesis preamble, so only chapters are lowered to LaTeX
+    lowered = transpiler.get('target', 'markdown')
+    chapters = set(content)
+    tasks.extend(transpile_task(root, f, deps={'validate'}, to=lowered if f in chapters else 'markdown')
+                 for f in dmd_sources)
+
+    if validation.get('check_files_exist', True):
+        produced = set(dmd_sources)
+        missing = [f for f in content if f not in produced and not (root / f).exists()]
+        if missing:
+            raise BuildError(f"Content files not found: {', '.join(missing)}")
+
+    tasks.append(Task(
+        name='bib',
+        action=lambda: filter_bibliography(root, [root / f for f in markdown], root / bibliography),
+        inputs=[root / f for f in markdown] + [root / bibliography],
+        outputs=[root / FILTERED_BIB],
+    ))
+
+    for name, (template, filled) in MATTER_TEMPLATES.items():
+        tasks.append(pandoc_task(name, root, ['--wrap=preserve', f'--template={template}', meta],
+                                 [meta, template], filled))
+
+    paper_pdfs = []
+    paper_extra = defaults_files(root, paper_defaults) if papers else []
+    for source, pdf in papers:
+        tasks.append(paper_task(root, source, pdf, FILTERED_BIB, paper_defaults, csl, paper_extra))
+        paper_pdfs.append(pdf)
+
+    if validation.get('check_paper_pdfs', True):
+        built = set(paper_pdfs)
+        missing = [paper['file'] for part in (config.get('structure') or {}).get('parts') or []
+                   for paper in part.get('papers') or []
+                   if paper.get('file') and paper['file'] not in built and not (root / paper['file']).exists()]
+        if missing:
+            raise BuildError(f"Paper PDFs not found: {', '.join(missing)}")
+
+    if fragments is None:
+        fragments = build.get('fragments', False)
+    if fragments:
+        tasks.extend(plan_fragments(root, content, meta, defaults, csl, output, paper_pdfs, tex,
+                                    lowered == 'latex'))
+        return tasks
+
+    inputs = content + [meta, FILTERED_BIB, csl, defaults] + defaults_files(root, defaults) + paper_pdfs
+    thesis_defaults = str(CACHE_DIR / 'latex' / 'defaults.yaml') if lowered == 'latex' else defaults
+    args = [f'--bibliography={FILTERED_BIB}', f'--csl={csl}', f'--defaults={thesis_defaults}', *content, meta]
+    if lowered == 'latex':
+        tasks.append(lowered_task('thesis', root, args, inputs, output, load_config(root / defaults),
+                                  thesis_defaults, content))
+    else:
+        tasks.append(pandoc_task('thesis', root, args, inputs, output))
+
+    return tasks
+
+
+def plan_fragments(root: Path, content: List[str], meta: str, defaults: str, csl: str,
+                   output: str, paper_pdfs: List[str], tex: bool, lowered: bool = False) -> List[Task]:
+    """
+    Tasks converting each content file to a LaTeX fragment, then assembling them.
+
+    A fragment only depends on its source, the filtered bibliography, the
+    citation style, the defaults file and its filters, so editing one
+    chapter reconverts just that chapter. Citations are rendered in every
+    fragment with the bibliography suppressed, and the whole bibliography
+    is placed in the references file's fragment. Cross-references are
+    LaTeX labels, resolved when the assembled document is compiled.
+
+    Fragments are converted with a copy of the defaults file without the
+    STANDALONE_DEFAULTS, so that only the master document has a preamble,
+    title matter and table of contents. For chapters lowered to LaTeX,
+    each fragment gets its own copy, without the Lua filters that have
+    nothing to rewrite in that chapter.
+    """
+    fragment_dir = CACHE_DIR / 'fragments'
+    filters = defaults_files(root, defaults, includes=False)
+    references = BACKMATTER_FILES['bibliography']
+    nocite = str(fragment_dir / 'nocite.yaml')
+    body_defaults = {key: value for key, value in load_config(root / defaults).items()
+                     if key not in STANDALONE_DEFAULTS}
+    tasks = []
+
+    fragment_paths = []
+    for f in content:
+        fragment = str(fragment_dir / (str(Path(f).with_suffix('')).replace('/', '-') + '.tex'))
+        fragment_paths.append(fragment)
+        fragment_defaults = str(Path(fragment).with_suffix('.defaults.yaml') if lowered else fragment_dir / 'defaults.yaml')
+
+        args = [f'--defaults={fragment_defaults}', f'--bibliography={FILTERED_BIB}', f'--csl={csl}', '--to=latex']
+        files = {}
+        if f == references:
+            # filtered.bib holds exactly the entries cited anywhere in the thesis
+            args.append(f'--metadata-file={nocite}')
+            files[nocite] = 'nocite: "@*"\n'
+        else:
+            args.append('--metadata=suppress-bibliography')
+        args.append(f)
+
+        inputs = [f, FILTERED_BIB, csl, defaults] + filters
+        if lowered:
+            tasks.append(lowered_task(f'fragment:{f}', root, args, inputs, fragment, body_defaults,
+                                      fragment_defaults, [f], files))
+        else:
+            files[fragment_defaults] = defaults_text(body_defaults)
+            tasks.append(pandoc_task(f'fragment:{f}', root, args, inputs, fragment, files))
+
+    # The master document is the template around \input commands, so it
+    # does not change when a fragment does
+    master_md = fragment_dir / 'master.md'
+    master_tex = output if tex else str(CACHE_DIR / 'latex' / (Path(output).stem + '.tex'))
+    body = ''.join(f'```{{=latex}}\n\\input{{{path}}}\n```\n\n' for path in fragment_paths)
+    # Variables pandoc would set from the content of a single-pass build
+    args = [f'--defaults={defaults}', '--standalone', '--variable=graphics', '--variable=tables',
+            '--variable=csl-refs', '--variable=strikeout', str(master_md), meta]
+    tasks.append(pandoc_task('thesis' if tex else 'master', root, args,
+                             [meta, defaults] + defaults_files(root, defaults), master_tex,
+                             {str(master_md): body}))
+
+    if not tex:
+        engine = load_config(root / defaults).get('pdf-engine', 'xelatex')
+        tasks.append(Task(
+            name='thesis',
+            action=lambda: run_latex(root, engine, master_tex, output),
+            inputs=[root / master_tex] + [root / f for f in fragment_paths] + [root / p for p in paper_pdfs],
+            outputs=[root / output],
+            signature=[engine, master_tex],
+        ))
+
+    return tasks
+
+
+def write_file(path: Path, text: str):
+    """
+    Write `text` to `path` unless it already has exactly that content.
+
+    The file is replaced atomically, since tasks running in parallel may
+    share it (the fragments' defaults file) and must never read it half
+    written.
+    """
+    try:
+        if path.read_text(encoding='utf-8') == text:
+            return
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def run_latex(root: Path, engine: str, tex: str, output: str, max_runs: int = 3):
+    """
+    Compile `tex` in `root` (so relative paths in fragments resolve) to `output`.
+
+    Like pandoc, the engine is rerun while LaTeX asks for it, up to
+    `max_runs` times. Auxiliary files stay next to `tex`, and `output` is
+    only replaced on success.
+    """
+    if shutil.which(engine) is None:
+        raise BuildError(f"{engine} not found")
+
+    tex_path = root / tex
+    for _ in range(max_runs):
+        result = trace.run(
+            [engine, '-interaction=nonstopmode', '-halt-on-error', f'-output-directory={tex_path.parent}', tex],
+            cwd=root, text=True, errors='replace'
+        )
+        log_path = tex_path.with_suffix('.log')
+        log = log_path.read_text(encoding='utf-8', errors='replace') if log_path.exists() else result.stdout
+        if result.returncode != 0:
+            errors = [line for line in log.splitlines() if line.startswith('!')] or log.splitlines()[-10:]
+            raise BuildError(f"{engine} exited with code {result.returncode}\n" + '\n'.join(errors[:10]))
+        if 'Rerun to get' not in log and 'Rerun LaTeX' not in log:
+            break
+
+    (root / output).parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tex_path.with_suffix('.pdf'), root / output)
+
+
+def plan_papers(root: Path, sources: List[str], bibliography: Optional[str] = None,
+                defaults: str = 'config/config_paper.yaml', csl: str = 'config/acl.csl') -> List[Task]:
+    """
+    Build graph compiling each paper source to a PDF next to it, without dmd.yaml.
+
+    `.dmd` sources are transpiled first. The bibliography defaults to
+    filtered.bib if it exists, else references.bib.
+    """
+    if bibliography is None:
+        bibliography = FILTERED_BIB if (root / FILTERED_BIB).exists() else 'references.bib'
+    extra = defaults_files(root, defaults)
+
+    tasks = []
+    for source in sources:
+        if Path(source).suffix == '.dmd':
+            source = str(Path(source).with_suffix('.md'))
+            tasks.append(transpile_task(root, source))
+        pdf = str(Path(source).with_suffix('.pdf'))
+        tasks.append(paper_task(root, source, pdf, bibliography, defaults, csl, extra))
+    return tasks
+
+
+def transpile_task(root: Path, target: str, deps: Optional[Set[str]] = None, to: str = 'markdown') -> Task:
+    """Task transpiling the .dmd file next to `target` into it, for the given transpiler target"""
+    source = (root / target).with_suffix('.dmd')
+    try:
+        options = DMDTranspiler(target=to).cache_options()
+    except ValueError as e:
+        raise BuildError(str(e))
+    return Task(
+        name=f'transpile:{target}',
+        action=lambda: transpile(root, source, root / target, to),
+        inputs=[source],
+        outputs=[root / target],
+        signature=options,
+        deps=deps or set(),
+    )
+
+
+def paper_task(root: Path, source: str, pdf: str, bibliography: str, defaults: str, csl: str,
+               extra: Optional[List[str]] = None) -> Task:
+    """Task compiling one paper like scripts/papers.sh does"""
+    args = [f'--bibliography={bibliography}', f'--defaults={defaults}', f'--csl={csl}',
+            source, '--top-level-division=chapter']
+    if extra is None:
+        extra = defaults_files(root, defaults)
+    inputs = [source, bibliography, defaults, csl] + extra
+    return pandoc_task(f'paper:{Path(source).stem}', root, args, inputs, pdf)
+
+
+def validate(root: Path, sources: List[Path], strict: bool):
+    """Validate DMD sources, raising BuildError with the first problems found"""
+    validator = DMDValidator(root, strict=strict,
+                             index=ProjectIndex(root / CACHE_DIR / 'index.sqlite'),
+                             fs_cache=DirectoryCache(root / CACHE_DIR / 'dirs.json'))
+    validator.validate_all(sources, jobs=1)
+
+    problems = validator.errors + (validator.warnings if strict else [])
+    if problems:
+        lines = [f"{os.path.relpath(p.file, root)}:{p.line}:{p.column or 0}: {p.message}" for p in problems[:10]]
+        if len(problems) > 10:
+            lines.append(f"... and {len(problems) - 10} more")
+        raise BuildError("Validation failed\n" + '\n'.join(lines))
+
+
+def transpile(root: Path, source: Path, target: Path, to: str = 'markdown'):
+    transpiler = DMDTranspiler(cache=TranspileCache(root / TranspileCache.DEFAULT_DIR), target=to)
+    transpiler.transpile_file(source, target)
+
+
+def filter_bibliography(root: Path, sources: List[Path], bibliography: Path):
+    keys = collect_citations([s for s in sources if s.exists()], jobs=1)
+    index = BibIndex(root / CACHE_DIR / 'bib.sqlite')
+    try:
+        filter_bib(bibliography, keys, root / FILTERED_BIB, index=index)
+    finally:
+        index.close()
@@ -0,0 +1,152 @@
+"""
+DMD Transpile Cache
+
+On-disk cache of transpiled output, keyed by a hash of the source content,
+the DMD version and the transpiler options. On a hit the transpile is
+skipped, and an output file that is still exactly as it was written is
+left untouched, so its mtime does not trigger downstream rebuilds.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from . import __version__
+
+
+@dataclass
+class CacheEntry:
+    """Cached transpile result"""
+    key: str
+    text: str
+    stats: Dict[str, int]
+    # Output files written from this entry: resolved path -> (size, mtime_ns)
+    outputs: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+
+
+class TranspileCache:
+    """Content-addressed cache of transpiled files with size-bounded eviction"""
+
+    DEFAULT_DIR = Path('.dmd-cache') / 'transpile'
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, cache_dir: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or self.DEFAULT_DIR
+        self.max_bytes = max_bytes
+
+    def key(self, content: str, options: Optional[Dict] = None) -> str:
+        """Cache key for source content transpiled with the given options"""
+        digest = hashlib.sha256()
+        digest.update(__version__.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(json.dumps(options or {}, sort_keys=True).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(content.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Look up an entry, marking it as recently used"""
+        path = self._path(key)
+        try:
+            data = json.loads(path.read_text(encoding='utf-8'))
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return CacheEntry(
+            key=key,
+            text=data['text'],
+            stats=data['stats'],
+            outputs={k: tuple(v) for k, v in data.get('outputs', {}).items()},
+        )
+
+    def put(self, key: str, text: str, stats: Dict[str, int],
+            output_file: Optional[Path] = None) -> CacheEntry:
+        """Store a transpile result, recording the output file it was written to"""
+        entry = CacheEntry(key=key, text=text, stats=dict(stats))
+        if output_file is not None:
+            self._record(entry, output_file)
+        self._write(entry)
+        self.evict()
+        return entry
+
+    def is_current(self, entry: CacheEntry, output_file: Path) -> bool:
+        """Check that `output_file` is unchanged since it was written from `entry`"""
+        recorded = entry.outputs.get(str(output_file.resolve()))
+        if recorded is None:
+            return False
+        try:
+            st = output_file.stat()
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == recorded
+
+    def restore(self, entry: CacheEntry, output_file: Path) -> bool:
+        """
+        Make `output_file` hold the entry's text.
+
+        Returns False (and leaves the file alone) if it is already current.
+        """
+        if self.is_current(entry, output_file):
+            return False
+
+        output_file.write_text(entry.text, encoding='utf-8')
+        self._record(entry, output_file)
+        self._write(entry)
+        return True
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob('*/*.json'):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove every entry"""
+        for path in self.cache_dir.glob('*/*.json'):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.json'
+
+    def _record(self, entry: CacheEntry, output_file: Path):
+        st = output_file.stat()
+        entry.outputs[str(output_file.resolve())] = (st.st_size, st.st_mtime_ns)
+
+    def _write(self, entry: CacheEntry):
+        """Write an entry atomically, so parallel workers never see partial files"""
+        path = self._path(entry.key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {'text': entry.text, 'stats': entry.stats, 'outputs': entry.outputs}
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
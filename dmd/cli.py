@@ -0,0 +1,238 @@
+"""
+DMD Command Line Interface
+
+`dmd <command>` entry point for project-level tasks. Transpiling single
+files is handled by scripts/dmd-transpile.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from . import trace
+from .batch import collect_inputs
+from .bib import collect_citations, entry_key, filter_bib, iter_entries
+from .bibindex import BibIndex
+from .build import (CACHE_DIR, BuildError, BuildState, load_config, plan_build, plan_papers,
+                    run_tasks, select_tasks)
+from .suggest import SuggestionIndex
+from .watch import WatchSession, watch_project
+
+
+def cmd_bib(args) -> int:
+    """Write the cited entries of the bibliography to a filtered copy"""
+    try:
+        sources = collect_inputs(args.sources)
+    except FileNotFoundError as e:
+        print(f"✗ Error: {e}", file=sys.stderr)
+        return 1
+    if not sources:
+        print("✗ Error: no source files found", file=sys.stderr)
+        return 1
+    if not args.bib.exists():
+        print(f"✗ Error: bibliography not found: {args.bib}", file=sys.stderr)
+        return 1
+
+    index = None if args.no_cache else BibIndex()
+    keys = collect_citations(sources, jobs=args.jobs)
+    found = filter_bib(args.bib, keys, args.output, index=index)
+
+    print(f"✓ {len(found)} of {len(keys)} cited entries written to {args.output}")
+
+    missing = sorted(keys - found)
+    if missing:
+        if index is not None:
+            known = index.keys(args.bib)
+        else:
+            with open(args.bib, 'rb') as stream:
+                known = [entry_key(e) for e in iter_entries(stream) if e.key is not None]
+        suggester = SuggestionIndex(known)
+
+        for key in missing:
+            print(f"⚠ Citation not found in {args.bib}: @{key}", file=sys.stderr)
+            similar = suggester.suggest(key, n=3, cutoff=0.6)
+            if similar:
+                print(f"  = help: Did you mean: {', '.join('@' + s for s in similar)}?", file=sys.stderr)
+
+    if index is not None:
+        index.close()
+    return 1 if missing and args.strict else 0
+
+
+def cmd_build(args) -> int:
+    """Run the stale tasks of the dmd.yaml build graph"""
+    root = args.config.resolve().parent
+    try:
+        tasks = plan_build(load_config(args.config), root, tex=args.tex, fragments=args.fragments or None)
+        tasks = select_tasks(tasks, args.targets)
+    except BuildError as e:
+        print(f"✗ Error: {e}", file=sys.stderr)
+        return 1
+
+    state = BuildState(root / CACHE_DIR / 'build.json')
+    results = run_tasks(tasks, state, jobs=args.jobs, force=args.force, dry_run=args.dry_run)
+    return report_results(results, args)
+
+
+def cmd_papers(args) -> int:
+    """Compile papers to PDF, rebuilding only those whose inputs changed"""
+    root = Path.cwd()
+    try:
+        sources = [str(p) for p in collect_inputs(args.sources)]
+    except FileNotFoundError as e:
+        print(f"✗ Error: {e}", file=sys.stderr)
+        return 1
+    if not sources:
+        print("✗ Error: no paper sources found", file=sys.stderr)
+        return 1
+
+    try:
+        tasks = plan_papers(root, sources, bibliography=args.bib, defaults=args.defaults, csl=args.csl)
+    except BuildError as e:
+        print(f"✗ Error: {e}", file=sys.stderr)
+        return 1
+
+    state = BuildState(root / CACHE_DIR / 'build.json')
+    results = run_tasks(tasks, state, jobs=args.jobs, force=args.force, dry_run=args.dry_run)
+    return report_results(results, args)
+
+
+def cmd_watch(args) -> int:
+    """Rebuild what changed whenever a source is saved, until interrupted"""
+    session = WatchSession(args.config, targets=args.targets, jobs=args.jobs, fragments=args.fragments or None)
+    try:
+        session.load()
+    except BuildError as e:
+        print(f"✗ Error: {e}", file=sys.stderr)
+        return 1
+
+    settings = session.config.get('watch') or {}
+    debounce_ms = args.debounce if args.debounce is not None else settings.get('debounce_ms', 1000)
+
+    def on_cycle(validator, results):
+        if results:
+            report_results(results, args)
+        elif validator is not None:
+            validator.print_report(verbose=args.verbose)
+        print("Watching for changes (Ctrl+C to stop)")
+
+    def on_error(error):
+        print(f"✗ Error: {error}", file=sys.stderr)
+
+    try:
+        watch_project(session, on_cycle, on_error, debounce_ms=debounce_ms, poll_ms=args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def report_results(results, args) -> int:
+    """Print one line per task result and a summary; returns the exit status"""
+    for result in results:
+        if result.status == 'built':
+            print(f"✓ {result.name} ({result.duration:.1f}s)")
+        elif result.status == 'would build':
+            print(f"• {result.name} would be built")
+        elif result.status == 'up-to-date':
+            if args.verbose:
+                print(f"  {result.name} is up to date")
+        elif result.status == 'skipped':
+            print(f"- {result.name} skipped ({result.message})", file=sys.stderr)
+        else:
+            print(f"✗ {result.name} failed: {result.message}", file=sys.stderr)
+
+    counts = {status: sum(result.status == status for result in results)
+              for status in ('built', 'up-to-date', 'skipped', 'failed')}
+    if not args.dry_run:
+        print(f"{counts['built']} built, {counts['up-to-date']} up to date, "
+              f"{counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts['failed'] else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='dmd', description='DMD project tools')
+    parser.add_argument('--trace', type=Path, metavar='FILE',
+                        help='Write the time, CPU and peak memory of each stage and external tool '
+                             'as a Chrome trace (view in chrome://tracing or ui.perfetto.dev)')
+    parser.add_argument('--profile', type=Path, metavar='FILE', help='Write cProfile statistics of the command')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    bib = commands.add_parser('bib', help='Filter the bibliography down to cited entries',
+                              description='Filter the bibliography down to cited entries')
+    bib.add_argument('sources', nargs='+', metavar='source',
+                     help='Markdown or DMD files (or globs) to collect citations from')
+    bib.add_argument('--bib', type=Path, default=Path('references.bib'),
+                     help='BibTeX database (default: references.bib)')
+    bib.add_argument('--output', '-o', type=Path, default=Path('filtered.bib'),
+                     help='Filtered output (default: filtered.bib)')
+    bib.add_argument('--jobs', '-j', type=int, default=None,
+                     help='Number of source files to read in parallel (default: CPU count)')
+    bib.add_argument('--strict', action='store_true', help='Exit with an error if a citation is not found')
+    bib.add_argument('--no-cache', action='store_true',
+                     help='Scan the whole bibliography instead of using the key index')
+    bib.set_defaults(func=cmd_bib)
+
+    build = commands.add_parser('build', help='Build what changed, as described by dmd.yaml',
+                                description='Build what changed, as described by dmd.yaml')
+    build.add_argument('targets', nargs='*', metavar='target',
+                       help="Tasks to build with what they depend on, as globs "
+                            "(e.g. 'paper:*'; default: everything)")
+    build.add_argument('--config', '-c', type=Path, default=Path('dmd.yaml'),
+                       help='Project configuration (default: dmd.yaml)')
+    build.add_argument('--jobs', '-j', type=int, default=None,
+                       help='Number of tasks to run in parallel (default: CPU count)')
+    build.add_argument('--force', action='store_true', help='Run every task, even if up to date')
+    build.add_argument('--dry-run', action='store_true', help='Only show which tasks would run')
+    build.add_argument('--tex', action='store_true', help='Generate the thesis as LaTeX instead of PDF')
+    build.add_argument('--fragments', action='store_true',
+                       help='Convert each chapter to a cached LaTeX fragment and assemble them '
+                            '(default: build.fragments in dmd.yaml)')
+    build.add_argument('--verbose', '-v', action='store_true', help='Also list up-to-date tasks')
+    build.set_defaults(func=cmd_build)
+
+    papers = commands.add_parser('papers', help='Compile papers to PDF, in parallel',
+                                 description='Compile papers to PDF next to their sources, rebuilding '
+                                             'only those whose source, bibliography or configuration changed. '
+                                             'A failed paper keeps its previous PDF.')
+    papers.add_argument('sources', nargs='*', metavar='source', default=['papers/*.md'],
+                        help='Paper .md or .dmd files or globs (default: papers/*.md)')
+    papers.add_argument('--bib', default=None,
+                        help='Bibliography (default: filtered.bib if it exists, else references.bib)')
+    papers.add_argument('--defaults', default='config/config_paper.yaml',
+                        help='Pandoc defaults file (default: config/config_paper.yaml)')
+    papers.add_argument('--csl', default='config/acl.csl', help='Citation style (default: config/acl.csl)')
+    papers.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Number of papers to compile in parallel (default: CPU count)')
+    papers.add_argument('--force', action='store_true', help='Recompile every paper')
+    papers.add_argument('--dry-run', action='store_true', help='Only show which papers would be compiled')
+    papers.add_argument('--verbose', '-v', action='store_true', help='Also list up-to-date papers')
+    papers.set_defaults(func=cmd_papers)
+
+    watch = commands.add_parser('watch', help='Rebuild what changed whenever a source is saved',
+                                description='Validate and rebuild the dmd.yaml project whenever a chapter, '
+                                            'paper, image or configuration file changes. Only changed DMD '
+                                            'files are parsed again; the build is skipped while validation fails.')
+    watch.add_argument('targets', nargs='*', metavar='target',
+                       help="Tasks to keep up to date, as globs (default: everything)")
+    watch.add_argument('--config', '-c', type=Path, default=Path('dmd.yaml'),
+                       help='Project configuration (default: dmd.yaml)')
+    watch.add_argument('--jobs', '-j', type=int, default=None,
+                       help='Number of tasks to run in parallel (default: CPU count)')
+    watch.add_argument('--fragments', action='store_true',
+                       help='Build the thesis from cached chapter fragments (default: build.fragments in dmd.yaml)')
+    watch.add_argument('--debounce', type=int, default=None, metavar='MS',
+                       help='Wait this long after the last change before building '
+                            '(default: watch.debounce_ms in dmd.yaml, or 1000)')
+    watch.add_argument('--interval', type=int, default=250, metavar='MS',
+                       help='How often to look for changes (default: 250)')
+    watch.add_argument('--verbose', '-v', action='store_true', help='Also list up-to-date tasks and warnings')
+    watch.set_defaults(func=cmd_watch, dry_run=False)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return trace.instrumented(lambda: args.func(args), trace_path=args.trace, profile_path=args.profile)
@@ -0,0 +1,73 @@
+"""
+DMD Filesystem Cache
+
+Answers file existence checks from directory listings, so validating many
+figures costs one listing per image directory instead of one stat per
+figure. Listings can be persisted between runs and are then reused for as
+long as the directory's mtime is unchanged.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional, Tuple
+
+
+class DirectoryCache:
+    """In-memory directory listings, optionally persisted to a JSON file"""
+
+    DEFAULT_PATH = Path('.dmd-cache') / 'dirs.json'
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._listings: Dict[str, FrozenSet[str]] = {}
+        self._stored: Dict[str, Tuple[int, FrozenSet[str]]] = {}
+        self._dirty = False
+
+        if path is not None:
+            try:
+                data = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                data = {}
+            self._stored = {d: (mtime, frozenset(names)) for d, (mtime, names) in data.items()}
+
+    def exists(self, path: Path) -> bool:
+        """Check whether `path` exists, listing its directory on first use"""
+        directory, name = os.path.split(os.path.normpath(path))
+        return name in self._listing(directory or '.')
+
+    def _listing(self, directory: str) -> FrozenSet[str]:
+        names = self._listings.get(directory)
+        if names is not None:
+            return names
+
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            names = frozenset()
+        else:
+            stored = self._stored.get(directory)
+            if stored is not None and stored[0] == mtime:
+                names = stored[1]
+            else:
+                try:
+                    names = frozenset(os.listdir(directory))
+                except OSError:
+                    names = frozenset()
+                self._stored[directory] = (mtime, names)
+                self._dirty = True
+
+        self._listings[directory] = names
+        return names
+
+    def save(self):
+        """Write listings back to the persistent file, if there is one and anything changed"""
+        if self.path is None or not self._dirty:
+            return
+
+        data = {d: [mtime, sorted(names)] for d, (mtime, names) in self._stored.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data), encoding='utf-8')
+        os.replace(tmp, self.path)
+        self._dirty = False
@@ -0,0 +1,90 @@
+"""
+DMD Project Index
+
+Persistent SQLite index of the labels, references and images found in each
+file, keyed by a hash of the file's content. Validation only has to parse
+files whose content changed since the last run; everything else is loaded
+from the index before references are resolved.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from . import __version__
+
+
+class ProjectIndex:
+    """Content-hash keyed store of per-file scan results"""
+
+    DEFAULT_PATH = Path('.dmd-cache') / 'index.sqlite'
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            digest TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS scans (
+            digest TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or self.DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        """Hash of file content, salted with the DMD version so upgrades re-parse"""
+        return hashlib.sha256(__version__.encode('utf-8') + b'\0' + data).hexdigest()
+
+    def lookup_stat(self, file_path: Path, st: os.stat_result) -> Optional[dict]:
+        """
+        Stored scan for a file whose size and mtime are unchanged.
+
+        This answers the common case without reading the file at all.
+        """
+        row = self.db.execute(
+            'SELECT s.data FROM files f JOIN scans s ON s.digest = f.digest '
+            'WHERE f.path = ? AND f.size = ? AND f.mtime_ns = ?',
+            (self._key(file_path), st.st_size, st.st_mtime_ns)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lookup_digest(self, digest: str) -> Optional[dict]:
+        """Stored scan for content with the given digest"""
+        row = self.db.execute('SELECT data FROM scans WHERE digest = ?', (digest,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store(self, file_path: Path, st: os.stat_result, digest: str, data: Optional[dict] = None):
+        """
+        Record a file's stat and digest, and its scan if new.
+
+        `st` must be taken before the file was read, so a file modified
+        while it was being scanned is not mistaken for an indexed one.
+        """
+        if data is not None:
+            self.db.execute('INSERT OR REPLACE INTO scans (digest, data) VALUES (?, ?)',
+                            (digest, json.dumps(data)))
+        self.db.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                        (self._key(file_path), st.st_size, st.st_mtime_ns, digest))
+
+    def commit(self):
+        """Drop scans no file refers to any more and persist changes"""
+        self.db.execute('DELETE FROM scans WHERE digest NOT IN (SELECT digest FROM files)')
+        self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def _key(self, file_path: Path) -> str:
+        return str(file_path.resolve())
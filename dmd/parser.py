@@ -5,62 +5,163 @@ Parses enhanced inline syntax for figures, tables, cross-references, and callout
 """
 
 import re
-from dataclasses import dataclass
-from typing import Optional, Dict, List, Tuple
+from bisect import bisect_right
+from typing import Optional, Dict, Iterator, List, Match, Pattern, Tuple, Union
 
 
-@dataclass
-class FigureElement:
+class _Element:
+    """
+    An element as offsets into the source text.
+
+    Only the source (shared by every element of a document), the span and
+    the document's line index are stored; text fields are sliced from the
+    span when accessed, so a document with many elements does not hold a
+    copy of each one's text.
+    """
+
+    __slots__ = ('_source', 'start', 'end', '_line_starts')
+
+    def __init__(self, source: str, start: int, end: int, line_starts: List[int]):
+        self._source = source
+        self.start = start
+        self.end = end
+        self._line_starts = line_starts
+
+    @property
+    def original(self) -> str:
+        """The matched source text"""
+        return self._source[self.start:self.end]
+
+    @property
+    def line_number(self) -> int:
+        return bisect_right(self._line_starts, self.start)
+
+    def _match(self, pattern: Pattern) -> Match:
+        # `end` is where the original match stopped, so this reproduces its groups
+        return pattern.match(self._source, self.start, self.end)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return (self.start, self.end, self.original) == (other.start, other.end, other.original)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.original!r}, start={self.start}, end={self.end})'
+
+
+class FigureElement(_Element):
     """Parsed figure element"""
-    label: str
-    image_path: str
-    caption: str
-    attributes: Dict[str, str]
-    line_number: int
-    original: str
 
+    __slots__ = ('_groups', '_attributes')
+
+    def __init__(self, source: str, start: int, end: int, line_starts: List[int]):
+        super().__init__(source, start, end, line_starts)
+        self._groups: Optional[Tuple[Optional[str], ...]] = None
+        self._attributes: Optional[Dict[str, str]] = None
+
+    def _group(self, n: int) -> Optional[str]:
+        # Figures are rare next to references; their fields are kept once read
+        if self._groups is None:
+            self._groups = self._match(DMDParser.FIGURE_PATTERN).groups()
+        return self._groups[n - 1]
+
+    @property
+    def label(self) -> str:
+        return self._group(1)
+
+    @property
+    def image_path(self) -> str:
+        return self._group(2)
 
-@dataclass
-class TableElement:
+    @property
+    def caption(self) -> str:
+        return self._group(4).strip()
+
+    @property
+    def attributes(self) -> Dict[str, str]:
+        if self._attributes is None:
+            self._attributes = parse_attributes(self._group(3) or "")
+        return self._attributes
+
+
+class TableElement(_Element):
     """Parsed table element"""
-    label: str
-    caption: str
-    line_number: int
-    original: str
 
+    __slots__ = ()
+
+    @property
+    def label(self) -> str:
+        source = self._source
+        return source[self.start + 5:source.index(']', self.start)]
 
-@dataclass
-class CrossReference:
+    @property
+    def caption(self) -> str:
+        source = self._source
+        return source[source.index(']', self.start) + 1:self.end].strip()
+
+
+class CrossReference(_Element):
     """Parsed cross-reference"""
-    ref_type: str  # 'fig', 'tbl', 'eq', 'sec'
-    label: str
-    custom_text: Optional[str]
-    line_number: int
-    original: str
 
+    __slots__ = ()
+
+    # Labels cannot contain ']' and custom text cannot contain ')', so
+    # every field is found by looking for the delimiters
+
+    @property
+    def ref_type(self) -> str:
+        """'fig', 'tbl', 'eq' or 'sec'"""
+        source = self._source
+        return source[self.start + 1:source.index('[', self.start)]
+
+    @property
+    def label(self) -> str:
+        source = self._source
+        bracket = source.index('[', self.start)
+        return source[bracket + 1:source.index(']', bracket)]
 
-@dataclass
-class CalloutElement:
+    @property
+    def custom_text(self) -> Optional[str]:
+        source = self._source
+        if source[self.end - 1] != ')':
+            return None
+        return source[source.index(']', self.start) + 2:self.end - 1]
+
+
+class CalloutElement(_Element):
     """Parsed callout element"""
-    callout_type: str  # 'note', 'warning', 'tip', etc.
-    content: str
-    line_number: int
-    original: str
+
+    __slots__ = ()
+
+    @property
+    def callout_type(self) -> str:
+        """'note', 'warning', 'tip', etc."""
+        source = self._source
+        return source[self.start + 1:source.index('{', self.start)]
+
+    @property
+    def content(self) -> str:
+        return self._source[self.start + len(self.callout_type) + 2:self.end - 1]
+
+
+# Any parsed element, as yielded by DMDParser.tokenize()
+Element = Union[FigureElement, TableElement, CrossReference, CalloutElement]
 
 
 class DMDParser:
     """Parser for DMD enhanced syntax"""
 
     # Figure syntax: @fig[id](path.jpg){w=50% short="Short"} Caption text.
+    # Image paths cannot contain whitespace, which is what tells a figure
+    # apart from a reference with custom text: @fig[id](as shown here).
     FIGURE_PATTERN = re.compile(
-        r'@fig\[([a-zA-Z0-9_-]+)\]\(([^)]+)\)(?:\{([^}]*)\})?\s*([^\n@]+?)(?=\n|@|\Z)',
-        re.MULTILINE
+        r'@fig\[([a-zA-Z0-9_-]+)\]\(([^)\s]+)\)(?:\{([^}]*)\})?\s*([^\n@]+?)(?=\n|@|\Z)'
     )
 
     # Table syntax: @tbl[id] Caption
+    # Only at the start of a line; mid-sentence it is a reference.
     TABLE_PATTERN = re.compile(
-        r'@tbl\[([a-zA-Z0-9_-]+)\]\s+([^\n]+)',
-        re.MULTILINE
+        r'(?<![^\n])@tbl\[([a-zA-Z0-9_-]+)\][ \t]+([^\n]+)'
     )
 
     # Cross-reference: @fig[label] or @fig[label](custom text)
@@ -73,137 +174,232 @@ class DMDParser:
         r'@(note|warning|tip|error|success)\{([^}]+)\}'
     )
 
+    # All of the above as one alternation, tried in priority order at each
+    # '@', so a single scan finds every directive in the document.
+    DIRECTIVE_PATTERN = re.compile(
+        r'(?P<figure>' + FIGURE_PATTERN.pattern + r')'
+        r'|(?P<table>' + TABLE_PATTERN.pattern + r')'
+        r'|(?P<callout>' + CALLOUT_PATTERN.pattern + r')'
+        r'|(?P<cross_ref>' + CROSS_REF_PATTERN.pattern + r')'
+    )
+
+    # The literal start every alternative above shares. The alternation
+    # defeats the regex engine's literal-prefix search, so finding
+    # candidates with this first is much faster on prose with many
+    # citations or e-mail addresses.
+    DIRECTIVE_START = re.compile(r'@(?:fig|tbl|eq|sec|note|warning|tip|error|success)[\[{]')
+
+    # The start of a directive that runs off the end of the content and
+    # could still match differently once more text is appended
+    PARTIAL_PATTERN = re.compile(
+        r'@(?:[a-z]*'
+        r'|(?:fig|tbl|eq|sec)\[[a-zA-Z0-9_-]*'
+        r'|(?:fig|tbl|eq|sec)\[[a-zA-Z0-9_-]+\](?:\([^)]*)?'
+        r'|fig\[[a-zA-Z0-9_-]+\]\([^)\s]+\)(?:\{[^}]*\}?)?\s*'
+        r'|tbl\[[a-zA-Z0-9_-]+\][^\n]*'
+        r'|(?:note|warning|tip|error|success)\{[^}]*'
+        r')\Z'
+    )
+
     def __init__(self, content: str):
         self.content = content
-        self.lines = content.split('\n')
+        self._tokens: Optional[List[Element]] = None
+        self._line_starts: Optional[List[int]] = None
+
+    def _get_line_starts(self) -> List[int]:
+        """Offsets at which each line begins, built on first use"""
+        if self._line_starts is None:
+            content = self.content
+            starts = [0]
+            pos = content.find('\n')
+            while pos != -1:
+                starts.append(pos + 1)
+                pos = content.find('\n', pos + 1)
+            self._line_starts = starts
+        return self._line_starts
 
     def get_line_number(self, match_start: int) -> int:
         """Get line number for a match position"""
-        return self.content[:match_start].count('\n') + 1
+        return bisect_right(self._get_line_starts(), match_start)
+
+    def get_position(self, match_start: int) -> Tuple[int, int]:
+        """Get (line, column) for a match position, both 1-based"""
+        line = self.get_line_number(match_start)
+        return line, match_start - self._line_starts[line - 1] + 1
+
+    def get_column(self, match_start: int) -> int:
+        """Get column for a match position (1-based)"""
+        return self.get_position(match_start)[1]
+
+    def tokenize(self) -> List[Element]:
+        """
+        Scan the content once and return every element in document order.
+
+        Cross-references inside a table caption or a callout body follow
+        the table or callout itself.
+        The result is cached, so repeated calls (and the parse_* helpers)
+        share a single scan.
+        """
+        if self._tokens is None:
+            self._tokens = list(self._scan())
+        return self._tokens
+
+    def _scan(self) -> Iterator[Element]:
+        content = self.content
+        line_starts = self._get_line_starts()
+        # Each alternative of DIRECTIVE_PATTERN wraps its pattern in one
+        # named group, so the element's own groups follow that group's index.
+        index = self.DIRECTIVE_PATTERN.groupindex
+
+        for match in self._directives():
+            kind = match.lastgroup
+            start, end = match.span()
+
+            if kind == 'figure':
+                yield FigureElement(content, start, end, line_starts)
+            elif kind in ('table', 'callout'):
+                element_type = TableElement if kind == 'table' else CalloutElement
+                yield element_type(content, start, end, line_starts)
+                # References in a table caption or a callout body are still references
+                body_start, body_end = match.span(index[kind] + 2)
+                for ref in self.CROSS_REF_PATTERN.finditer(content, body_start, body_end):
+                    yield CrossReference(content, ref.start(), ref.end(), line_starts)
+            else:
+                yield CrossReference(content, start, end, line_starts)
+
+    def has_open_directive(self) -> bool:
+        """
+        Check whether a directive is still open at the end of the content.
+
+        True when appending more text could change how the content parses,
+        e.g. a callout whose closing brace has not been seen yet.
+        """
+        content = self.content
+        tokens = self.tokenize()
+        i = 0
+        pos = content.find('@')
+
+        while pos != -1:
+            # Skip '@'s inside complete elements (e.g. references in a callout)
+            while i < len(tokens) and tokens[i].end <= pos:
+                i += 1
+            if i < len(tokens) and tokens[i].start < pos:
+                pos = content.find('@', tokens[i].end)
+                continue
+            if self.PARTIAL_PATTERN.match(content, pos):
+                return True
+            pos = content.find('@', pos + 1)
+
+        return False
+
+    def _directives(self) -> Iterator[Match[str]]:
+        """DIRECTIVE_PATTERN.finditer(content), tried only where a directive can start"""
+        content = self.content
+        search = self.DIRECTIVE_START.search
+        match_at = self.DIRECTIVE_PATTERN.match
+        pos = 0
+        while True:
+            candidate = search(content, pos)
+            if candidate is None:
+                return
+            match = match_at(content, candidate.start())
+            if match:
+                yield match
+                pos = match.end()
+            else:
+                pos = candidate.start() + 1
+
+    def iter_elements(self) -> Iterator[Element]:
+        """
+        Yield every element in document order, scanning only as far as consumed.
+
+        Uses the cached scan if tokenize() already ran; otherwise nothing
+        is kept, so a single pass over a large document needs no list of
+        all its elements.
+        """
+        if self._tokens is not None:
+            return iter(self._tokens)
+        return self._scan()
+
+    def iter_figures(self) -> Iterator[FigureElement]:
+        return (e for e in self.iter_elements() if isinstance(e, FigureElement))
+
+    def iter_tables(self) -> Iterator[TableElement]:
+        return (e for e in self.iter_elements() if isinstance(e, TableElement))
+
+    def iter_cross_references(self) -> Iterator[CrossReference]:
+        return (e for e in self.iter_elements() if isinstance(e, CrossReference))
+
+    def iter_callouts(self) -> Iterator[CalloutElement]:
+        return (e for e in self.iter_elements() if isinstance(e, CalloutElement))
 
     def parse_figures(self) -> List[FigureElement]:
         """Parse all figure elements"""
-        figures = []
-        for match in self.FIGURE_PATTERN.finditer(self.content):
-            label = match.group(1)
-            image_path = match.group(2)
-            attr_str = match.group(3) or ""
-            caption = match.group(4).strip()
-
-            # Parse attributes
-            attributes = self._parse_attributes(attr_str)
-
-            figures.append(FigureElement(
-                label=label,
-                image_path=image_path,
-                caption=caption,
-                attributes=attributes,
-                line_number=self.get_line_number(match.start()),
-                original=match.group(0)
-            ))
-
-        return figures
+        self.tokenize()
+        return list(self.iter_figures())
 
     def parse_tables(self) -> List[TableElement]:
         """Parse all table elements"""
-        tables = []
-        for match in self.TABLE_PATTERN.finditer(self.content):
-            label = match.group(1)
-            caption = match.group(2).strip()
-
-            tables.append(TableElement(
-                label=label,
-                caption=caption,
-                line_number=self.get_line_number(match.start()),
-                original=match.group(0)
-            ))
-
-        return tables
+        self.tokenize()
+        return list(self.iter_tables())
 
     def parse_cross_references(self) -> List[CrossReference]:
         """Parse all cross-references"""
-        refs = []
-        for match in self.CROSS_REF_PATTERN.finditer(self.content):
-            ref_type = match.group(1)
-            label = match.group(2)
-            custom_text = match.group(3)
-
-            refs.append(CrossReference(
-                ref_type=ref_type,
-                label=label,
-                custom_text=custom_text,
-                line_number=self.get_line_number(match.start()),
-                original=match.group(0)
-            ))
-
-        return refs
+        self.tokenize()
+        return list(self.iter_cross_references())
 
     def parse_callouts(self) -> List[CalloutElement]:
         """Parse all callout elements"""
-        callouts = []
-        for match in self.CALLOUT_PATTERN.finditer(self.content):
-            callout_type = match.group(1)
-            content = match.group(2)
-
-            callouts.append(CalloutElement(
-                callout_type=callout_type,
-                content=content,
-                line_number=self.get_line_number(match.start()),
-                original=match.group(0)
-            ))
-
-        return callouts
+        self.tokenize()
+        return list(self.iter_callouts())
 
-    def _parse_attributes(self, attr_str: str) -> Dict[str, str]:
+    def has_enhanced_syntax(self) -> bool:
         """
-        Parse attribute string like 'w=50% short="Short caption"'
-        Returns dict like {'width': '50%', 'short-caption': 'Short caption'}
+        Check if content contains any DMD enhanced syntax.
+
+        Stops at the first directive, and only tries the full pattern where
+        one can start, so a plain markdown chapter costs a single fast scan.
         """
-        attributes = {}
+        if self._tokens is not None:
+            return bool(self._tokens)
+        return next(self._directives(), None) is not None
 
-        if not attr_str:
-            return attributes
 
-        # Handle quoted values: key="value with spaces"
-        quoted_pattern = r'(\w+)="([^"]*)"'
-        for match in re.finditer(quoted_pattern, attr_str):
-            key = match.group(1)
-            value = match.group(2)
-            # Normalize attribute names
+def parse_attributes(attr_str: str) -> Dict[str, str]:
+    """
+    Parse attribute string like 'w=50% short="Short caption"'
+    Returns dict like {'width': '50%', 'short-caption': 'Short caption'}
+    """
+    attributes = {}
+
+    if not attr_str:
+        return attributes
+
+    # Handle quoted values: key="value with spaces"
+    quoted_pattern = r'(\w+)="([^"]*)"'
+    for match in re.finditer(quoted_pattern, attr_str):
+        key = match.group(1)
+        value = match.group(2)
+        # Normalize attribute names
+        if key == 'w':
+            key = 'width'
+        elif key == 'h':
+            key = 'height'
+        elif key == 'short':
+            key = 'short-caption'
+        attributes[key] = value
+
+    # Handle unquoted values: key=value
+    unquoted_pattern = r'(\w+)=([^\s"]+)'
+    for match in re.finditer(unquoted_pattern, attr_str):
+        key = match.group(1)
+        value = match.group(2)
+        # Skip if already processed as quoted
+        if key not in attributes:
             if key == 'w':
                 key = 'width'
             elif key == 'h':
                 key = 'height'
-            elif key == 'short':
-                key = 'short-caption'
             attributes[key] = value
 
-        # Handle unquoted values: key=value
-        unquoted_pattern = r'(\w+)=([^\s"]+)'
-        for match in re.finditer(unquoted_pattern, attr_str):
-            key = match.group(1)
-            value = match.group(2)
-            # Skip if already processed as quoted
-            if key not in attributes:
-                if key == 'w':
-                    key = 'width'
-                elif key == 'h':
-                    key = 'height'
-                attributes[key] = value
-
-        return attributes
-
-    def has_enhanced_syntax(self) -> bool:
-        """Check if content contains any DMD enhanced syntax"""
-        patterns = [
-            self.FIGURE_PATTERN,
-            self.TABLE_PATTERN,
-            self.CROSS_REF_PATTERN,
-            self.CALLOUT_PATTERN
-        ]
-
-        for pattern in patterns:
-            if pattern.search(self.content):
-                return True
-
-        return False
+    return attributes
@@ -0,0 +1,37 @@
+"""
+DMD Rewrite Engine
+
+Applies span edits to a source string in a single pass. Edits are
+(start, end, replacement) triples in terms of offsets into the original
+content, so repeated or identical snippets never get confused with each
+other and the output is built once from a list of pieces.
+"""
+
+from typing import Iterable, List, Tuple
+
+# (start, end, replacement) - an insertion has start == end
+Edit = Tuple[int, int, str]
+
+
+def apply_edits(content: str, edits: Iterable[Edit]) -> str:
+    """
+    Return `content` with every edit applied.
+
+    Edits may arrive in any order but must not overlap. Insertions at the
+    same offset as a replacement are placed before it.
+    """
+    pieces: List[str] = []
+    pos = 0
+
+    for start, end, replacement in sorted(edits, key=lambda e: (e[0], e[1])):
+        if start < pos:
+            raise ValueError(f"Overlapping edit at offset {start}")
+        pieces.append(content[pos:start])
+        pieces.append(replacement)
+        pos = end
+
+    if not pieces:
+        return content
+
+    pieces.append(content[pos:])
+    return ''.join(pieces)
@@ -0,0 +1,60 @@
+"""
+DMD Label Suggestions
+
+"Did you mean" lookups for undefined references. A trigram index narrows
+the defined labels down to a few candidates that share text with the
+missing one, and only those are ranked with difflib, using the same
+scoring as difflib.get_close_matches. Answers are memoized, since a
+renamed label typically leaves many identical stale references behind.
+"""
+
+import heapq
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Tuple
+
+
+def trigrams(text: str) -> List[str]:
+    """Trigrams of `text`, padded so that short labels still produce some"""
+    padded = f'\0\0{text}\0'
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class SuggestionIndex:
+    """Trigram index over a set of labels"""
+
+    def __init__(self, labels: Iterable[str], max_candidates: int = 50):
+        self.labels = sorted(set(labels))
+        self.max_candidates = max_candidates
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._memo: Dict[Tuple[str, int, float], List[str]] = {}
+
+        for i, label in enumerate(self.labels):
+            for gram in set(trigrams(label)):
+                self._postings[gram].append(i)
+
+    def suggest(self, label: str, n: int = 3, cutoff: float = 0.6) -> List[str]:
+        """Up to `n` labels similar to `label`, best first"""
+        key = (label, n, cutoff)
+        if key in self._memo:
+            return self._memo[key]
+
+        shared = Counter()
+        for gram in set(trigrams(label)):
+            for i in self._postings.get(gram, ()):
+                shared[i] += 1
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(label)
+        scored = []
+        for i, _ in shared.most_common(self.max_candidates):
+            candidate = self.labels[i]
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff:
+                    scored.append((score, candidate))
+
+        result = [candidate for _, candidate in heapq.nlargest(n, scored)]
+        self._memo[key] = result
+        return result
@@ -0,0 +1,203 @@
+"""
+DMD Tracing
+
+Optional timing of the stages of a build. A span records wall time, CPU
+time and the peak resident set size of the process; external tools
+started through run() record the CPU time and peak RSS of the tool
+itself. Nothing is recorded unless tracing was turned on with enable(),
+so instrumented code only pays for a global lookup per span.
+
+Traces are written in Chrome's trace-event format, which chrome://tracing
+and https://ui.perfetto.dev display as a timeline per thread.
+"""
+
+import cProfile
+import io
+import json
+import locale
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+@dataclass
+class Span:
+    """One timed stage"""
+    name: str
+    category: str
+    start: float                    # Seconds since the tracer was created
+    duration: float
+    cpu: Optional[float] = None     # CPU seconds of this thread, or of the external tool
+    max_rss_mb: Optional[float] = None
+    thread: int = 0
+    args: Dict[str, Any] = field(default_factory=dict)
+
+
+class Tracer:
+    """Collects spans from any thread"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_chrome(self) -> Dict:
+        """The spans as a Chrome trace-event document"""
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = dict(span.args)
+            if span.cpu is not None:
+                args['cpu_ms'] = round(span.cpu * 1000, 3)
+            if span.max_rss_mb is not None:
+                args['max_rss_mb'] = round(span.max_rss_mb, 1)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round(span.start * 1e6),
+                'dur': round(span.duration * 1e6),
+                'pid': pid,
+                'tid': span.thread,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_chrome()) + '\n', encoding='utf-8')
+
+    def totals(self) -> Dict[str, float]:
+        """Wall time per category"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.category] = totals.get(span.category, 0.0) + span.duration
+        return totals
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable() -> Tracer:
+    """Start recording spans into a new tracer"""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> Optional[Tracer]:
+    """Stop recording; returns the tracer that was active"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def max_rss_mb(usage) -> float:
+    """ru_maxrss in MB; it is in kilobytes on Linux but in bytes on macOS"""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss * scale / 1e6
+
+
+@contextmanager
+def span(name: str, category: str = 'dmd', **args) -> Iterator[None]:
+    """Record the enclosed block as a span if tracing is enabled"""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        rss = max_rss_mb(resource.getrusage(resource.RUSAGE_SELF)) if resource else None
+        tracer.add(Span(name, category, start - tracer.origin, duration, time.thread_time() - cpu,
+                        rss, threading.get_ident(), args))
+
+
+def run(command: Sequence[str], name: Optional[str] = None, text: bool = False,
+        errors: Optional[str] = None, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run(command, capture_output=True, ...), traced as an external tool.
+
+    When tracing, the child is reaped with os.wait4 so that its own CPU
+    time and peak RSS are known even while other tools run in parallel
+    threads. `name` defaults to the program name.
+    """
+    tracer = _tracer
+    if tracer is None or not hasattr(os, 'wait4'):
+        with span(name or Path(command[0]).name, 'external'):
+            return subprocess.run(command, capture_output=True, text=text, errors=errors, **kwargs)
+
+    start = time.perf_counter()
+    output: Dict[str, bytes] = {}
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs) as proc:
+        # Drain both pipes, as communicate() would, so the child never blocks on a full pipe
+        readers = [threading.Thread(target=lambda s=s: output.__setitem__(s, getattr(proc, s).read()))
+                   for s in ('stdout', 'stderr')]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    tracer.add(Span(name or Path(command[0]).name, 'external', start - tracer.origin,
+                    time.perf_counter() - start, usage.ru_utime + usage.ru_stime, max_rss_mb(usage),
+                    threading.get_ident(), {'command': ' '.join(map(str, command))}))
+
+    stdout, stderr = output['stdout'], output['stderr']
+    if text or errors:
+        encoding = locale.getpreferredencoding(False)
+        stdout, stderr = (
+            data.decode(encoding, errors or 'strict').replace('\r\n', '\n').replace('\r', '\n')
+            for data in (stdout, stderr))
+    return subprocess.CompletedProcess(list(command), proc.returncode, stdout, stderr)
+
+
+def instrumented(func: Callable[[], Any], trace_path: Optional[Path] = None,
+                 profile_path: Optional[Path] = None) -> Any:
+    """
+    Call `func`, writing a trace and/or cProfile statistics if paths are given.
+
+    A short summary of both is printed to stderr. Returns what `func` returns.
+    """
+    if trace_path:
+        enable()
+    profiler = cProfile.Profile() if profile_path else None
+
+    try:
+        if profiler:
+            return profiler.runcall(func)
+        return func()
+    finally:
+        if trace_path:
+            tracer = disable()
+            tracer.write(trace_path)
+            totals = ', '.join(f"{category} {seconds:.2f}s" for category, seconds in sorted(tracer.totals().items()))
+            print(f"Trace written to {trace_path} ({totals or 'no spans'})", file=sys.stderr)
+        if profiler:
+            profile_path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(profile_path))
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+            print(summary.getvalue().rstrip(), file=sys.stderr)
+            print(f"Profile written to {profile_path} (python -m pstats {profile_path})", file=sys.stderr)
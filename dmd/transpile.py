@@ -3,11 +3,19 @@ DMD Transpiler
 
 Converts enhanced DMD syntax to standard markdown + LaTeX that can be processed
 by the existing Pandoc + Lua filter + XeLaTeX pipeline.
+
+With the `latex` target, figures, cross-references and callouts are written
+as the raw LaTeX that the Lua filters would have produced, so Pandoc passes
+them through and the filters find nothing left to rewrite.
 """
 
+import re
 from pathlib import Path
-from typing import Optional
-from .parser import DMDParser, FigureElement, TableElement, CrossReference, CalloutElement
+from typing import Dict, List, Optional, TextIO, Tuple
+from .parser import DMDParser, Element, FigureElement, TableElement, CrossReference, CalloutElement
+from . import trace
+from .cache import TranspileCache
+from .rewrite import Edit, apply_edits
 
 
 class DMDTranspiler:
@@ -29,8 +37,34 @@ class DMDTranspiler:
         'tip': 'graybox',
     }
 
-    def __init__(self, verbose: bool = False):
+    # tcolorbox options of each box style, as in latex/filters/filterboxes.lua
+    BOX_COLORS = {
+        'bluebox': ('blue!10!white', 'blue!20!white', 'black'),
+        'yellowbox': ('orange!10!white', 'orange!20!white', 'black'),
+        'redbox': ('red!10!white', 'red!20!white', 'black'),
+        'greenbox': ('green!10!white', 'green!20!white', 'black'),
+        'graybox': ('gray!10!white', 'gray!20!white', 'black'),
+        'blackbox': ('white', 'black', 'white'),
+    }
+    BOX_LAYOUT = ('boxrule=0.5mm, arc=3mm, boxsep=1mm, left=5mm, right=5mm, top=3mm, bottom=3mm, '
+                  'toptitle=1mm, bottomtitle=1mm, titlerule=0.5mm, width=\\textwidth')
+
+    # Output formats: pandoc markdown for the Lua filters, or with DMD
+    # elements already lowered to LaTeX
+    TARGETS = ('markdown', 'latex')
+
+    # Captions without markdown markup, which can be written to LaTeX as they are.
+    # Anything else keeps the markdown form, so Pandoc still renders it.
+    PLAIN_CAPTION = re.compile(r'[^\\*_`$\[\]@<>~^"{}|]*')
+    LATEX_SPECIALS = re.compile(r'([&%#])')
+
+    def __init__(self, verbose: bool = False, cache: Optional[TranspileCache] = None,
+                 target: str = 'markdown'):
+        if target not in self.TARGETS:
+            raise ValueError(f"Unknown transpile target: {target}")
         self.verbose = verbose
+        self.cache = cache
+        self.target = target
         self.stats = {
             'figures': 0,
             'tables': 0,
@@ -42,6 +76,9 @@ class DMDTranspiler:
         """
         Transpile a file from enhanced syntax to standard markdown.
 
+        With a cache, unchanged sources are not transpiled again and an
+        output file that is still as it was written is not rewritten.
+
         Args:
             input_file: Path to input .dmd or .md file
             output_file: Optional path to write output (if None, returns string)
@@ -51,70 +88,238 @@ class DMDTranspiler:
         """
         content = input_file.read_text(encoding='utf-8')
 
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(content, self.cache_options())
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.stats = dict(entry.stats)
+                if output_file and self.cache.restore(entry, output_file):
+                    if self.verbose:
+                        print(f"Restored {output_file} from cache")
+                elif self.verbose:
+                    print(f"{input_file} unchanged, skipping")
+                return entry.text
+
         # Parse the content
         parser = DMDParser(content)
 
         # Check if it has enhanced syntax - if not, pass through unchanged
-        if not parser.has_enhanced_syntax():
+        passthrough = not parser.has_enhanced_syntax()
+        if passthrough:
+            self.stats = {k: 0 for k in self.stats}
             if self.verbose:
                 print(f"No enhanced syntax found in {input_file}, passing through unchanged")
-            if output_file:
-                output_file.write_text(content, encoding='utf-8')
-            return content
-
-        # Transpile the content
-        transpiled = self.transpile_content(content)
+            transpiled = content
+        else:
+            # Transpile the content; the check above stopped at the first directive
+            transpiled = self.transpile_content(content, parser)
 
         # Write output if requested
         if output_file:
             output_file.write_text(transpiled, encoding='utf-8')
-            if self.verbose:
+            if self.verbose and not passthrough:
                 print(f"Transpiled {input_file} -> {output_file}")
                 print(f"  Figures: {self.stats['figures']}")
                 print(f"  Tables: {self.stats['tables']}")
                 print(f"  Cross-refs: {self.stats['cross_refs']}")
                 print(f"  Callouts: {self.stats['callouts']}")
 
+        if key is not None:
+            self.cache.put(key, transpiled, self.stats, output_file)
+
         return transpiled
 
-    def transpile_content(self, content: str) -> str:
+    def cache_options(self) -> Dict:
+        """Settings that affect the output, folded into the cache key"""
+        options = {'callout_styles': self.CALLOUT_STYLES}
+        if self.target != 'markdown':
+            options['target'] = self.target
+        return options
+
+    def transpile_stream(self, reader: TextIO, writer: TextIO, chunk_size: int = 1 << 16) -> None:
+        """
+        Transpile a text stream into another, a chunk of lines at a time.
+
+        The output is identical to transpile_content() on the whole input.
+        Input is buffered until at least `chunk_size` characters are
+        pending and then flushed, unless an element (or a table still
+        waiting for its last row) runs off the end of the buffer. The rows
+        of such a table are written as they arrive; only its @tbl line and
+        last row are kept until the table ends and its caption can be
+        inserted. For any other open element more lines are read first,
+        checking again once the buffer has doubled. Memory use is therefore
+        bounded by the chunk size plus the largest multi-line element.
+        """
+        totals = {k: 0 for k in self.stats}
+        buffer: List[str] = []
+        pending = 0
+        next_check = chunk_size
+
+        def transpile(text: str, parser: Optional[DMDParser] = None) -> str:
+            output = self.transpile_content(text, parser)
+            for key, count in self.stats.items():
+                totals[key] += count
+            return output
+
+        for line in reader:
+            buffer.append(line)
+            pending += len(line)
+            if pending < next_check:
+                continue
+
+            content = ''.join(buffer)
+            parser = DMDParser(content)
+            if not self._is_open(content, parser):
+                writer.write(transpile(content, parser))
+                buffer = []
+                pending = 0
+                next_check = chunk_size
+                continue
+
+            split = self._split_open_table(content, parser)
+            if split is None:
+                buffer = [content]
+                next_check = 2 * pending
+                continue
+
+            # Write the text before the table and its finished rows; keep the
+            # @tbl line, which becomes the caption after the last row. The
+            # '@' it starts with ends a table right above it, as in the
+            # whole input, and is copied unchanged.
+            start, directive_end, last_row = split
+            writer.write(transpile(content[:start + 1])[:-1])
+            writer.write(transpile(content[directive_end:last_row]))
+            content = content[start:directive_end] + content[last_row:]
+            buffer = [content]
+            pending = len(content)
+            next_check = pending + chunk_size
+
+        if buffer:
+            writer.write(transpile(''.join(buffer)))
+
+        self.stats = totals
+
+    def _is_open(self, content: str, parser: DMDParser) -> bool:
+        """Check whether text appended to `content` could change its output"""
+        if parser.has_open_directive():
+            return True
+
+        # Only the last table can still be scanning at the end of the content
+        tables = parser.parse_tables()
+        if tables:
+            _, table_end, _ = self._scan_table(content, tables[-1])
+            return table_end == len(content)
+
+        return False
+
+    def _split_open_table(self, content: str, parser: DMDParser) -> Optional[Tuple[int, int, int]]:
+        """
+        Find the parts of `content` whose output is final while its last table is still open.
+
+        Returns the start and end of the @tbl line and the start of the
+        table's last row. The output of the text before the @tbl line and
+        of the rows before the last one does not depend on what is
+        appended. None if the table cannot be split, e.g. because a
+        callout around it is still open.
+        """
+        if parser.has_open_directive():
+            return None
+        tables = parser.parse_tables()
+        if not tables:
+            return None
+        tbl = tables[-1]
+        directive_end, table_end, last_row = self._scan_table(content, tbl)
+        if table_end != len(content) or last_row is None:
+            return None
+        if any(element.start < tbl.start < element.end for element in parser.iter_elements()):
+            return None
+        return tbl.start, directive_end, last_row
+
+    def transpile_content(self, content: str, parser: Optional[DMDParser] = None) -> str:
         """
         Transpile content string from enhanced syntax to standard markdown.
 
-        Processing order matters - some transforms depend on others.
+        Every element is rewritten from a single scan of the content, and
+        the output is built in one pass.
+        An existing parser for `content` may be passed to avoid rescanning it.
         """
         # Reset stats
         self.stats = {k: 0 for k in self.stats}
 
-        # Process in order
-        content = self.process_figures(content)
-        content = self.process_tables(content)
-        content = self.process_callouts(content)
-        content = self.process_cross_references(content)
+        return self._rewrite(content, parser,
+                             (FigureElement, TableElement, CalloutElement, CrossReference))
+
+    def _rewrite(self, content: str, parser: Optional[DMDParser],
+                 kinds: Tuple[type, ...]) -> str:
+        """Rewrite every element of the given kinds from one token stream"""
+        if parser is None:
+            parser = DMDParser(content)
+
+        # Elements are consumed as they are found; a scan cached by the
+        # caller (e.g. the streaming check) is reused instead
+        with trace.span('transpile:rewrite', chars=len(content), kinds=[kind.__name__ for kind in kinds]):
+            edits: List[Edit] = []
+            # A table's caption moves below the table, so the references in
+            # it (which follow the table) are rewritten as part of the caption
+            table: Optional[TableElement] = None
+            caption_refs: List[CrossReference] = []
+
+            for element in parser.iter_elements():
+                if table is not None:
+                    if element.start < table.end:
+                        if isinstance(element, kinds):
+                            caption_refs.append(element)
+                        continue
+                    edits.extend(self._table_edits(content, table, caption_refs))
+                    table = None
+
+                if isinstance(element, TableElement) and isinstance(element, kinds):
+                    table = element
+                    caption_refs = []
+                elif isinstance(element, kinds):
+                    edits.extend(self._element_edits(content, element))
+
+            if table is not None:
+                edits.extend(self._table_edits(content, table, caption_refs))
+
+            return apply_edits(content, edits)
+
+    def _element_edits(self, content: str, element: Element) -> List[Edit]:
+        """Span edits that turn one parsed element into standard markdown"""
+        lower = self.target == 'latex'
+
+        if isinstance(element, FigureElement):
+            self.stats['figures'] += 1
+            figure = self._figure_to_latex(content, element) if lower else None
+            return [(element.start, element.end, figure or self._figure_to_markdown(element))]
+
+        if isinstance(element, CrossReference):
+            self.stats['cross_refs'] += 1
+            reference = self._reference_to_latex(element) if lower else self._reference_to_standard(element)
+            return [(element.start, element.end, reference)]
+
+        if isinstance(element, CalloutElement):
+            # Replace only the delimiters, so references inside the body
+            # can be rewritten independently
+            self.stats['callouts'] += 1
+            opening, closing = self._callout_latex(element) if lower else self._callout_fences(element)
+            body_start = element.start + len(element.callout_type) + 2
+            return [(element.start, body_start, opening),
+                    (element.end - 1, element.end, closing)]
 
-        return content
+        return []
 
-    def process_figures(self, content: str) -> str:
+    def process_figures(self, content: str, parser: Optional[DMDParser] = None) -> str:
         """
         Convert figure inline syntax to standard markdown.
 
         Input:  @fig[id](path.jpg){w=50% short="Short"} Caption text.
         Output: ![Caption text.](path.jpg){#fig:id width=50% short-caption="Short"}
         """
-        parser = DMDParser(content)
-        figures = parser.parse_figures()
-
-        # Sort by position (reverse order to maintain positions during replacement)
-        figures.sort(key=lambda f: content.find(f.original), reverse=True)
-
-        for fig in figures:
-            standard_md = self._figure_to_markdown(fig)
-            content = content.replace(fig.original, standard_md, 1)
-            self.stats['figures'] += 1
+        return self._rewrite(content, parser, (FigureElement,))
 
-        return content
-
-    def process_tables(self, content: str) -> str:
+    def process_tables(self, content: str, parser: Optional[DMDParser] = None) -> str:
         """
         Convert table inline syntax to standard markdown.
 
@@ -129,47 +334,91 @@ class DMDTranspiler:
 
                 : Caption text {#tbl:id}
         """
-        parser = DMDParser(content)
-        tables = parser.parse_tables()
+        return self._rewrite(content, parser, (TableElement,))
 
-        # Sort by position (reverse order)
-        tables.sort(key=lambda t: content.find(t.original), reverse=True)
-
-        for tbl in tables:
-            # For tables, we need to replace the @tbl[id] line with proper caption syntax
-            # The table markdown should follow immediately after
-            standard_caption = f": {tbl.caption} {{#tbl:{tbl.label}}}"
-
-            # Replace just the @tbl[id] Caption line
-            # The actual table markdown is already there
-            content = content.replace(tbl.original, '', 1)
-
-            # Find the table that follows and append caption
-            # Look for the next table (starts with |)
-            pos = content.find(tbl.original[:0])  # Position where we removed @tbl
-
-            # Find end of table (blank line after table)
-            lines = content[pos:].split('\n')
-            table_end_idx = 0
-            in_table = False
-            for i, line in enumerate(lines):
-                if line.strip().startswith('|'):
-                    in_table = True
-                elif in_table and line.strip() == '':
-                    table_end_idx = i
-                    break
-
-            if table_end_idx > 0:
-                # Insert caption after table
-                before_table = '\n'.join(lines[:table_end_idx])
-                after_table = '\n'.join(lines[table_end_idx:])
-                content = content[:pos] + before_table + '\n\n' + standard_caption + after_table
+    def _table_edits(self, content: str, tbl: TableElement, references: List[CrossReference]) -> List[Edit]:
+        """
+        Remove the @tbl line and insert its caption after the table below it.
 
-            self.stats['tables'] += 1
+        `references` are the references in the caption to rewrite with it.
+        """
+        self.stats['tables'] += 1
+        caption_start = content.index(']', tbl.start) + 1
+        caption_edits = [(start - caption_start, end - caption_start, replacement)
+                         for ref in references
+                         for start, end, replacement in self._element_edits(content, ref)]
+        caption = apply_edits(content[caption_start:tbl.end], caption_edits).strip()
+        standard_caption = f": {caption} {{#tbl:{tbl.label}}}"
+        directive_end, pos, last_row = self._scan_table(content, tbl)
+
+        if last_row is None:
+            return [(tbl.start, tbl.end, standard_caption)]
+
+        # `pos` is the start of the first line after the table
+        if content[pos - 1] != '\n':
+            caption = '\n\n' + standard_caption
+        elif pos < len(content) and content[pos] != '\n':
+            caption = '\n' + standard_caption + '\n\n'
+        else:
+            caption = '\n' + standard_caption + '\n'
 
-        return content
+        return [(tbl.start, directive_end, ''), (pos, pos, caption)]
 
-    def process_cross_references(self, content: str) -> str:
+    def _scan_table(self, content: str, tbl: TableElement) -> Tuple[int, int, Optional[int]]:
+        """
+        Find the table that belongs to a @tbl directive.
+
+        Only the lines between the directive and the end of its own table
+        are looked at. Blank lines may separate the two; any other text
+        means there is no table. A row that ends inside an element (e.g. a
+        figure whose caption is on the next line) continues up to the end
+        of the element's last line. Returns the end of the directive line,
+        where scanning stopped, and the start of the table's last row (None
+        if no table was found).
+        """
+        size = len(content)
+
+        # The directive ends at the end of its line; take the newline too
+        line_end = content.find('\n', tbl.end)
+        pos = size if line_end == -1 else line_end + 1
+        directive_end = pos
+
+        last_row = None
+        while pos < size:
+            line_end = content.find('\n', pos)
+            next_pos = size if line_end == -1 else line_end + 1
+            line = content[pos:next_pos].strip()
+
+            if line.startswith('|'):
+                last_row = pos
+                next_pos = self._row_end(content, pos, next_pos)
+            elif last_row is not None or line:
+                break
+            pos = next_pos
+
+        return directive_end, pos, last_row
+
+    @staticmethod
+    def _row_end(content: str, start: int, end: int) -> int:
+        """`end`, or the end of a later line if an element in content[start:end] runs past it"""
+        search = DMDParser.DIRECTIVE_START.search
+        match_at = DMDParser.DIRECTIVE_PATTERN.match
+        pos = start
+
+        while True:
+            candidate = search(content, pos, end)
+            if candidate is None:
+                return end
+            match = match_at(content, candidate.start())
+            if match is None:
+                pos = candidate.start() + 1
+                continue
+            pos = match.end()
+            if pos >= end:
+                line_end = content.find('\n', pos)
+                end = len(content) if line_end == -1 else line_end + 1
+
+    def process_cross_references(self, content: str, parser: Optional[DMDParser] = None) -> str:
         """
         Convert unified cross-reference syntax to appropriate format.
 
@@ -183,20 +432,9 @@ class DMDTranspiler:
                 \\eqref{eq:label} (LaTeX)
                 @sec:label (pandoc native)
         """
-        parser = DMDParser(content)
-        refs = parser.parse_cross_references()
-
-        # Sort by position (reverse order)
-        refs.sort(key=lambda r: content.find(r.original), reverse=True)
-
-        for ref in refs:
-            standard_ref = self._reference_to_standard(ref)
-            content = content.replace(ref.original, standard_ref, 1)
-            self.stats['cross_refs'] += 1
-
-        return content
+        return self._rewrite(content, parser, (CrossReference,))
 
-    def process_callouts(self, content: str) -> str:
+    def process_callouts(self, content: str, parser: Optional[DMDParser] = None) -> str:
         """
         Convert callout syntax to div boxes.
 
@@ -207,18 +445,7 @@ class DMDTranspiler:
                 Important concept
                 :::
         """
-        parser = DMDParser(content)
-        callouts = parser.parse_callouts()
-
-        # Sort by position (reverse order)
-        callouts.sort(key=lambda c: content.find(c.original), reverse=True)
-
-        for callout in callouts:
-            div_box = self._callout_to_div(callout)
-            content = content.replace(callout.original, div_box, 1)
-            self.stats['callouts'] += 1
-
-        return content
+        return self._rewrite(content, parser, (CalloutElement,))
 
     def _figure_to_markdown(self, fig: FigureElement) -> str:
         """Convert FigureElement to standard markdown with attributes"""
@@ -240,6 +467,56 @@ class DMDTranspiler:
 
         return f'![{fig.caption}]({fig.image_path}){{{attr_str}}}'
 
+    def _figure_to_latex(self, content: str, fig: FigureElement) -> Optional[str]:
+        """
+        Convert FigureElement to a raw LaTeX figure, as short-captions.lua would.
+
+        Returns None if the caption contains markup that only Pandoc can
+        render, or if the figure shares its line with other text.
+        """
+        size = len(content)
+        if (fig.start > 0 and content[fig.start - 1] != '\n') or (fig.end < size and content[fig.end] != '\n'):
+            return None
+
+        caption = self._plain_latex(fig.caption)
+        short = self._plain_latex(fig.attributes.get('short-caption', ''))
+        if caption is None or short is None:
+            return None
+
+        options = ['keepaspectratio']
+        for key, extent in (('width', '\\linewidth'), ('height', '\\textheight')):
+            value = fig.attributes.get(key)
+            if value:
+                # Same conversion of percentages as Pandoc's LaTeX writer
+                if value.endswith('%') and value[:-1].replace('.', '', 1).isdigit():
+                    value = f'{float(value[:-1]) / 100:g}{extent}'
+                options.append(f'{key}={value}')
+
+        # Blank lines keep the raw block from running into the paragraphs around it
+        short_part = f'[{short}]' if short else ''
+        return (f'\n```{{=latex}}\n'
+                f'\\begin{{figure}}\n'
+                f'\\centering\n'
+                f'\\includegraphics[{",".join(options)}]{{{fig.image_path}}}\n'
+                f'\\caption{short_part}{{{caption}}}\\label{{fig:{fig.label}}}\n'
+                f'\\end{{figure}}\n'
+                f'```\n')
+
+    def _plain_latex(self, text: str) -> Optional[str]:
+        """`text` escaped for LaTeX, or None if it contains markdown markup"""
+        if not self.PLAIN_CAPTION.fullmatch(text):
+            return None
+        return self.LATEX_SPECIALS.sub(r'\\\1', text)
+
+    def _reference_to_latex(self, ref: CrossReference) -> str:
+        """Convert CrossReference to the LaTeX command it ends up as"""
+        target = f'{ref.ref_type}:{ref.label}'
+        if ref.ref_type == 'eq' or (ref.custom_text and self._plain_latex(ref.custom_text) is None):
+            return self._reference_to_standard(ref)
+        if ref.custom_text:
+            return f'\\hyperref[{target}]{{{self._plain_latex(ref.custom_text)}}}'
+        return f'\\autoref{{{target}}}'
+
     def _reference_to_standard(self, ref: CrossReference) -> str:
         """Convert CrossReference to standard syntax"""
         if ref.custom_text:
@@ -259,9 +536,20 @@ class DMDTranspiler:
                 # Figures, tables, sections use pandoc @ syntax
                 return f'@{ref.ref_type}:{ref.label}'
 
-    def _callout_to_div(self, callout: CalloutElement) -> str:
-        """Convert CalloutElement to div box"""
+    def _callout_fences(self, callout: CalloutElement) -> Tuple[str, str]:
+        """Opening and closing div fences that replace a callout's delimiters"""
+        box_style = self.CALLOUT_STYLES.get(callout.callout_type, 'graybox')
+        title = callout.callout_type.capitalize()
+
+        return f'::: {{.{box_style} title="{title}"}}\n', '\n:::'
+
+    def _callout_latex(self, callout: CalloutElement) -> Tuple[str, str]:
+        """Raw tcolorbox delimiters that replace a callout's, as filterboxes.lua writes them"""
         box_style = self.CALLOUT_STYLES.get(callout.callout_type, 'graybox')
+        colback, colframe, coltitle = self.BOX_COLORS[box_style]
         title = callout.callout_type.capitalize()
+        options = (f'colback={colback}, colframe={colframe}, coltitle={coltitle}, '
+                   f'title=\\textbf{{{title}}}, {self.BOX_LAYOUT}')
 
-        return f'::: {{.{box_style} title="{title}"}}\n{callout.content}\n:::'
+        return (f'```{{=latex}}\n\\begin{{tcolorbox}}[{options}]\n```\n\n',
+                '\n\n```{=latex}\n\\end{tcolorbox}\n```')
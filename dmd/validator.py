@@ -5,11 +5,116 @@ Validates cross-references, checks for duplicate labels, and provides helpful
 error messages with line numbers and suggestions.
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Set, Optional, Tuple
-from dataclasses import dataclass
-from difflib import get_close_matches
-from .parser import DMDParser
+from dataclasses import dataclass, field
+from . import trace
+from .fscache import DirectoryCache
+from .index import ProjectIndex
+from .parser import DMDParser, FigureElement, TableElement, CrossReference
+from .suggest import SuggestionIndex
+
+
+# Names used in messages about each label type
+LABEL_NAMES = {
+    'fig': 'figure',
+    'tbl': 'table',
+    'eq': 'equation',
+    'sec': 'section',
+}
+
+
+@dataclass
+class FileScan:
+    """Labels, references and images found in one file"""
+    file: Path
+    labels: List[Tuple[str, str, int, int]] = field(default_factory=list)      # (type, label, line, column)
+    references: List[Tuple[str, str, int, int]] = field(default_factory=list)  # (type, label, line, column)
+    images: List[Tuple[str, int, int]] = field(default_factory=list)           # (path, line, column)
+
+    def to_dict(self) -> dict:
+        """Serializable form, without the file path"""
+        return {'labels': self.labels, 'references': self.references, 'images': self.images}
+
+    @classmethod
+    def from_dict(cls, file_path: Path, data: dict) -> 'FileScan':
+        return cls(
+            file=file_path,
+            labels=[tuple(x) for x in data['labels']],
+            references=[tuple(x) for x in data['references']],
+            images=[tuple(x) for x in data['images']],
+        )
+
+
+def scan_file(file_path: Path) -> FileScan:
+    """Read and parse one file, independent of any other file"""
+    content = file_path.read_text(encoding='utf-8')
+    parser = DMDParser(content)
+    scan = FileScan(file=file_path)
+
+    for element in parser.iter_elements():
+        line, column = parser.get_position(element.start)
+        if isinstance(element, FigureElement):
+            scan.labels.append(('fig', element.label, line, column))
+            scan.images.append((element.image_path, line, column))
+        elif isinstance(element, TableElement):
+            scan.labels.append(('tbl', element.label, line, column))
+        elif isinstance(element, CrossReference):
+            scan.references.append((element.ref_type, element.label, line, column))
+
+    return scan
+
+
+def scan_files(files: List[Path], jobs: Optional[int] = None,
+               index: Optional[ProjectIndex] = None) -> List[FileScan]:
+    """
+    Scan files on a process pool, returning results in the order of `files`.
+
+    With an index, files whose content is already indexed are loaded from
+    it and only the rest are parsed; their results are added to the index.
+    """
+    scans: List[Optional[FileScan]] = [None] * len(files)
+    pending: List[Tuple[int, os.stat_result, Optional[str]]] = []
+
+    for i, file_path in enumerate(files):
+        if index is None:
+            pending.append((i, None, None))
+            continue
+
+        st = file_path.stat()
+        data = index.lookup_stat(file_path, st)
+        if data is None:
+            # Touched or new: only re-parse if the content actually changed
+            digest = index.digest(file_path.read_bytes())
+            data = index.lookup_digest(digest)
+            if data is None:
+                pending.append((i, st, digest))
+                continue
+            index.store(file_path, st, digest)
+        scans[i] = FileScan.from_dict(file_path, data)
+
+    to_scan = [files[i] for i, _, _ in pending]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(to_scan)))
+
+    if jobs == 1:
+        results = [scan_file(f) for f in to_scan]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(scan_file, to_scan))
+
+    for (i, st, digest), scan in zip(pending, results):
+        scans[i] = scan
+        if index is not None:
+            index.store(files[i], st, digest, scan.to_dict())
+
+    if index is not None:
+        index.commit()
+
+    return scans
 
 
 @dataclass
@@ -26,9 +131,14 @@ class ValidationError:
 class DMDValidator:
     """Validate DMD documents for common issues"""
 
-    def __init__(self, project_dir: Path, strict: bool = False):
+    def __init__(self, project_dir: Path, strict: bool = False, index: Optional[ProjectIndex] = None,
+                 fs_cache: Optional[DirectoryCache] = None):
         self.project_dir = project_dir
         self.strict = strict
+        self.index = index
+
+        # Image existence is answered from one listing per directory
+        self.fs_cache = fs_cache or DirectoryCache()
         self.errors: List[ValidationError] = []
         self.warnings: List[ValidationError] = []
 
@@ -43,8 +153,11 @@ class DMDValidator:
         # Track where labels are defined
         self.label_locations: Dict[str, Tuple[Path, int]] = {}
 
+        # "Did you mean" indexes per label type, see validate_references()
+        self._suggesters: Dict[str, SuggestionIndex] = {}
+
         # Track all references
-        self.references: List[Tuple[str, str, Path, int]] = []  # (type, label, file, line)
+        self.references: List[Tuple[str, str, Path, int, int]] = []  # (type, label, file, line, column)
 
     def validate_file(self, file_path: Path) -> bool:
         """
@@ -52,73 +165,55 @@ class DMDValidator:
 
         Returns True if no errors found (warnings are OK).
         """
-        content = file_path.read_text(encoding='utf-8')
-        parser = DMDParser(content)
-
-        # Collect labels from figures
-        figures = parser.parse_figures()
-        for fig in figures:
-            label = fig.label
-            if label in self.labels['fig']:
+        self.merge_scan(scan_file(file_path))
+        return len(self.errors) == 0
+
+    def merge_scan(self, scan: FileScan):
+        """Add one file's labels and references, reporting duplicates and missing images"""
+        file_path = scan.file
+
+        for label_type, label, line, column in scan.labels:
+            key = f'{label_type}:{label}'
+            if label in self.labels[label_type]:
                 # Duplicate label
-                prev_file, prev_line = self.label_locations[f'fig:{label}']
+                prev_file, prev_line = self.label_locations[key]
                 self.errors.append(ValidationError(
                     severity='error',
                     file=file_path,
-                    line=fig.line_number,
-                    column=None,
-                    message=f"Duplicate figure label 'fig:{label}'",
+                    line=line,
+                    column=column,
+                    message=f"Duplicate {LABEL_NAMES[label_type]} label '{key}'",
                     suggestion=f"Previous definition at {prev_file}:{prev_line}"
                 ))
             else:
-                self.labels['fig'].add(label)
-                self.label_locations[f'fig:{label}'] = (file_path, fig.line_number)
-
-        # Collect labels from tables
-        tables = parser.parse_tables()
-        for tbl in tables:
-            label = tbl.label
-            if label in self.labels['tbl']:
-                prev_file, prev_line = self.label_locations[f'tbl:{label}']
-                self.errors.append(ValidationError(
-                    severity='error',
-                    file=file_path,
-                    line=tbl.line_number,
-                    column=None,
-                    message=f"Duplicate table label 'tbl:{label}'",
-                    suggestion=f"Previous definition at {prev_file}:{prev_line}"
-                ))
-            else:
-                self.labels['tbl'].add(label)
-                self.label_locations[f'tbl:{label}'] = (file_path, tbl.line_number)
+                self.labels[label_type].add(label)
+                self.label_locations[key] = (file_path, line)
 
-        # Collect cross-references
-        refs = parser.parse_cross_references()
-        for ref in refs:
-            self.references.append((ref.ref_type, ref.label, file_path, ref.line_number))
+        for ref_type, label, line, column in scan.references:
+            self.references.append((ref_type, label, file_path, line, column))
 
         # Check for images that don't exist
-        for fig in figures:
-            image_path = self.project_dir / fig.image_path
-            if not image_path.exists():
+        for image, line, column in scan.images:
+            if not self.fs_cache.exists(self.project_dir / image):
                 self.warnings.append(ValidationError(
                     severity='warning',
                     file=file_path,
-                    line=fig.line_number,
-                    column=None,
-                    message=f"Image file not found: {fig.image_path}",
+                    line=line,
+                    column=column,
+                    message=f"Image file not found: {image}",
                     suggestion="Check the path or create the image"
                 ))
 
-        return len(self.errors) == 0
-
     def validate_references(self) -> bool:
         """
         Validate all cross-references after collecting all labels.
 
         Returns True if no undefined references found.
         """
-        for ref_type, label, file_path, line_num in self.references:
+        # Suggestion indexes are built on first use from the labels as they are now
+        self._suggesters = {}
+
+        for ref_type, label, file_path, line_num, column in self.references:
             if label not in self.labels[ref_type]:
                 # Undefined reference
                 similar = self._find_similar_labels(label, ref_type)
@@ -131,26 +226,37 @@ class DMDValidator:
                     severity='error',
                     file=file_path,
                     line=line_num,
-                    column=None,
+                    column=column,
                     message=f"Undefined reference @{ref_type}:{label}",
                     suggestion=suggestion
                 ))
 
         return len(self.errors) == 0
 
-    def validate_all(self, files: List[Path]) -> bool:
+    def validate_all(self, files: List[Path], jobs: Optional[int] = None) -> bool:
         """
         Validate all files in the project.
 
+        Files are read and parsed on up to `jobs` worker processes (default:
+        CPU count), skipping those whose content is unchanged in the
+        project index. Results are merged in the order of `files`, so
+        which definition counts as the duplicate never depends on which
+        worker finishes first.
+
         Returns True if validation passes (no errors).
         """
+        files = [f for f in files if f.suffix in ['.md', '.dmd']]
+
         # Phase 1: Collect all labels and check for duplicates
-        for file_path in files:
-            if file_path.suffix in ['.md', '.dmd']:
-                self.validate_file(file_path)
+        with trace.span('validate:labels', files=len(files)):
+            for scan in scan_files(files, jobs, self.index):
+                self.merge_scan(scan)
+
+            self.fs_cache.save()
 
         # Phase 2: Validate all references
-        self.validate_references()
+        with trace.span('validate:references', references=len(self.references)):
+            self.validate_references()
 
         return len(self.errors) == 0
 
@@ -177,7 +283,10 @@ class DMDValidator:
         """Print a single error in a nice format"""
         severity_symbol = "✗" if error.severity == 'error' else "⚠"
         print(f"{severity_symbol} {error.severity.upper()}: {error.message}")
-        print(f"  --> {error.file}:{error.line}")
+        location = f"{error.file}:{error.line}"
+        if error.column is not None:
+            location += f":{error.column}"
+        print(f"  --> {location}")
 
         if error.suggestion:
             print(f"  = help: {error.suggestion}")
@@ -186,12 +295,14 @@ class DMDValidator:
 
     def _find_similar_labels(self, label: str, ref_type: str, max_suggestions: int = 3) -> List[str]:
         """Find similar label names using fuzzy matching"""
-        defined_labels = list(self.labels[ref_type])
-
-        if not defined_labels:
+        if not self.labels[ref_type]:
             return []
 
-        similar = get_close_matches(label, defined_labels, n=max_suggestions, cutoff=0.6)
+        suggester = self._suggesters.get(ref_type)
+        if suggester is None:
+            suggester = self._suggesters[ref_type] = SuggestionIndex(self.labels[ref_type])
+
+        similar = suggester.suggest(label, n=max_suggestions, cutoff=0.6)
         return [f'@{ref_type}:{s}' for s in similar]
 
     def has_errors(self) -> bool:
@@ -0,0 +1,212 @@
+"""
+DMD Watch Mode
+
+Keeps a build session alive between edits: the labels and references of
+every DMD source stay in memory, so a save re-parses only the touched
+files before references are checked again, and the build graph's file
+hashes stay warm. Changes are found by polling directory listings, which
+needs nothing beyond the standard library and costs one scandir per
+watched directory per interval.
+"""
+
+import copy
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .build import CACHE_DIR, BuildError, BuildState, TaskResult, load_config, plan_build, run_tasks, select_tasks
+from .fscache import DirectoryCache
+from .validator import DMDValidator, FileScan, scan_file
+
+
+class PollingWatcher:
+    """Reports files added, removed or modified in a set of directories"""
+
+    def __init__(self, directories: Iterable[Path] = (), ignore: Optional[Callable[[Path], bool]] = None):
+        self.ignore = ignore or (lambda path: False)
+        self.directories: Set[Path] = set()
+        self._snapshot: Dict[Path, Tuple[int, int]] = {}
+        self.set_directories(directories)
+
+    def set_directories(self, directories: Iterable[Path]):
+        """
+        Change the watched directories without reporting the current files of new ones as changes.
+
+        Directories that stay watched keep their snapshot, so the next poll
+        still reports what changed in them meanwhile (e.g. during a build).
+        """
+        directories = set(directories)
+        added = directories - self.directories
+        self.directories = directories
+        snapshot = {path: stamp for path, stamp in self._snapshot.items()
+                    if path.parent in directories and not self.ignore(path)}
+        snapshot.update(self._take(added))
+        self._snapshot = snapshot
+
+    def poll(self) -> Set[Path]:
+        """Files that changed since the last poll"""
+        snapshot = self._take()
+        old = self._snapshot
+        self._snapshot = snapshot
+        changed = {path for path, stamp in snapshot.items() if old.get(path) != stamp}
+        changed.update(path for path in old if path not in snapshot)
+        return changed
+
+    def _take(self, directories: Optional[Iterable[Path]] = None) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for directory in self.directories if directories is None else directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                # Hidden files include editor swap files and pandoc's temporary outputs
+                if entry.name.startswith('.'):
+                    continue
+                path = Path(entry.path)
+                try:
+                    if not entry.is_file() or self.ignore(path):
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+
+class WatchSession:
+    """In-memory state for repeated validate-and-build cycles of a dmd.yaml project"""
+
+    def __init__(self, config_path: Path, targets: Iterable[str] = (), jobs: Optional[int] = None,
+                 fragments: Optional[bool] = None):
+        self.config_path = config_path.resolve()
+        self.root = self.config_path.parent
+        self.targets = list(targets)
+        self.jobs = jobs
+        self.fragments = fragments
+        self.state = BuildState(self.root / CACHE_DIR / 'build.json')
+        self.scans: Dict[Path, FileScan] = {}
+        self.config: dict = {}
+        self.tasks = []
+        self.sources: List[Path] = []
+        self.strict = False
+        self.validate = True
+
+    def load(self):
+        """(Re)read dmd.yaml and plan the build. Raises BuildError."""
+        self.config = load_config(self.config_path)
+        watch_config = copy.deepcopy(self.config)
+        build = watch_config.get('build') or {}
+        transpiler = build.get('transpiler') or {}
+        self.strict = transpiler.get('strict', False)
+        self.validate = transpiler.get('enabled', True) and transpiler.get('validate_before_build', True)
+
+        # Validation happens in memory, before the build graph runs
+        transpiler['validate_before_build'] = False
+        build['transpiler'] = transpiler
+        watch_config['build'] = build
+
+        self.tasks = select_tasks(plan_build(watch_config, self.root, fragments=self.fragments), self.targets)
+        self.sources = [i for task in self.tasks if task.name.startswith('transpile:') for i in task.inputs]
+        for path in list(self.scans):
+            if path not in self.sources:
+                del self.scans[path]
+
+    def directories(self) -> Set[Path]:
+        """Directories holding the config, any task input, or an image referenced from a source"""
+        directories = {self.root}
+        for task in self.tasks:
+            directories.update(path.parent for path in task.inputs)
+        for scan in self.scans.values():
+            directories.update((self.root / image).parent for image, _, _ in scan.images)
+        return directories
+
+    def outputs(self) -> Set[Path]:
+        return {output for task in self.tasks for output in task.outputs}
+
+    def check(self, changed: Iterable[Path] = ()) -> DMDValidator:
+        """
+        Validate all sources, re-parsing only those in `changed` or not parsed yet.
+
+        Labels and references of unchanged files come from memory.
+        """
+        changed = set(changed)
+        for source in self.sources:
+            if source in changed or source not in self.scans:
+                if source.exists():
+                    self.scans[source] = scan_file(source)
+                else:
+                    self.scans.pop(source, None)
+
+        validator = DMDValidator(self.root, strict=self.strict, fs_cache=DirectoryCache())
+        for source in self.sources:
+            if source in self.scans:
+                validator.merge_scan(self.scans[source])
+        validator.validate_references()
+        return validator
+
+    def cycle(self, changed: Iterable[Path] = ()) -> Tuple[Optional[DMDValidator], List[TaskResult]]:
+        """
+        One round after `changed` files were saved: validate, then build what is stale.
+
+        The build is not run while validation reports errors (or warnings,
+        in strict mode). Returns the validator (None if validation is off)
+        and the task results.
+        """
+        changed = set(changed)
+        if self.config_path in changed or not self.tasks:
+            self.load()
+
+        validator = None
+        if self.validate and self.sources:
+            validator = self.check(changed)
+            if validator.has_errors() or (self.strict and validator.has_warnings()):
+                return validator, []
+
+        results = run_tasks(self.tasks, self.state, jobs=self.jobs)
+        return validator, results
+
+
+def watch_project(session: WatchSession, on_cycle: Callable[[Optional[DMDValidator], List[TaskResult]], None],
+          on_error: Callable[[BuildError], None], debounce_ms: int = 1000, poll_ms: int = 250,
+          cycles: Optional[int] = None):
+    """
+    Build once, then again after each burst of changes.
+
+    Changes are collected until none arrive for `debounce_ms`, so saving
+    several files (or an editor writing one in steps) starts one build.
+    Files the build writes itself are not treated as changes. Runs until
+    interrupted, or for `cycles` rounds after the first.
+    """
+    changed: Set[Path] = set()
+    watcher = PollingWatcher()
+    # Watch before the first build, so that saves during it are not missed
+    try:
+        session.load()
+        watcher.set_directories(session.directories())
+    except BuildError:
+        pass  # reported by the first cycle
+
+    def run(paths):
+        try:
+            on_cycle(*session.cycle(paths))
+        except BuildError as e:
+            on_error(e)
+        outputs = session.outputs()
+        watcher.ignore = lambda path: path in outputs
+        watcher.set_directories(session.directories())
+
+    run(changed)
+    while cycles is None or cycles > 0:
+        time.sleep(poll_ms / 1000)
+        new = watcher.poll()
+        if new:
+            changed |= new
+            last_change = time.monotonic()
+            continue
+        if changed and (time.monotonic() - last_change) * 1000 >= debounce_ms:
+            run(changed)
+            changed = set()
+            if cycles is not None:
+                cycles -= 1
@@ -1,39 +1,30 @@
+import argparse
+import hashlib
+import json
 import os
 import subprocess
 import shutil
+import sys
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
 
+# The dmd package (for tracing) lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def convert_pgf_to_pdf(pgf_file_path):
-    # Ensure pdflatex is available in the system's PATH
-    try:
-        subprocess.run(["pdflatex", "--version"], check=True, capture_output=True)
-    except FileNotFoundError:
-        print("Error: 'pdflatex' command not found.")
-        print("Please ensure you have a LaTeX distribution (like TeX Live or MiKTeX)")
-        print("installed and 'pdflatex' is added to your system's PATH.")
-        return
-    except subprocess.CalledProcessError as e:
-        print(f"Error checking pdflatex version: {e}")
-        print(f"Stderr: {e.stderr.decode()}")
-        return
-
-    input_dir = os.path.dirname(pgf_file_path)
-    base_filename = os.path.splitext(os.path.basename(pgf_file_path))[0]
-    output_pdf_path = os.path.join(input_dir, f"{base_filename}.pdf")
+from dmd import trace
 
-    # Define the LaTeX template
-    # The \input command requires the path to be relative to the .tex file
-    # or absolute. Using os.path.relpath to ensure it works correctly.
-    latex_template = (
-        r"""
+# Standalone preamble used to compile every .pgf figure
+LATEX_PREAMBLE = r"""
 \documentclass[pgfplots, border=3mm]{standalone}
 \usepackage[utf8]{inputenc}
 \usepackage{pgfplots}
 \usepackage{pgf}
 \usepackage{amsmath}
-\usepackage{amsfonts} 
-\usepackage{amssymb} 
+\usepackage{amsfonts}
+\usepackage{amssymb}
 \usepackage{latexsym}
 \usepackage{color, colortbl}
 
@@ -57,7 +48,163 @@ def convert_pgf_to_pdf(pgf_file_path):
 \everymath=\expandafter{\the\everymath\displaystyle}
 \newcommand{\pcal}{$\mathcal{P}$ }
 \newcommand{\scal}{$\mathcal{S}$ }
+"""
+
+# Records the content hash each PDF was built from, relative to the root folder
+MANIFEST_NAME = ".pgf_to_pdf.json"
+
+# Precompiled preamble (mylatexformat), kept next to the manifest
+FORMAT_DIR_NAME = ".pgf_to_pdf-format"
+FORMAT_NAME = "pgfpreamble"
+
+# Lines of LaTeX output kept for failed figures
+LOG_TAIL_LINES = 20
+
+
+@dataclass
+class FigureResult:
+    """Outcome of one figure; status is "converted", "skipped" or "failed" """
+
+    source: str
+    output: str
+    status: str
+    duration: float = 0.0
+    message: str = ""
+    log_tail: list = field(default_factory=list)
+
+
+class PdflatexNotFound(RuntimeError):
+    pass
+
+
+def check_pdflatex():
+    """
+    Ensure pdflatex is available in the system's PATH.
+
+    Called once per run rather than once per figure. Returns the version
+    banner (which the format file depends on) or raises PdflatexNotFound.
+    """
+    try:
+        result = subprocess.run(["pdflatex", "--version"], check=True, capture_output=True)
+    except FileNotFoundError:
+        raise PdflatexNotFound(
+            "'pdflatex' command not found.\n"
+            "Please ensure you have a LaTeX distribution (like TeX Live or MiKTeX)\n"
+            "installed and 'pdflatex' is added to your system's PATH."
+        )
+    except subprocess.CalledProcessError as e:
+        raise PdflatexNotFound(
+            f"Error checking pdflatex version: {e}\nStderr: {e.stderr.decode()}"
+        )
+    return result.stdout.decode(errors="ignore").split("\n")[0] or "pdflatex"
+
+
+def source_hash(pgf_file_path):
+    """Hash of the figure source together with the preamble it is compiled with"""
+    digest = hashlib.sha256(LATEX_PREAMBLE.encode("utf-8"))
+    with open(pgf_file_path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_manifest(root_folder):
+    try:
+        with open(os.path.join(root_folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(root_folder, manifest):
+    path = os.path.join(root_folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def is_up_to_date(pgf_file_path, recorded_hash):
+    """
+    Check whether the figure's PDF can be kept.
+
+    A PDF with a manifest entry is current when the recorded hash matches,
+    which also catches preamble changes and survives mtime churn from
+    checkouts. Without an entry, a PDF newer than its source is kept.
+    """
+    output_pdf_path = os.path.splitext(pgf_file_path)[0] + ".pdf"
+    if not os.path.exists(output_pdf_path):
+        return False
+    if recorded_hash is not None:
+        return recorded_hash == source_hash(pgf_file_path)
+    return os.path.getmtime(output_pdf_path) >= os.path.getmtime(pgf_file_path)
+
+
+def build_format(format_dir, pdflatex_version):
+    """
+    Dump LATEX_PREAMBLE into a pdflatex format file with mylatexformat.
+
+    Loading the format skips compiling the preamble for every figure. The
+    format is reused until the preamble or the pdflatex version changes.
+    Returns the format path (without .fmt) to pass to -fmt, or None if it
+    could not be built, in which case figures compile the preamble as before.
+    """
+    format_base = os.path.abspath(os.path.join(format_dir, FORMAT_NAME))
+    stamp = hashlib.sha256(
+        (pdflatex_version + "\0" + LATEX_PREAMBLE).encode("utf-8")
+    ).hexdigest()
+
+    try:
+        with open(format_base + ".stamp", "r", encoding="utf-8") as f:
+            if f.read() == stamp and os.path.exists(format_base + ".fmt"):
+                return format_base
+    except OSError:
+        pass
+
+    os.makedirs(format_dir, exist_ok=True)
+    with open(os.path.join(format_dir, "preamble.tex"), "w", encoding="utf-8") as f:
+        f.write(LATEX_PREAMBLE + "\n\\begin{document}\n\\end{document}\n")
+
+    result = trace.run(
+        [
+            "pdflatex",
+            "-ini",
+            "-interaction=nonstopmode",
+            f"-jobname={FORMAT_NAME}",
+            "&pdflatex",
+            "mylatexformat.ltx",
+            "preamble.tex",
+        ],
+        cwd=format_dir,
+        name="pdflatex format",
+        text=True,
+    )
+    if result.returncode != 0 or not os.path.exists(format_base + ".fmt"):
+        return None
+
+    with open(format_base + ".stamp", "w", encoding="utf-8") as f:
+        f.write(stamp)
+    return format_base
+
 
+def convert_pgf_to_pdf(pgf_file_path, format_path=None):
+    """
+    Compile one .pgf file to a PDF next to it.
+
+    With a format from build_format() the preamble is loaded precompiled.
+    Assumes pdflatex was checked with check_pdflatex(). Returns a
+    FigureResult; failures carry the tail of the LaTeX log.
+    """
+    started = time.monotonic()
+    input_dir = os.path.dirname(pgf_file_path)
+    base_filename = os.path.splitext(os.path.basename(pgf_file_path))[0]
+    output_pdf_path = os.path.join(input_dir, f"{base_filename}.pdf")
+    result = FigureResult(source=pgf_file_path, output=output_pdf_path, status="failed")
+
+    # Define the LaTeX template
+    # The \input command requires the path to be relative to the .tex file
+    # or absolute. Using os.path.relpath to ensure it works correctly.
+    latex_template = (
+        LATEX_PREAMBLE
+        + r"""
 \begin{document}
 
 \input{"""
@@ -82,78 +229,201 @@ def convert_pgf_to_pdf(pgf_file_path):
         with open(temp_tex_path, "w", encoding="utf-8") as f:
             f.write(latex_template)
 
-        print(f"Converting '{pgf_file_path}' to PDF...")
-
         # We change the current working directory to the temporary directory
         # so pdflatex can find the .pgf file via \input.
+        command = ["pdflatex", "-interaction=nonstopmode", temp_tex_filename]
+        if format_path:
+            # mylatexformat skips the document's own copy of the preamble
+            command.insert(1, f"-fmt={format_path}")
         try:
-            result = subprocess.run(
-                ["pdflatex", "-interaction=nonstopmode", temp_tex_filename],
+            completed = trace.run(
+                command,
                 cwd=temp_compilation_dir,
-                capture_output=True,
-                check=True,  # Raise an exception for non-zero exit codes
+                name=f"pdflatex {base_filename}",
                 text=True,  # Capture stdout/stderr as text
             )
             generated_pdf_path = os.path.join(
                 temp_compilation_dir, f"{base_filename}.pdf"
             )
-            if os.path.exists(generated_pdf_path):
+            if completed.returncode == 0 and os.path.exists(generated_pdf_path):
                 shutil.move(generated_pdf_path, output_pdf_path)
-                print(f"Successfully converted and saved as '{output_pdf_path}'")
+                result.status = "converted"
             else:
-                print(
-                    f"Error: PDF not generated for '{pgf_file_path}'. Check LaTeX log for details."
-                )
-                # Optionally print log if PDF wasn't found
+                if completed.returncode != 0:
+                    result.message = f"pdflatex exited with code {completed.returncode}"
+                else:
+                    result.message = "PDF not generated"
+                # Keep the end of the log (or of stdout) for quick debugging
                 log_path = os.path.join(temp_compilation_dir, f"{base_filename}.log")
                 if os.path.exists(log_path):
                     with open(
                         log_path, "r", encoding="utf-8", errors="ignore"
                     ) as log_f:
-                        print("--- LaTeX Log (partial) ---")
-                        # Print last 20 lines of log for quick debugging
-                        log_lines = log_f.readlines()
-                        for line in log_lines[-20:]:
-                            print(line.strip())
-                        print("---------------------------")
-
-        except subprocess.CalledProcessError as e:
-            print(f"Error compiling '{pgf_file_path}':")
-            print(f"Command: {' '.join(e.cmd)}")
-            print(f"Return Code: {e.returncode}")
-            print(f"Stdout:\n{e.stdout}")
-            print(f"Stderr:\n{e.stderr}")
-            print("Please check the .pgf file for LaTeX errors.")
+                        log_lines = log_f.read().splitlines()
+                else:
+                    log_lines = (completed.stdout + completed.stderr).splitlines()
+                result.log_tail = log_lines[-LOG_TAIL_LINES:]
         except Exception as e:
-            print(
-                f"An unexpected error occurred during conversion of '{pgf_file_path}': {e}"
+            result.message = f"An unexpected error occurred: {e}"
+
+    result.duration = time.monotonic() - started
+    return result
+
+
+def find_pgf_files(root_folder):
+    pgf_files = []
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        for filename in filenames:
+            if filename.lower().endswith(".pgf"):
+                pgf_files.append(os.path.join(dirpath, filename))
+    return sorted(pgf_files)
+
+
+def convert_folder(root_folder, jobs=None, force=False, format_path=None):
+    """
+    Convert every stale .pgf file below root_folder, `jobs` at a time.
+
+    pdflatex runs are independent subprocesses, so a thread pool is enough
+    to keep that many compilations going. Returns a FigureResult per
+    figure, in path order.
+    """
+    pgf_files = find_pgf_files(root_folder)
+    manifest = load_manifest(root_folder)
+
+    results = {}
+    stale = []
+    for pgf_file_path in pgf_files:
+        key = os.path.relpath(pgf_file_path, root_folder)
+        if not force and is_up_to_date(pgf_file_path, manifest.get(key)):
+            results[pgf_file_path] = FigureResult(
+                source=pgf_file_path,
+                output=os.path.splitext(pgf_file_path)[0] + ".pdf",
+                status="skipped",
             )
+        else:
+            stale.append(pgf_file_path)
+
+    # Hash before compiling, so an edit made meanwhile is picked up next run
+    hashes = [source_hash(p) for p in stale]
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        for pgf_file_path, digest, result in zip(
+            stale,
+            hashes,
+            executor.map(lambda p: convert_pgf_to_pdf(p, format_path), stale),
+        ):
+            results[pgf_file_path] = result
+            if result.status == "converted":
+                manifest[os.path.relpath(pgf_file_path, root_folder)] = digest
+
+    # Forget figures that no longer exist
+    current = {os.path.relpath(p, root_folder) for p in pgf_files}
+    manifest = {k: v for k, v in manifest.items() if k in current}
+    if pgf_files:
+        save_manifest(root_folder, manifest)
 
+    return [results[p] for p in pgf_files]
 
-def main():
+
+def convert_many(roots, jobs=None, force=False, use_format=True):
     """
-    Main function to ask for the root folder and process all .pgf files.
+    Convert the .pgf files below each root folder.
+
+    Checks pdflatex once (raising PdflatexNotFound), builds the preamble
+    format per root unless use_format is False, and returns one
+    FigureResult per figure.
     """
-    root_folder = input("Enter the path to the folder containing .pgf files: ").strip()
+    pdflatex_version = check_pdflatex()
 
-    if not os.path.isdir(root_folder):
-        print(f"Error: The provided path '{root_folder}' is not a valid directory.")
-        return
+    results = []
+    for root_folder in roots:
+        if not os.path.isdir(root_folder):
+            raise NotADirectoryError(f"'{root_folder}' is not a valid directory")
 
-    print(f"\nStarting conversion process in '{root_folder}'...")
-    found_pgf_files = False
-    for dirpath, dirnames, filenames in os.walk(root_folder):
-        for filename in filenames:
-            if filename.lower().endswith(".pgf"):
-                found_pgf_files = True
-                pgf_file_path = os.path.join(dirpath, filename)
-                convert_pgf_to_pdf(pgf_file_path)
+        format_path = None
+        if use_format and find_pgf_files(root_folder):
+            format_path = build_format(
+                os.path.join(root_folder, FORMAT_DIR_NAME), pdflatex_version
+            )
+        results.extend(
+            convert_folder(root_folder, jobs=jobs, force=force, format_path=format_path)
+        )
+    return results
 
-    if not found_pgf_files:
-        print(f"No .pgf files found in '{root_folder}' or its subfolders.")
-    else:
-        print("\nConversion process completed.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert matplotlib .pgf figures to standalone PDFs"
+    )
+    parser.add_argument("roots", nargs="+", help="Folders to search for .pgf files")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None,
+        help="Number of figures to compile in parallel (default: CPU count)",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Recompile figures that are up to date"
+    )
+    parser.add_argument(
+        "--no-format", action="store_true",
+        help="Compile the full preamble for every figure instead of a precompiled format",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print a JSON report instead of text"
+    )
+    parser.add_argument(
+        "--trace", metavar="FILE",
+        help="Write the time, CPU and memory of each pdflatex run as a Chrome trace",
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE", help="Write cProfile statistics of the run"
+    )
+    args = parser.parse_args(argv)
+
+    return trace.instrumented(
+        lambda: run(args),
+        trace_path=args.trace and Path(args.trace),
+        profile_path=args.profile and Path(args.profile),
+    )
+
+
+def run(args):
+    try:
+        results = convert_many(
+            args.roots, jobs=args.jobs, force=args.force, use_format=not args.no_format
+        )
+    except (PdflatexNotFound, NotADirectoryError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    failed = [r for r in results if r.status == "failed"]
+
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+        return 1 if failed else 0
+
+    if not results:
+        print("No .pgf files found.")
+        return 0
+
+    for r in results:
+        if r.status == "converted":
+            print(f"Converted '{r.source}' -> '{r.output}' ({r.duration:.1f}s)")
+        elif r.status == "failed":
+            print(f"Error compiling '{r.source}': {r.message}")
+            if r.log_tail:
+                print("--- LaTeX Log (partial) ---")
+                for line in r.log_tail:
+                    print(line)
+                print("---------------------------")
+
+    converted = sum(r.status == "converted" for r in results)
+    skipped = sum(r.status == "skipped" for r in results)
+    print(
+        f"\nConversion process completed: {converted} converted, "
+        f"{skipped} up to date, {len(failed)} failed."
+    )
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -7,7 +7,6 @@
 set -e
 
 BIB_FILE="references.bib"
-DEFAULTS_FILE="config/config.yaml"
 
 # Define all files that contain citations
 ALL_FILES=(
@@ -24,17 +23,10 @@ ALL_FILES=(
 echo "=== Filtering Bibliography ==="
 echo "Source: ${BIB_FILE}"
 
-# Fix URL-encoded underscores in BibTeX file (common in some export formats)
-sed 's/\\%5F/_/g' "${BIB_FILE}" > "${BIB_FILE}.tmp" && mv "${BIB_FILE}.tmp" "${BIB_FILE}"
-
-# Run pandoc with filterbib.lua to extract cited references
-# Output to /dev/null since we only need the filtered.bib side effect
-pandoc --bibliography ${BIB_FILE} \
-       --csl=config/acl.csl \
-       --defaults=${DEFAULTS_FILE} \
-       --lua-filter=latex/filters/filterbib.lua \
-       ${ALL_FILES[*]} \
-       -o /dev/null
+# Collect citation keys from the sources and copy the cited entries in one
+# pass over the bibliography (URL-encoded underscores are fixed on the way;
+# the source .bib is left untouched)
+python3 scripts/dmd bib "${ALL_FILES[@]}" --bib "${BIB_FILE}" --output filtered.bib
 
 echo "Generated: filtered.bib"
 echo "=== Bibliography Filtering Complete ==="
@@ -1,31 +1,19 @@
 #!/bin/sh
 
 # Compile individual papers from Markdown to PDF
-# Processes all .md files in the papers/ directory
+# Processes all .md files in the papers/ directory (or the files given as
+# arguments), compiling them in parallel. Papers whose source, bibliography
+# and configuration are unchanged are skipped, and a paper that fails to
+# compile keeps its previous PDF. Pass --force to recompile everything.
 
 echo "=== Compiling Individual Papers ==="
 
-# Remove old PDFs
-rm -f papers/*.pdf
+if [ $# -eq 0 ]; then
+  set -- papers/*.md
+fi
 
-# Process each markdown file in papers/
-for PAPER in papers/*.md; do
-  echo "---------------------------------"
-  echo "Processing $PAPER"
-
-  # Extract basename without extension
-  BASENAME=$(basename $PAPER .md)
-
-  # Compile to PDF using paper configuration
-  pandoc --bibliography=filtered.bib \
-         --defaults=config/config_paper.yaml \
-         --csl=config/acl.csl \
-         $PAPER \
-         -o papers/${BASENAME}.pdf \
-         --top-level-division=chapter
-
-  echo "Generated papers/${BASENAME}.pdf"
-  echo "---------------------------------"
-done
+python3 scripts/dmd papers "$@"
+STATUS=$?
 
 echo "=== Paper Compilation Complete ==="
+exit $STATUS
@@ -0,0 +1,87 @@
+"""
+Smoke tests for the benchmark suite
+"""
+
+import json
+import pytest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.generate import generate_document, write_project
+from benchmarks.run import Measurement, compare, main, scaling_exponent, to_baseline
+from dmd.parser import DMDParser
+
+
+class TestGenerate:
+    """Test the synthetic document generators"""
+
+    def test_element_count(self):
+        """Test that the reported count is what the parser finds"""
+        text, count = generate_document(500)
+        assert count >= 500
+        assert len(DMDParser(text).tokenize()) == count
+
+    def test_project_labels_unique(self, tmp_path):
+        """Test that labels do not clash across chapters"""
+        files, total = write_project(tmp_path, 250, per_file=100)
+        assert len(files) == 3
+        assert total >= 250
+
+
+class TestRegressionGate:
+    """Test comparison against the stored baseline"""
+
+    def test_compare(self):
+        """Test that worse scaling or larger peaks are reported, but not a slower machine"""
+        baseline = {'parse': {str(size): {'elements_per_s': 1000, 'mb_per_s': 1.0, 'peak_mb': 10.0}
+                              for size in (100, 1000, 10000)}}
+
+        def run(seconds, peak=10.0):
+            return [Measurement('parse', size, size, 0.1, seconds(size), peak) for size in (100, 1000, 10000)]
+
+        linear = run(lambda size: size / 1000)
+        slower_machine = run(lambda size: size / 400)
+        quadratic = run(lambda size: size * size / 1e6)
+        untracked = Measurement('parse', 10, 10, 0.1, 1.0, 10.0)
+
+        assert compare(linear + [untracked], baseline, tolerance=0.3) == []
+        assert compare(slower_machine, baseline, tolerance=0.3) == []
+        assert 'size^2.00' in compare(quadratic, baseline, tolerance=0.3)[0]
+        assert compare(linear[:1], baseline, tolerance=0.3) == []
+        assert 'peak 20.0 MB' in compare(run(lambda size: size / 1000, peak=20.0), baseline, tolerance=0.3)[0]
+
+    def test_calibrated_throughput(self):
+        """Test that a uniform slowdown is reported unless the calibration loop slowed down alike"""
+        def run(seconds):
+            return [Measurement('parse', size, size, 0.1, seconds(size), 10.0) for size in (100, 1000, 10000)]
+
+        baseline = to_baseline(run(lambda size: size / 1000), calibration=0.01)
+        slower = run(lambda size: size / 400)
+
+        assert compare(slower, baseline, tolerance=0.3) == []
+        assert compare(slower, baseline, tolerance=0.3, calibration=0.025) == []
+        assert compare(slower, baseline, tolerance=0.3, calibration=0.01) == [
+            'parse: 2.5x slower than the baseline relative to the calibration loop']
+        assert compare(slower[:1], baseline, tolerance=0.3, calibration=0.01) != []
+        assert compare(slower, baseline, tolerance=0.3, calibration=0.01, throughput_tolerance=2.0) == []
+
+    def test_scaling_exponent(self):
+        """Test the fitted exponent of time against size"""
+        assert scaling_exponent({10: 100.0, 1000: 100.0}) == pytest.approx(1.0)
+        assert scaling_exponent({10: 100.0, 100: 10.0, 1000: 1.0}) == pytest.approx(2.0)
+
+    def test_run(self, tmp_path, capsys):
+        """Test recording a baseline and checking against it"""
+        baseline = tmp_path / 'baseline.json'
+
+        assert main(['--sizes', '10', '--baseline', str(baseline), '--update-baseline']) == 0
+        assert set(json.loads(baseline.read_text())) == {'parse', 'transpile', 'validate'}
+        assert main(['--sizes', '10', '--baseline', str(baseline), '--tolerance', '0.99']) == 0
+        assert 'No regressions' in capsys.readouterr().out
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
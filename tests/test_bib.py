@@ -0,0 +1,148 @@
+"""
+Unit tests for bibliography filtering
+"""
+
+import io
+import pytest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dmd.bib import collect_citations, extract_citations, filter_bib, iter_entries
+from dmd.bibindex import BibIndex
+from dmd.cli import main
+
+
+BIB = b'''% Comment line with an @ sign
+@string{jcl = "Journal of Computational Linguistics"}
+
+@article{smith2020,
+  title={Nested {Braces} and an @ sign},
+  journal=jcl,
+  year={2020}}
+@book{doe_2019, title = {One line}, year = 2019} @misc{inline, note={Same line}}
+@inproceedings(paren2021,
+  title={Parens (inside) braces}
+)
+@article{url\\%5Fkey,
+  title={Encoded underscore}
+}
+'''
+
+
+class TestCitations:
+    """Test citation key extraction from markdown"""
+
+    def test_extract(self):
+        """Test pandoc citation forms"""
+        text = ('Cite [@smith2020; @doe_2019, p. 3] or @inline showed -@{odd.key/1}.\n'
+                'Mail me@example.com, see @smith2020.\n')
+        assert extract_citations(text) == {'smith2020', 'doe_2019', 'inline', 'odd.key/1'}
+
+    def test_cross_references_and_code_ignored(self):
+        """Test that cross-references, DMD directives and code are skipped"""
+        text = ('@fig[plot](a.png) See @fig:plot, @tbl[x] and @sec:intro.\n'
+                'Use `@citekey` syntax.\n\n```\n@notacite\n```\n@real\n')
+        assert extract_citations(text) == {'real'}
+
+    def test_callouts_ignored(self):
+        """Test that callout names are not keys, but citations in the body are"""
+        text = '@note{As @smith2020 shows.}\n\n@warning{Careful} and @tip{x}; see @tip too.\n'
+        assert extract_citations(text) == {'smith2020', 'tip'}
+
+    def test_locator(self):
+        """Test that a citation with an attached locator is kept"""
+        text = '@smith2020[p. 3] says so, unlike @fig[a](the plot) and @tbl[t] Caption.\n'
+        assert extract_citations(text) == {'smith2020'}
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_collect(self, tmp_path, jobs):
+        """Test collecting keys across files"""
+        (tmp_path / 'a.md').write_text('[@one; @two]')
+        (tmp_path / 'b.dmd').write_text('@two and @three')
+        files = [tmp_path / 'a.md', tmp_path / 'b.dmd']
+        assert collect_citations(files, jobs=jobs) == {'one', 'two', 'three'}
+
+
+class TestBibScanner:
+    """Test brace-aware entry scanning"""
+
+    def test_entries(self):
+        """Test entry boundaries, keys and offsets"""
+        entries = list(iter_entries(io.BytesIO(BIB)))
+
+        assert [(e.kind, e.key) for e in entries] == [
+            ('string', None), ('article', 'smith2020'), ('book', 'doe_2019'),
+            ('misc', 'inline'), ('inproceedings', 'paren2021'), ('article', 'url\\%5Fkey'),
+        ]
+        for entry in entries:
+            assert BIB[entry.offset:entry.offset + len(entry.text)] == entry.text
+        assert entries[1].text.endswith(b'year={2020}}')
+        assert entries[4].text.endswith(b')')
+
+    def test_filter(self, tmp_path):
+        """Test that cited entries and macros are written, once"""
+        bib = tmp_path / 'references.bib'
+        bib.write_bytes(BIB + b'@article{smith2020, title={Duplicate}}\n')
+        out = tmp_path / 'filtered.bib'
+
+        found = filter_bib(bib, {'smith2020', 'url_key', 'missing'}, out)
+
+        assert found == {'smith2020', 'url_key'}
+        assert [(e.kind, e.key) for e in iter_entries(io.BytesIO(out.read_bytes()))] == [
+            ('string', None), ('article', 'smith2020'), ('article', 'url_key'),
+        ]
+        assert b'Duplicate' not in out.read_bytes()
+
+    def test_cli(self, tmp_path, monkeypatch, capsys):
+        """Test the `dmd bib` command, with suggestions for unknown keys"""
+        monkeypatch.chdir(tmp_path)
+        Path('references.bib').write_bytes(BIB)
+        Path('ch.md').write_text('See @inline and @smith202.')
+
+        assert main(['bib', 'ch.md', '-j', '1']) == 0
+        assert b'@misc{inline' in Path('filtered.bib').read_bytes()
+        assert Path('.dmd-cache', 'bib.sqlite').exists()
+
+        err = capsys.readouterr().err
+        assert '@smith202' in err
+        assert 'Did you mean: @smith2020?' in err
+        assert main(['bib', 'ch.md', '-j', '1', '--strict']) == 1
+
+
+class TestBibIndex:
+    """Test offset-based filtering through the key index"""
+
+    def test_matches_scan(self, tmp_path):
+        """Test that indexed filtering writes exactly what a scan writes"""
+        bib = tmp_path / 'references.bib'
+        bib.write_bytes(BIB + b'@article{smith2020, title={Duplicate}}\n')
+        index = BibIndex(tmp_path / 'bib.sqlite')
+        keys = {'smith2020', 'url_key', 'paren2021', 'inline', 'missing'}
+
+        scanned = filter_bib(bib, keys, tmp_path / 'scanned.bib')
+        indexed = filter_bib(bib, keys, tmp_path / 'indexed.bib', index=index)
+
+        assert indexed == scanned
+        assert (tmp_path / 'indexed.bib').read_bytes() == (tmp_path / 'scanned.bib').read_bytes()
+        assert sorted(index.keys(bib)) == ['doe_2019', 'inline', 'paren2021', 'smith2020', 'url_key']
+
+    def test_invalidated_by_change(self, tmp_path):
+        """Test that the index is rebuilt only when the file changes"""
+        bib = tmp_path / 'references.bib'
+        bib.write_bytes(BIB)
+        index = BibIndex(tmp_path / 'bib.sqlite')
+
+        assert index.refresh(bib)
+        assert not BibIndex(tmp_path / 'bib.sqlite').refresh(bib)
+
+        bib.write_bytes(b'@misc{new, note={Prepended}}\n' + BIB)
+        assert index.lookup(bib, ['new', 'inline'])['new'] == (0, 28)
+        offset, length = index.lookup(bib, ['inline'])['inline']
+        assert bib.read_bytes()[offset:offset + length].startswith(b'@misc{inline')
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
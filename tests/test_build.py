@@ -0,0 +1,297 @@
+"""
+Unit tests for the DMD build orchestrator
+"""
+
+import json
+import os
+import threading
+import pytest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dmd.build import (BuildError, BuildState, Task, plan_build, plan_papers, resolve_dependencies,
+                       run_tasks, select_tasks)
+
+
+def copy_task(name, source, target, log):
+    """Task copying `source` to `target`, recording each run in `log`"""
+    def action():
+        log.append(name)
+        target.write_text(source.read_text().upper())
+    return Task(name=name, action=action, inputs=[source], outputs=[target])
+
+
+class TestScheduler:
+    """Test staleness, ordering and failure handling"""
+
+    def test_only_stale_tasks_run(self, tmp_path):
+        """Test that unchanged inputs skip a task and changed ones rerun it"""
+        a, b, c = tmp_path / 'a', tmp_path / 'b', tmp_path / 'c'
+        a.write_text('x')
+        log = []
+        tasks = [copy_task('second', b, c, log), copy_task('first', a, b, log)]
+        state_path = tmp_path / 'state.json'
+
+        results = run_tasks(tasks, BuildState(state_path), jobs=2)
+        assert log == ['first', 'second']
+        assert [r.status for r in results] == ['built', 'built']
+
+        log.clear()
+        run_tasks(tasks, BuildState(state_path))
+        assert log == []
+
+        # Same content after a rewrite: nothing to do
+        a.write_text('x')
+        run_tasks(tasks, BuildState(state_path))
+        assert log == []
+
+        a.write_text('y')
+        run_tasks(tasks, BuildState(state_path))
+        assert log == ['first', 'second']
+
+        c.unlink()
+        log.clear()
+        run_tasks(tasks, BuildState(state_path))
+        assert log == ['second']
+
+    def test_failure_skips_dependents(self, tmp_path):
+        """Test that a failed task blocks only what depends on it"""
+        def fail():
+            raise BuildError('broken')
+
+        a = tmp_path / 'a'
+        a.write_text('x')
+        log = []
+        tasks = [
+            Task(name='broken', action=fail, inputs=[a], outputs=[tmp_path / 'b']),
+            copy_task('blocked', tmp_path / 'b', tmp_path / 'c', log),
+            copy_task('independent', a, tmp_path / 'd', log),
+        ]
+
+        results = run_tasks(tasks, BuildState())
+
+        assert [(r.status, r.message) for r in results] == [
+            ('failed', 'broken'), ('skipped', 'broken failed'), ('built', None)]
+        assert log == ['independent']
+
+    def test_independent_tasks_run_in_parallel(self, tmp_path):
+        """Test that ready tasks are started together"""
+        barrier = threading.Barrier(3, timeout=5)
+        tasks = [Task(name=str(i), action=barrier.wait) for i in range(3)]
+
+        results = run_tasks(tasks, BuildState(), jobs=3)
+
+        assert all(r.status == 'built' for r in results)
+
+    def test_dry_run(self, tmp_path):
+        """Test that a dry run reports downstream tasks as stale and runs nothing"""
+        a, b, c = tmp_path / 'a', tmp_path / 'b', tmp_path / 'c'
+        a.write_text('x')
+        log = []
+        tasks = [copy_task('first', a, b, log), copy_task('second', b, c, log)]
+        state = BuildState(tmp_path / 'state.json')
+        run_tasks(tasks, state)
+
+        a.write_text('y')
+        log.clear()
+        results = run_tasks(tasks, BuildState(tmp_path / 'state.json'), dry_run=True)
+
+        assert [r.status for r in results] == ['would build', 'would build']
+        assert log == []
+
+    def test_cycle(self, tmp_path):
+        """Test that cyclic graphs are rejected"""
+        a, b = tmp_path / 'a', tmp_path / 'b'
+        tasks = [copy_task('one', a, b, []), copy_task('two', b, a, [])]
+
+        with pytest.raises(BuildError, match='cycle'):
+            resolve_dependencies(tasks)
+
+
+class TestPlan:
+    """Test building the task graph from dmd.yaml"""
+
+    def write_project(self, tmp_path):
+        (tmp_path / 'chapters').mkdir()
+        (tmp_path / 'config').mkdir()
+        (tmp_path / 'chapters' / 'intro.dmd').write_text('@fig[a](a.png) A.\n\nSee @fig[a] [@cited].\n')
+        (tmp_path / 'chapters' / 'end.md').write_text('Done.\n')
+        (tmp_path / 'config' / 'config.yaml').write_text(
+            'filters:\n  - citeproc\n'
+            'include-before-body:\n  - __frontmatter.filled.tex\n'
+            'include-after-body:\n  - __backmatter.filled.tex\n'
+            'toc: true\n'
+        )
+        (tmp_path / 'references.bib').write_text('@book{cited, title={A}}\n@book{other, title={B}}\n')
+        return {
+            'structure': {'parts': [{'chapters': ['chapters/intro.md', 'chapters/end.md']}]},
+            'build': {'transpiler': {'enabled': True, 'validate_before_build': True}},
+            'validation': {'check_paper_pdfs': False},
+        }
+
+    def test_graph(self, tmp_path):
+        """Test that DMD chapters are validated and transpiled before use"""
+        config = self.write_project(tmp_path)
+        tasks = plan_build(config, tmp_path)
+        deps = resolve_dependencies(tasks)
+
+        assert deps['transpile:chapters/intro.md'] == {'validate'}
+        assert deps['bib'] == {'transpile:chapters/intro.md'}
+        assert deps['thesis'] == {'transpile:chapters/intro.md', 'bib', 'frontmatter', 'backmatter'}
+
+    def test_fragment_graph(self, tmp_path):
+        """Test that chapter fragments depend only on their own inputs"""
+        config = self.write_project(tmp_path)
+        tasks = {t.name: t for t in plan_build(config, tmp_path, fragments=True)}
+        deps = resolve_dependencies(list(tasks.values()))
+
+        assert deps['fragment:chapters/end.md'] == {'bib'}
+        assert deps['fragment:chapters/intro.md'] == {'transpile:chapters/intro.md', 'bib'}
+        assert deps['master'] == {'frontmatter', 'backmatter'}
+        assert deps['thesis'] == {'master', 'fragment:chapters/intro.md', 'fragment:chapters/end.md'}
+        assert tmp_path / 'meta.yaml' not in tasks['fragment:chapters/end.md'].inputs
+
+    @pytest.mark.skipif(os.name != 'posix', reason='uses a shell script as pandoc')
+    def test_fragments_have_no_preamble(self, tmp_path, monkeypatch):
+        """Test that fragments are converted without the settings that make a full document"""
+        bin_dir = tmp_path / 'bin'
+        bin_dir.mkdir()
+        (bin_dir / 'pandoc').write_text(STANDALONE_PANDOC)
+        (bin_dir / 'pandoc').chmod(0o755)
+        monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        config = self.write_project(tmp_path)
+
+        tasks = select_tasks(plan_build(config, tmp_path, fragments=True), ['fragment:*'])
+        # Fragments in parallel share the defaults file
+        results = run_tasks(tasks, BuildState(tmp_path / 'state.json'), jobs=2)
+
+        assert all(r.status == 'built' for r in results), [r.message for r in results]
+        fragment_dir = tmp_path / '.dmd-cache' / 'fragments'
+        for name in ('chapters-intro.tex', 'chapters-end.tex'):
+            assert '\\documentclass' not in (fragment_dir / name).read_text()
+        assert 'citeproc' in (fragment_dir / 'defaults.yaml').read_text()
+        assert not list(fragment_dir.glob('*.tmp'))
+
+    def test_build_bib(self, tmp_path):
+        """Test running a target together with what it depends on"""
+        config = self.write_project(tmp_path)
+        tasks = select_tasks(plan_build(config, tmp_path), ['bib'])
+
+        results = run_tasks(tasks, BuildState(tmp_path / 'state.json'), jobs=2)
+
+        assert [r.name for r in results] == ['validate', 'transpile:chapters/intro.md', 'bib']
+        assert all(r.status == 'built' for r in results)
+        filtered = (tmp_path / 'filtered.bib').read_text()
+        assert 'cited' in filtered and 'other' not in filtered
+
+    def test_missing_chapter(self, tmp_path):
+        """Test that missing content files are reported before building"""
+        config = self.write_project(tmp_path)
+        config['structure']['parts'][0]['chapters'].append('chapters/missing.md')
+
+        with pytest.raises(BuildError, match='chapters/missing.md'):
+            plan_build(config, tmp_path)
+
+    @pytest.mark.skipif(os.name != 'posix', reason='uses a shell script as pandoc')
+    @pytest.mark.parametrize('fragments', [False, True])
+    def test_lowered_chapters_skip_idle_filters(self, tmp_path, monkeypatch, fragments):
+        """Test that Lua filters with nothing left to rewrite are not run on lowered chapters"""
+        bin_dir = tmp_path / 'bin'
+        bin_dir.mkdir()
+        (bin_dir / 'pandoc').write_text(FAKE_PANDOC)
+        (bin_dir / 'pandoc').chmod(0o755)
+        monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        config = self.write_project(tmp_path)
+        config['build']['transpiler']['target'] = 'latex'
+        lua = ['latex/filters/short-captions.lua', 'latex/filters/short-captions-table.lua',
+               'latex/filters/filterboxes.lua']
+        (tmp_path / 'latex' / 'filters').mkdir(parents=True)
+        for path in lua:
+            (tmp_path / path).write_text('')
+        (tmp_path / 'config' / 'config.yaml').write_text(
+            'filters: [citeproc, ' + ', '.join(lua) + ']\ntoc: true\n')
+        # The caption has markup, so this figure is left to short-captions.lua
+        (tmp_path / 'chapters' / 'intro.dmd').write_text(
+            '@fig[a](a.png){short="A"} A *b*.\n\n@note{Lowered to a tcolorbox.}\n')
+
+        tasks = {t.name: t for t in plan_build(config, tmp_path, fragments=fragments)}
+        run_tasks([tasks['transpile:chapters/intro.md']], BuildState())
+        for name in ('fragment:chapters/intro.md', 'fragment:chapters/end.md') if fragments else ('thesis',):
+            tasks[name].action()
+
+        def filters(path):
+            return json.loads((tmp_path / '.dmd-cache' / path).read_text())['filters']
+
+        if fragments:
+            assert filters('fragments/chapters-intro.defaults.yaml') == ['citeproc'] + lua[:2]
+            assert filters('fragments/chapters-end.defaults.yaml') == ['citeproc']
+        else:
+            assert filters('latex/defaults.yaml') == ['citeproc'] + lua[:2]
+            assert '.dmd-cache/latex/defaults.yaml' in (tmp_path / 'thesis.pdf').read_text()
+
+
+FAKE_PANDOC = """#!/bin/sh
+for arg; do [ "$prev" = "-o" ] && out=$arg; prev=$arg; done
+case "$*" in *broken*) echo "pandoc: failed" >&2; echo partial > "$out"; exit 1;; esac
+echo "$@" > "$out"
+"""
+
+
+# Writes a complete document, as pandoc does, when its defaults file
+# includes files in the header or body or asks for a table of contents
+STANDALONE_PANDOC = """#!/bin/sh
+for arg; do
+  [ "$prev" = "-o" ] && out=$arg
+  case "$arg" in --defaults=*) defaults=${arg#--defaults=};; esac
+  prev=$arg
+done
+if grep -Eq '"?(include-[a-z-]+|toc|standalone)"?:' "$defaults"; then
+  printf '\\documentclass{scrbook}\n\\begin{document}\nbody\n\\end{document}\n' > "$out"
+else
+  echo body > "$out"
+fi
+"""
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='uses a shell script as pandoc')
+class TestPapers:
+    """Test paper compilation without dmd.yaml"""
+
+    def test_incremental_and_failure(self, tmp_path, monkeypatch):
+        """Test that unchanged papers are skipped and failed ones keep their PDF"""
+        bin_dir = tmp_path / 'bin'
+        bin_dir.mkdir()
+        (bin_dir / 'pandoc').write_text(FAKE_PANDOC)
+        (bin_dir / 'pandoc').chmod(0o755)
+        monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+        (tmp_path / 'config').mkdir()
+        (tmp_path / 'config' / 'config_paper.yaml').write_text('filters:\n  - citeproc\n')
+        (tmp_path / 'references.bib').write_text('')
+        (tmp_path / 'papers').mkdir()
+        for name in ('one', 'two', 'broken'):
+            (tmp_path / 'papers' / f'{name}.md').write_text(f'# {name}\n')
+        (tmp_path / 'papers' / 'broken.pdf').write_text('previous')
+        sources = ['papers/one.md', 'papers/two.md', 'papers/broken.md']
+        state_path = tmp_path / 'state.json'
+
+        results = run_tasks(plan_papers(tmp_path, sources), BuildState(state_path), jobs=3)
+        assert [(r.name, r.status) for r in results] == [
+            ('paper:one', 'built'), ('paper:two', 'built'), ('paper:broken', 'failed')]
+        assert (tmp_path / 'papers' / 'broken.pdf').read_text() == 'previous'
+        assert not [p for p in (tmp_path / 'papers').iterdir() if p.name.startswith('.')]
+
+        (tmp_path / 'papers' / 'two.md').write_text('# two, revised\n')
+        results = run_tasks(plan_papers(tmp_path, sources), BuildState(state_path))
+        assert [r.status for r in results] == ['up-to-date', 'built', 'failed']
+
+        (tmp_path / 'config' / 'config_paper.yaml').write_text('filters: []\n')
+        results = run_tasks(plan_papers(tmp_path, sources[:2]), BuildState(state_path))
+        assert [r.status for r in results] == ['built', 'built']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
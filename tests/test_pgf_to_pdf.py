@@ -0,0 +1,176 @@
+"""
+Unit tests for the .pgf figure converter
+
+pdflatex is replaced by a stub that writes the files a successful run
+would, so these tests run without a LaTeX installation.
+"""
+
+import importlib.util
+import json
+import os
+import subprocess
+import pytest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+SCRIPT = Path(__file__).parent.parent / 'figures-generated' / 'pgf_to_pdf.py'
+spec = importlib.util.spec_from_file_location('pgf_to_pdf', SCRIPT)
+pgf_to_pdf = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pgf_to_pdf)
+
+
+@pytest.fixture
+def pdflatex(monkeypatch):
+    """Stub for trace.run that records the job of every pdflatex call"""
+    calls = []
+
+    def run(command, cwd=None, name=None, text=False, **kwargs):
+        if '-ini' in command:
+            calls.append('format')
+            Path(cwd, pgf_to_pdf.FORMAT_NAME + '.fmt').write_text('format')
+            return subprocess.CompletedProcess(command, 0, '', '')
+
+        job = Path(command[-1]).stem
+        calls.append(job)
+        if 'broken' in job:
+            Path(cwd, job + '.log').write_text('! Undefined control sequence.\n')
+            return subprocess.CompletedProcess(command, 1, '', '')
+        Path(cwd, job + '.pdf').write_text('pdf')
+        return subprocess.CompletedProcess(command, 0, '', '')
+
+    monkeypatch.setattr(pgf_to_pdf.trace, 'run', run)
+    monkeypatch.setattr(pgf_to_pdf, 'check_pdflatex', lambda: 'pdfTeX 3.141592653')
+    return calls
+
+
+def write_figures(root, *names):
+    for name in names:
+        (root / f'{name}.pgf').write_text(f'\\begin{{pgfpicture}}{name}\\end{{pgfpicture}}\n')
+
+
+def statuses(results):
+    return {Path(r.source).stem: r.status for r in results}
+
+
+def set_mtime(path, seconds):
+    os.utime(path, (seconds, seconds))
+
+
+class TestConvertFolder:
+    """Test which figures are recompiled"""
+
+    def test_skip_on_hash_match(self, tmp_path, pdflatex):
+        """Test that a recorded hash keeps a PDF even when it is older than its source"""
+        write_figures(tmp_path, 'a', 'b')
+
+        assert statuses(pgf_to_pdf.convert_folder(str(tmp_path))) == {'a': 'converted', 'b': 'converted'}
+        assert sorted(pdflatex) == ['a', 'b']
+
+        # A checkout that touches the source but keeps its content
+        set_mtime(tmp_path / 'a.pdf', 1000)
+        set_mtime(tmp_path / 'a.pgf', 2000)
+        (tmp_path / 'b.pgf').write_text('changed')
+        pdflatex.clear()
+
+        assert statuses(pgf_to_pdf.convert_folder(str(tmp_path))) == {'a': 'skipped', 'b': 'converted'}
+        assert pdflatex == ['b']
+
+    def test_skip_on_newer_pdf_without_manifest(self, tmp_path, pdflatex):
+        """Test the mtime fallback for PDFs built before the manifest existed"""
+        write_figures(tmp_path, 'new', 'old')
+        for name, pdf_time in (('new', 2000), ('old', 500)):
+            (tmp_path / f'{name}.pdf').write_text('pdf')
+            set_mtime(tmp_path / f'{name}.pgf', 1000)
+            set_mtime(tmp_path / f'{name}.pdf', pdf_time)
+
+        assert statuses(pgf_to_pdf.convert_folder(str(tmp_path))) == {'new': 'skipped', 'old': 'converted'}
+        assert pdflatex == ['old']
+
+    def test_preamble_change_rebuilds(self, tmp_path, pdflatex, monkeypatch):
+        """Test that every figure is recompiled when the shared preamble changes"""
+        write_figures(tmp_path, 'a', 'b')
+        pgf_to_pdf.convert_folder(str(tmp_path))
+        pdflatex.clear()
+
+        monkeypatch.setattr(pgf_to_pdf, 'LATEX_PREAMBLE', pgf_to_pdf.LATEX_PREAMBLE + '\\usepackage{bm}\n')
+
+        assert statuses(pgf_to_pdf.convert_folder(str(tmp_path))) == {'a': 'converted', 'b': 'converted'}
+        assert sorted(pdflatex) == ['a', 'b']
+
+    def test_manifest_pruned(self, tmp_path, pdflatex):
+        """Test that removed figures are dropped and failed ones are not recorded"""
+        (tmp_path / 'sub').mkdir()
+        write_figures(tmp_path, 'a', 'gone', 'broken')
+        write_figures(tmp_path / 'sub', 'c')
+
+        results = pgf_to_pdf.convert_folder(str(tmp_path), jobs=2)
+        manifest = json.loads((tmp_path / pgf_to_pdf.MANIFEST_NAME).read_text())
+        assert sorted(manifest) == ['a.pgf', 'gone.pgf', os.path.join('sub', 'c.pgf')]
+        failed = [r for r in results if r.status == 'failed']
+        assert failed[0].message == 'pdflatex exited with code 1'
+        assert failed[0].log_tail == ['! Undefined control sequence.']
+
+        (tmp_path / 'gone.pgf').unlink()
+        pgf_to_pdf.convert_folder(str(tmp_path))
+
+        manifest = json.loads((tmp_path / pgf_to_pdf.MANIFEST_NAME).read_text())
+        assert sorted(manifest) == ['a.pgf', os.path.join('sub', 'c.pgf')]
+
+
+class TestFormat:
+    """Test the precompiled preamble"""
+
+    def test_reused_until_stamp_changes(self, tmp_path, pdflatex, monkeypatch):
+        """Test that the format is rebuilt only for a new preamble or pdflatex version"""
+        format_dir = str(tmp_path / pgf_to_pdf.FORMAT_DIR_NAME)
+
+        path = pgf_to_pdf.build_format(format_dir, 'pdfTeX 1')
+        assert path == os.path.abspath(os.path.join(format_dir, pgf_to_pdf.FORMAT_NAME))
+        assert pgf_to_pdf.build_format(format_dir, 'pdfTeX 1') == path
+        assert pdflatex == ['format']
+
+        pgf_to_pdf.build_format(format_dir, 'pdfTeX 2')
+        monkeypatch.setattr(pgf_to_pdf, 'LATEX_PREAMBLE', pgf_to_pdf.LATEX_PREAMBLE + '%\n')
+        pgf_to_pdf.build_format(format_dir, 'pdfTeX 2')
+        assert pdflatex == ['format'] * 3
+
+    def test_failed_format_falls_back(self, tmp_path, monkeypatch):
+        """Test that figures compile the preamble themselves if no format could be built"""
+        monkeypatch.setattr(pgf_to_pdf.trace, 'run',
+                            lambda command, **kwargs: subprocess.CompletedProcess(command, 1, '', ''))
+
+        assert pgf_to_pdf.build_format(str(tmp_path / 'format'), 'pdfTeX 1') is None
+
+
+class TestReport:
+    """Test the command line and its JSON report"""
+
+    def test_json(self, tmp_path, pdflatex, capsys):
+        """Test one report entry per figure across roots, and the exit status"""
+        one, two = tmp_path / 'one', tmp_path / 'two'
+        one.mkdir()
+        two.mkdir()
+        write_figures(one, 'a')
+        write_figures(two, 'broken')
+
+        assert pgf_to_pdf.main([str(one), str(two), '--json']) == 1
+
+        report = json.loads(capsys.readouterr().out)
+        assert [(Path(r['source']).name, r['status']) for r in report] == [
+            ('a.pgf', 'converted'), ('broken.pgf', 'failed')]
+        assert pdflatex.count('format') == 2
+
+        (two / 'broken.pgf').unlink()
+        assert pgf_to_pdf.main([str(one), str(two), '--json', '--no-format']) == 0
+        assert [r['status'] for r in json.loads(capsys.readouterr().out)] == ['skipped']
+
+    def test_missing_root(self, tmp_path, pdflatex, capsys):
+        assert pgf_to_pdf.main([str(tmp_path / 'nowhere')]) == 2
+        assert 'not a valid directory' in capsys.readouterr().err
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
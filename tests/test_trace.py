@@ -0,0 +1,94 @@
+"""
+Unit tests for build tracing
+"""
+
+import json
+import os
+import sys
+import pytest
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dmd import trace
+from dmd.cli import main
+from dmd.transpile import DMDTranspiler
+
+
+@pytest.fixture
+def tracer():
+    tracer = trace.enable()
+    yield tracer
+    trace.disable()
+
+
+class TestSpans:
+    """Test recording of in-process stages"""
+
+    def test_disabled_by_default(self):
+        """Test that nothing is recorded without a tracer"""
+        assert trace.disable() is None
+        with trace.span('stage'):
+            pass
+
+    def test_transpile_stages(self, tracer):
+        """Test that transpiling records its stages with CPU time and memory"""
+        DMDTranspiler().transpile_content('@fig[a](a.png) Caption.\n\nSee @fig[a].\n')
+
+        names = [span.name for span in tracer.spans]
+        assert names == ['transpile:rewrite']
+        assert all(span.cpu is not None and span.duration >= 0 for span in tracer.spans)
+
+    def test_chrome_format(self, tracer, tmp_path):
+        """Test the trace-event document"""
+        with trace.span('outer', 'task', file='a.md'):
+            with trace.span('inner'):
+                pass
+        tracer.write(tmp_path / 'trace.json')
+
+        events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+        assert [(e['name'], e['cat'], e['ph']) for e in events] == [('inner', 'dmd', 'X'), ('outer', 'task', 'X')]
+        assert events[1]['args']['file'] == 'a.md'
+        assert events[1]['ts'] <= events[0]['ts']
+        assert set(tracer.totals()) == {'dmd', 'task'}
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs a shell')
+class TestExternalTools:
+    """Test tracing of subprocesses"""
+
+    @pytest.mark.parametrize('enabled', [False, True])
+    def test_run(self, enabled):
+        """Test that output and exit status match subprocess.run, traced or not"""
+        tracer = trace.enable() if enabled else None
+        try:
+            result = trace.run(['sh', '-c', 'echo out; echo err >&2; exit 3'], text=True)
+        finally:
+            trace.disable()
+
+        assert (result.returncode, result.stdout, result.stderr) == (3, 'out\n', 'err\n')
+        if enabled:
+            [span] = tracer.spans
+            assert span.category == 'external' and span.name == 'sh'
+            assert span.cpu is not None and span.max_rss_mb > 0
+
+
+class TestCommandLine:
+    """Test the --trace and --profile options"""
+
+    def test_trace_and_profile(self, tmp_path, monkeypatch, capsys):
+        """Test that a command writes both files"""
+        monkeypatch.chdir(tmp_path)
+        Path('references.bib').write_text('@misc{a, note={A}}\n')
+        Path('ch.md').write_text('See @a.\n')
+
+        assert main(['--trace', 'trace.json', '--profile', 'run.prof', 'bib', 'ch.md', '-j', '1']) == 0
+
+        assert 'traceEvents' in json.loads(Path('trace.json').read_text())
+        assert Path('run.prof').stat().st_size > 0
+        assert 'Profile written to run.prof' in capsys.readouterr().err
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
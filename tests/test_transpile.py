@@ -3,6 +3,8 @@ Unit tests for DMD transpiler
 """
 
 import pytest
+import subprocess
+from io import StringIO
 from pathlib import Path
 import sys
 
@@ -11,6 +13,8 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from dmd.transpile import DMDTranspiler
 from dmd.parser import DMDParser
+from dmd.batch import collect_inputs, default_output, transpile_many
+from dmd.cache import TranspileCache
 
 
 class TestFigureSyntax:
@@ -88,6 +92,71 @@ class TestTableSyntax:
         assert transpiler.stats['tables'] == 1
 
 
+    def test_multiple_tables(self):
+        """Test that each caption lands after its own table"""
+        input_md = '''@tbl[first] First caption
+
+| A |
+|---|
+| 1 |
+
+Text between.
+
+@tbl[second] Second caption
+| B |
+|---|
+| 2 |'''
+        transpiler = DMDTranspiler()
+        result = transpiler.transpile_content(input_md)
+
+        assert result == '''
+| A |
+|---|
+| 1 |
+
+: First caption {#tbl:first}
+
+Text between.
+
+| B |
+|---|
+| 2 |
+
+: Second caption {#tbl:second}'''
+        assert transpiler.stats['tables'] == 2
+
+    def test_table_directive_without_table(self):
+        """Test that a caption with no table below stays in place"""
+        input_md = '@tbl[orphan] Lonely caption\n\nJust a paragraph.\n'
+        transpiler = DMDTranspiler()
+        result = transpiler.transpile_content(input_md)
+
+        assert result == ': Lonely caption {#tbl:orphan}\n\nJust a paragraph.\n'
+
+    @pytest.mark.parametrize('target, expected', [
+        ('markdown', ': Results, see @fig:a and \\eqref{eq:e} {#tbl:t1}'),
+        ('latex', ': Results, see \\autoref{fig:a} and \\eqref{eq:e} {#tbl:t1}'),
+    ])
+    def test_references_in_caption(self, target, expected):
+        """Test that references move with the caption and are rewritten"""
+        transpiler = DMDTranspiler(target=target)
+        result = transpiler.transpile_content('@tbl[t1] Results, see @fig[a] and @eq[e]\n\n| a |\n|---|\n| 1 |\n')
+
+        assert result == '\n| a |\n|---|\n| 1 |\n\n' + expected + '\n'
+        assert transpiler.stats['cross_refs'] == 2
+        assert DMDTranspiler().process_tables('@tbl[t] See @fig[a]\n| a |\n') == '| a |\n\n: See @fig[a] {#tbl:t}\n'
+
+    def test_element_across_last_row(self):
+        """Test that the caption goes after an element that wraps out of the table"""
+        reference = '@tbl[t] Cap\n| a | see @fig[x](the\nfigure) |\n\nmore\n'
+        figure = '@tbl[t] Cap\n| a | b |\n| c | @fig[x](img.png)\nCaption here.\n\nmore\n'
+
+        assert DMDTranspiler().transpile_content(reference) == (
+            '| a | see [the\nfigure](#fig:x) |\n\n: Cap {#tbl:t}\n\nmore\n')
+        assert DMDTranspiler().transpile_content(figure) == (
+            '| a | b |\n| c | ![Caption here.](img.png){#fig:x}\n\n: Cap {#tbl:t}\n\nmore\n')
+
+
 class TestCrossReferences:
     """Test cross-reference syntax transpilation"""
 
@@ -133,6 +202,26 @@ class TestCrossReferences:
         assert 'Maxwell\'s equation \\eqref{eq:maxwell}' in result
 
 
+    def test_repeated_identical_references(self):
+        """Test that identical references are each rewritten in place"""
+        input_md = '@fig[x] then @eq[y], and again @fig[x] and @eq[y].'
+        transpiler = DMDTranspiler()
+        result = transpiler.transpile_content(input_md)
+
+        assert result == '@fig:x then \\eqref{eq:y}, and again @fig:x and \\eqref{eq:y}.'
+        assert transpiler.stats['cross_refs'] == 4
+
+    def test_reference_inside_callout(self):
+        """Test that references in a callout body are rewritten too"""
+        input_md = '@note{Compare @fig[a] with @tbl[b].}'
+        transpiler = DMDTranspiler()
+        result = transpiler.transpile_content(input_md)
+
+        assert result == '::: {.bluebox title="Note"}\nCompare @fig:a with @tbl:b.\n:::'
+        assert transpiler.stats['callouts'] == 1
+        assert transpiler.stats['cross_refs'] == 2
+
+
 class TestCallouts:
     """Test callout syntax transpilation"""
 
@@ -165,6 +254,53 @@ class TestCallouts:
         assert '::: {.graybox title="Tip"}' in result
 
 
+class TestLatexTarget:
+    """Test lowering DMD elements to raw LaTeX"""
+
+    def test_figure(self):
+        """Test that figures become the LaTeX short-captions.lua would write"""
+        input_md = 'Text.\n@fig[a](img/a.png){w=50% short="Short & sweet"} Long caption, 10% off.\nMore.'
+        result = DMDTranspiler(target='latex').transpile_content(input_md)
+
+        assert result == ('Text.\n\n```{=latex}\n'
+                          '\\begin{figure}\n'
+                          '\\centering\n'
+                          '\\includegraphics[keepaspectratio,width=0.5\\linewidth]{img/a.png}\n'
+                          '\\caption[Short \\& sweet]{Long caption, 10\\% off.}\\label{fig:a}\n'
+                          '\\end{figure}\n'
+                          '```\n\nMore.')
+
+    def test_figure_with_markup_is_left_to_pandoc(self):
+        """Test that captions Pandoc has to render keep the markdown form"""
+        transpiler = DMDTranspiler(target='latex')
+
+        assert transpiler.transpile_content('@fig[a](a.png) An *emphasised* caption with $x$.') == \
+            '![An *emphasised* caption with $x$.](a.png){#fig:a}'
+        assert transpiler.transpile_content('See @fig[a](a.png) inline.').startswith('See ![')
+
+    def test_references(self):
+        """Test that references become LaTeX commands"""
+        input_md = 'See @fig[a], @tbl[b](this table), @sec[c](*that*) and @eq[d].'
+        result = DMDTranspiler(target='latex').transpile_content(input_md)
+
+        assert result == 'See \\autoref{fig:a}, \\hyperref[tbl:b]{this table}, [*that*](#sec:c) and \\eqref{eq:d}.'
+
+    def test_callout(self):
+        """Test that callouts become tcolorbox environments around their body"""
+        result = DMDTranspiler(target='latex').transpile_content('@warning{Mind @fig[a].}')
+
+        assert result.startswith('```{=latex}\n\\begin{tcolorbox}[colback=orange!10!white, '
+                                 'colframe=orange!20!white, coltitle=black, title=\\textbf{Warning}, ')
+        assert result.endswith(']\n```\n\nMind \\autoref{fig:a}.\n\n```{=latex}\n\\end{tcolorbox}\n```')
+
+    def test_target_in_cache_key(self):
+        """Test that the default target keeps existing cache keys"""
+        assert DMDTranspiler().cache_options() == {'callout_styles': DMDTranspiler.CALLOUT_STYLES}
+        assert DMDTranspiler(target='latex').cache_options()['target'] == 'latex'
+        with pytest.raises(ValueError):
+            DMDTranspiler(target='json')
+
+
 class TestBackwardCompatibility:
     """Test backward compatibility with standard markdown"""
 
@@ -210,6 +346,210 @@ Reference both: @fig[std] and @fig[enhanced].
         assert '@fig:enhanced' in result
 
 
+class TestStreaming:
+    """Test chunked transpilation against whole-document transpilation"""
+
+    DOCUMENT = '''# Chapter
+
+@fig[a](a.png){w=50%
+short="A"}
+Caption on the next line.
+
+@note{A callout
+
+spanning paragraphs, see @fig[a].}
+
+@tbl[t] Results
+
+| A | B |
+|---|---|
+| 1 | 2 |
+
+As @tbl[t](the table) shows, @eq[e] holds.
+
+@warning{Wrapped
+@tbl[w] Inside
+| a |
+| b |}
+
+@tbl[u] First, see @fig[a]
+| x |
+|---|
+@tbl[v] Second
+| @tbl[t](T) | 2 |
+|---|---|
+| 3 | @eq[e] |
+'''
+
+    @pytest.mark.parametrize('target', DMDTranspiler.TARGETS)
+    @pytest.mark.parametrize('chunk_size', [1, 8, 64, 1 << 16])
+    def test_stream_matches_content(self, chunk_size, target):
+        """Test that every chunk size yields identical output and stats"""
+        expected_transpiler = DMDTranspiler(target=target)
+        expected = expected_transpiler.transpile_content(self.DOCUMENT)
+
+        transpiler = DMDTranspiler(target=target)
+        output = StringIO()
+        transpiler.transpile_stream(StringIO(self.DOCUMENT), output, chunk_size=chunk_size)
+
+        assert output.getvalue() == expected
+        assert transpiler.stats == expected_transpiler.stats
+
+    def test_large_table(self):
+        """Test that a table much larger than the chunk size is not held in memory"""
+        import tracemalloc
+
+        def lines():
+            yield '@tbl[big] Big, see @eq[e]\n\n| n | ref |\n|---|---|\n'
+            for i in range(10000):
+                yield f'| {i} | @fig[f{i % 7}] |\n'
+            yield '\nAfter.\n'
+
+        document = ''.join(lines())
+        output = StringIO()
+        DMDTranspiler().transpile_stream(lines(), output, chunk_size=1024)
+        assert output.getvalue() == DMDTranspiler().transpile_content(document)
+
+        class Discard:
+            def write(self, text):
+                pass
+
+        # Holding the table re-scanned all of it for every chunk
+        tracemalloc.start()
+        try:
+            DMDTranspiler().transpile_stream(lines(), Discard(), chunk_size=1024)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < len(document) / 4
+
+    def test_open_directive_detection(self):
+        """Test detection of directives cut off by the end of the buffer"""
+        assert DMDParser('@note{not closed yet\n').has_open_directive()
+        assert DMDParser('See @fig[a](custom\n').has_open_directive()
+        assert not DMDParser('@note{closed} and @fig[a].\n').has_open_directive()
+
+
+class TestBatch:
+    """Test multi-file transpilation"""
+
+    def test_collect_inputs(self, tmp_path):
+        """Test expansion of files, directories and globs"""
+        (tmp_path / 'a.dmd').write_text('@note{a}')
+        (tmp_path / 'sub').mkdir()
+        (tmp_path / 'sub' / 'b.dmd').write_text('@note{b}')
+        (tmp_path / 'c.md').write_text('plain')
+
+        files = collect_inputs([str(tmp_path), str(tmp_path / '*.md'), str(tmp_path / 'a.dmd')])
+
+        assert files == [tmp_path / 'a.dmd', tmp_path / 'sub' / 'b.dmd', tmp_path / 'c.md']
+
+        with pytest.raises(FileNotFoundError, match='missing.md'):
+            collect_inputs([str(tmp_path / 'a.dmd'), str(tmp_path / 'missing.md')])
+
+    @pytest.mark.parametrize('name', ['intro.dmd', 'intro.md'])
+    def test_legacy_output_argument(self, tmp_path, name):
+        """Test that `dmd-transpile input output.md` writes to output.md for any input"""
+        (tmp_path / name).write_text('See @fig[a].')
+
+        result = self.run_script(tmp_path, name, 'out.md')
+        assert result.returncode == 0, result.stderr
+        assert (tmp_path / 'out.md').read_text() == 'See @fig:a.'
+        assert sorted(p.name for p in tmp_path.iterdir()) == sorted([name, 'out.md'])
+
+    def test_legacy_output_argument_existing(self, tmp_path):
+        """Test that an existing .md after a .md input is read, never overwritten"""
+        (tmp_path / 'intro.dmd').write_text('See @fig[a].')
+        (tmp_path / 'a.md').write_text('See @tbl[t].')
+        (tmp_path / 'b.md').write_text('See @sec[s].')
+
+        # A .dmd input still names its output, also once that exists
+        for _ in range(2):
+            assert self.run_script(tmp_path, 'intro.dmd', 'a.md').returncode == 0
+            assert (tmp_path / 'a.md').read_text() == 'See @fig:a.'
+
+        result = self.run_script(tmp_path, 'a.md', 'b.md')
+        assert result.returncode == 0, result.stderr
+        assert (tmp_path / 'b.md').read_text() == 'See @sec[s].'
+        assert (tmp_path / 'b.transpiled.md').read_text() == 'See @sec:s.'
+        assert (tmp_path / 'a.transpiled.md').read_text() == 'See @fig:a.'
+
+    def test_output_is_input(self, tmp_path):
+        """Test that an output naming one of the inputs is refused"""
+        (tmp_path / 'a.md').write_text('See @fig[a].')
+
+        result = self.run_script(tmp_path, 'a.md', '--output', 'a.md')
+        assert result.returncode == 1
+        assert 'also an input' in result.stderr
+        assert (tmp_path / 'a.md').read_text() == 'See @fig[a].'
+
+    @staticmethod
+    def run_script(cwd, *args):
+        script = Path(__file__).parent.parent / 'scripts' / 'dmd-transpile'
+        return subprocess.run([sys.executable, str(script), *args, '--no-cache'],
+                              cwd=cwd, capture_output=True, text=True)
+
+    def test_transpile_many(self, tmp_path):
+        """Test parallel transpilation with per-file results and errors"""
+        good = tmp_path / 'good.dmd'
+        good.write_text('See @fig[x].')
+        missing = tmp_path / 'missing.dmd'
+
+        jobs = [(good, default_output(good)), (missing, default_output(missing))]
+        results = transpile_many(jobs, workers=2)
+
+        assert [r.input_file for r in results] == [good, missing]
+        assert results[0].error is None
+        assert results[0].stats['cross_refs'] == 1
+        assert (tmp_path / 'good.md').read_text() == 'See @fig:x.'
+        assert 'FileNotFoundError' in results[1].error
+
+
+class TestCache:
+    """Test the incremental transpile cache"""
+
+    def test_hit_leaves_output_untouched(self, tmp_path):
+        """Test that an unchanged source does not rewrite its output"""
+        source = tmp_path / 'ch.dmd'
+        output = tmp_path / 'ch.md'
+        source.write_text('See @fig[x].')
+        cache = TranspileCache(tmp_path / 'cache')
+
+        DMDTranspiler(cache=cache).transpile_file(source, output)
+        mtime = output.stat().st_mtime_ns
+
+        transpiler = DMDTranspiler(cache=cache)
+        result = transpiler.transpile_file(source, output)
+
+        assert result == 'See @fig:x.'
+        assert transpiler.stats['cross_refs'] == 1
+        assert output.stat().st_mtime_ns == mtime
+
+    def test_modified_output_is_restored(self, tmp_path):
+        """Test that a hit still repairs an output edited by hand"""
+        source = tmp_path / 'ch.dmd'
+        output = tmp_path / 'ch.md'
+        source.write_text('See @fig[x].')
+        cache = TranspileCache(tmp_path / 'cache')
+
+        DMDTranspiler(cache=cache).transpile_file(source, output)
+        output.write_text('edited')
+        DMDTranspiler(cache=cache).transpile_file(source, output)
+
+        assert output.read_text() == 'See @fig:x.'
+
+    def test_eviction(self, tmp_path):
+        """Test that the cache stays within its size bound"""
+        cache = TranspileCache(tmp_path / 'cache', max_bytes=300)
+        keys = [cache.key(f'content {i}') for i in range(10)]
+        for key in keys:
+            cache.put(key, 'x' * 100, {})
+
+        remaining = list((tmp_path / 'cache').glob('*/*.json'))
+        assert 0 < len(remaining) < len(keys)
+        assert sum(p.stat().st_size for p in remaining) <= 300
+
+
 class TestParser:
     """Test the DMD parser"""
 
@@ -237,6 +577,74 @@ class TestParser:
         assert refs[1].ref_type == 'tbl'
         assert refs[2].ref_type == 'eq'
 
+    def test_tokenize_document_order(self):
+        """Test that one scan yields every element kind in position order"""
+        content = (
+            '@fig[a](a.png) Caption.\n'
+            '@tbl[t] Table caption\n'
+            'See @tbl[t] and @note{Compare @fig[a](with this)}.\n'
+        )
+        parser = DMDParser(content)
+        tokens = parser.tokenize()
+
+        kinds = [type(t).__name__ for t in tokens]
+        assert kinds == ['FigureElement', 'TableElement', 'CrossReference',
+                         'CalloutElement', 'CrossReference']
+        assert [t.start for t in tokens] == sorted(t.start for t in tokens)
+        assert all(content[t.start:t.end] == t.original for t in tokens)
+        assert tokens[-1].custom_text == 'with this'
+        assert parser.tokenize() is tokens
+
+    def test_elements_are_compact(self):
+        """Test that elements keep offsets, not copies of their text"""
+        content = '@tbl[t]  Caption  \nSee @sec[s](the part) and @note{Body}.\n'
+        table, ref, callout = DMDParser(content).tokenize()
+
+        assert not hasattr(ref, '__dict__')
+        assert (table.label, table.caption) == ('t', 'Caption')
+        assert (ref.ref_type, ref.label, ref.custom_text) == ('sec', 's', 'the part')
+        assert (callout.callout_type, callout.content) == ('note', 'Body')
+        assert ref == DMDParser(content).tokenize()[1]
+
+    def test_table_definition_requires_line_start(self):
+        """Test that @tbl mid-sentence is a reference, not a table"""
+        parser = DMDParser('Results in @tbl[results] show improvements.')
+
+        assert parser.parse_tables() == []
+        assert len(parser.parse_cross_references()) == 1
+
+    def test_references_in_table_caption(self):
+        """Test that references in a table caption follow the table"""
+        tokens = DMDParser('@tbl[t] Results, cf. @fig[a] and @eq[e](this)\n').tokenize()
+
+        assert [type(t).__name__ for t in tokens] == ['TableElement', 'CrossReference', 'CrossReference']
+        assert [(r.ref_type, r.label) for r in tokens[1:]] == [('fig', 'a'), ('eq', 'e')]
+
+    def test_line_and_column_lookup(self):
+        """Test line/column positions from the newline index"""
+        content = 'First line\n\nSee @fig[a] and\n  @eq[b].'
+        parser = DMDParser(content)
+        refs = parser.parse_cross_references()
+
+        assert [r.line_number for r in refs] == [3, 4]
+        assert parser.get_position(refs[0].start) == (3, 5)
+        assert parser.get_position(refs[1].start) == (4, 3)
+        assert parser.get_position(0) == (1, 1)
+
+    def test_iterators_are_lazy(self):
+        """Test that iter_* scan only as far as they are consumed"""
+        content = '@fig[a](a.png) Caption.\n\nSee @fig[a], @tbl[b] and @note{Body}.\n'
+        parser = DMDParser(content)
+
+        first = next(parser.iter_elements())
+        assert (type(first).__name__, first.label) == ('FigureElement', 'a')
+        assert parser._tokens is None
+
+        assert [r.label for r in parser.iter_cross_references()] == ['a', 'b']
+        assert [c.content for c in parser.iter_callouts()] == ['Body']
+        assert list(parser.iter_elements()) == parser.tokenize()
+        assert parser.parse_tables() == list(parser.iter_tables()) == []
+
     def test_has_enhanced_syntax(self):
         """Test detection of enhanced syntax"""
         # Standard markdown
@@ -248,6 +656,10 @@ class TestParser:
         enhanced = '@fig[test](img.jpg) Caption.'
         parser2 = DMDParser(enhanced)
         assert parser2.has_enhanced_syntax()
+        assert parser2._tokens is None
+
+        # An '@' that starts no directive
+        assert not DMDParser('Mail me@example.com or @someone.').has_enhanced_syntax()
 
 
 if __name__ == '__main__':
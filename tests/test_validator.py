@@ -0,0 +1,158 @@
+"""
+Unit tests for DMD validator
+"""
+
+import os
+import pytest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dmd import validator as validator_module
+from dmd.fscache import DirectoryCache
+from dmd.index import ProjectIndex
+from dmd.suggest import SuggestionIndex
+from dmd.validator import DMDValidator
+
+
+def write_project(tmp_path):
+    """Create a small two-chapter project with one duplicate label"""
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'a.png').write_bytes(b'')
+
+    first = tmp_path / 'first.dmd'
+    first.write_text('@fig[a](images/a.png) First.\n\nSee @fig[b] and @tbl[missing].\n')
+    second = tmp_path / 'second.dmd'
+    second.write_text('@fig[b](images/b.png) Second.\n@fig[a](images/a.png) Again.\n')
+    return [first, second]
+
+
+class TestValidateAll:
+    """Test two-phase validation across files"""
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_errors_and_warnings(self, tmp_path, jobs):
+        """Test duplicate, undefined and missing-image reports"""
+        files = write_project(tmp_path)
+        validator = DMDValidator(tmp_path)
+
+        assert not validator.validate_all(files, jobs=jobs)
+
+        messages = [e.message for e in validator.errors]
+        assert messages == ["Duplicate figure label 'fig:a'",
+                            "Undefined reference @tbl:missing"]
+        assert validator.errors[0].file == files[1]
+        assert (validator.errors[0].line, validator.errors[0].column) == (2, 1)
+        assert validator.errors[1].column == 17
+        assert [w.message for w in validator.warnings] == ["Image file not found: images/b.png"]
+
+    def test_reference_in_table_caption(self, tmp_path):
+        """Test that references in a table caption are checked"""
+        chapter = tmp_path / 'chapter.dmd'
+        chapter.write_text('@tbl[t] Results, cf. @fig[nosuch]\n\n| a |\n|---|\n| 1 |\n')
+        validator = DMDValidator(tmp_path)
+
+        assert not validator.validate_all([chapter], jobs=1)
+        assert [(e.message, e.line, e.column) for e in validator.errors] == [
+            ("Undefined reference @fig:nosuch", 1, 22)]
+
+    def test_parallel_matches_serial(self, tmp_path):
+        """Test that worker count does not change the report"""
+        files = write_project(tmp_path)
+
+        serial = DMDValidator(tmp_path)
+        serial.validate_all(files, jobs=1)
+        parallel = DMDValidator(tmp_path)
+        parallel.validate_all(files, jobs=2)
+
+        assert serial.errors == parallel.errors
+        assert serial.warnings == parallel.warnings
+        assert serial.label_locations == parallel.label_locations
+
+
+class TestProjectIndex:
+    """Test incremental validation through the persistent index"""
+
+    def test_only_changed_files_are_parsed(self, tmp_path, monkeypatch):
+        """Test that a second run parses just the edited file"""
+        files = write_project(tmp_path)
+        index_path = tmp_path / 'index.sqlite'
+
+        first = DMDValidator(tmp_path, index=ProjectIndex(index_path))
+        first.validate_all(files, jobs=1)
+
+        parsed = []
+        scan_file = validator_module.scan_file
+        monkeypatch.setattr(validator_module, 'scan_file',
+                            lambda path: parsed.append(path) or scan_file(path))
+
+        second = DMDValidator(tmp_path, index=ProjectIndex(index_path))
+        second.validate_all(files, jobs=1)
+        assert parsed == []
+        assert second.errors == first.errors
+        assert second.warnings == first.warnings
+
+        files[1].write_text('@fig[b](images/b.png) Second.\n@tbl[missing] Now defined\n')
+        third = DMDValidator(tmp_path, index=ProjectIndex(index_path))
+        third.validate_all(files, jobs=1)
+        assert parsed == [files[1]]
+        assert third.errors == []
+
+
+class TestDirectoryCache:
+    """Test listing-based existence checks"""
+
+    def test_exists(self, tmp_path):
+        """Test lookups against a single directory listing"""
+        (tmp_path / 'images').mkdir()
+        (tmp_path / 'images' / 'a.png').write_bytes(b'')
+        cache = DirectoryCache()
+
+        assert cache.exists(tmp_path / 'images' / 'a.png')
+        assert cache.exists(tmp_path / 'images' / '..' / 'images' / 'a.png')
+        assert not cache.exists(tmp_path / 'images' / 'b.png')
+        assert not cache.exists(tmp_path / 'missing' / 'a.png')
+
+    def test_persisted_listing_invalidated_by_mtime(self, tmp_path):
+        """Test that a saved listing is reused until the directory changes"""
+        images = tmp_path / 'images'
+        images.mkdir()
+        store = tmp_path / 'dirs.json'
+
+        first = DirectoryCache(store)
+        assert not first.exists(images / 'a.png')
+        first.save()
+
+        (images / 'a.png').write_bytes(b'')
+        os.utime(images, ns=(0, images.stat().st_mtime_ns + 1))
+
+        assert DirectoryCache(store).exists(images / 'a.png')
+
+
+class TestSuggestions:
+    """Test "did you mean" suggestions for undefined references"""
+
+    LABELS = ['results', 'results-table', 'architecture', 'arch-detail', 'setup', 'plot-loss']
+
+    @pytest.mark.parametrize('label', ['reslts', 'architectur', 'plot_loss', 'arch', 'zzz', 'a'])
+    def test_matches_difflib(self, label):
+        """Test that the index ranks like difflib.get_close_matches"""
+        from difflib import get_close_matches
+
+        index = SuggestionIndex(self.LABELS)
+        assert index.suggest(label) == get_close_matches(label, self.LABELS, n=3, cutoff=0.6)
+
+    def test_bulk_rename(self, tmp_path):
+        """Test suggestions for many stale references to a renamed label"""
+        (tmp_path / 'ch.dmd').write_text('@fig[results-new](r.png) R.\n' + 'See @fig[results].\n' * 200)
+        validator = DMDValidator(tmp_path)
+        validator.validate_all([tmp_path / 'ch.dmd'], jobs=1)
+
+        assert len(validator.errors) == 200
+        assert {e.suggestion for e in validator.errors} == {"Did you mean: @fig:results-new?"}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
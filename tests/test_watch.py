@@ -0,0 +1,145 @@
+"""
+Unit tests for DMD watch mode
+"""
+
+import os
+import pytest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import dmd.watch
+from dmd.watch import PollingWatcher, WatchSession
+
+
+CONFIG = '''
+structure:
+  parts:
+    - chapters: [chapters/intro.md, chapters/results.md]
+build:
+  transpiler: {enabled: true, validate_before_build: true}
+validation: {check_paper_pdfs: false}
+'''
+
+
+def touch(path, text):
+    """Write `text` with an mtime that differs from the previous write"""
+    stamp = path.stat().st_mtime_ns + 10**9 if path.exists() else None
+    path.write_text(text)
+    if stamp:
+        os.utime(path, ns=(stamp, stamp))
+
+
+class TestPollingWatcher:
+    """Test change detection from directory snapshots"""
+
+    def test_changes(self, tmp_path):
+        """Test that added, modified and removed files are reported once"""
+        a, b = tmp_path / 'a.dmd', tmp_path / 'b.dmd'
+        a.write_text('a')
+        (tmp_path / '.a.dmd.swp').write_text('')
+        watcher = PollingWatcher([tmp_path], ignore=lambda path: path.suffix == '.pdf')
+
+        assert watcher.poll() == set()
+        touch(a, 'changed')
+        b.write_text('b')
+        (tmp_path / 'out.pdf').write_text('')
+        (tmp_path / '.a.dmd.swx').write_text('')
+        assert watcher.poll() == {a, b}
+        assert watcher.poll() == set()
+
+        a.unlink()
+        assert watcher.poll() == {a}
+
+    def test_set_directories_keeps_snapshot(self, tmp_path):
+        """Test that changes made before new directories are added are still reported"""
+        (tmp_path / 'sub').mkdir()
+        a = tmp_path / 'a.dmd'
+        a.write_text('a')
+        (tmp_path / 'sub' / 'b.png').write_text('b')
+        watcher = PollingWatcher([tmp_path])
+
+        touch(a, 'changed')
+        watcher.set_directories([tmp_path, tmp_path / 'sub'])
+        assert watcher.poll() == {a}
+
+
+class TestWatchSession:
+    """Test validating and building from the in-memory label index"""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        (tmp_path / 'chapters').mkdir()
+        (tmp_path / 'config').mkdir()
+        (tmp_path / 'config' / 'config.yaml').write_text('filters:\n  - citeproc\n')
+        (tmp_path / 'dmd.yaml').write_text(CONFIG)
+        (tmp_path / 'chapters' / 'intro.dmd').write_text('@fig[a](a.png) A.\n')
+        (tmp_path / 'chapters' / 'results.dmd').write_text('See @fig[a].\n')
+        (tmp_path / 'references.bib').write_text('')
+        return tmp_path
+
+    def test_only_touched_files_are_parsed(self, project, monkeypatch):
+        """Test that references resolve against labels of unchanged files kept in memory"""
+        parsed = []
+        scan_file = dmd.watch.scan_file
+        monkeypatch.setattr(dmd.watch, 'scan_file', lambda path: parsed.append(path.name) or scan_file(path))
+        session = WatchSession(project / 'dmd.yaml', targets=['transpile:*'])
+
+        validator, results = session.cycle()
+        assert not validator.has_errors()
+        assert sorted(parsed) == ['intro.dmd', 'results.dmd']
+        assert [r.status for r in results] == ['built', 'built']
+
+        results_dmd = project / 'chapters' / 'results.dmd'
+        parsed.clear()
+        touch(results_dmd, 'See @fig[b].\n')
+        validator, results = session.cycle({results_dmd})
+        assert parsed == ['results.dmd']
+        assert len(validator.errors) == 1
+        assert results == []
+
+        parsed.clear()
+        touch(results_dmd, 'See @fig[a] again.\n')
+        validator, results = session.cycle({results_dmd})
+        assert parsed == ['results.dmd']
+        assert not validator.has_errors()
+        assert [(r.name, r.status) for r in results] == [
+            ('transpile:chapters/intro.md', 'up-to-date'), ('transpile:chapters/results.md', 'built')]
+        assert 'again' in (project / 'chapters' / 'results.md').read_text()
+
+    def test_watched_directories(self, project):
+        """Test that sources and image folders are watched, and outputs are not"""
+        session = WatchSession(project / 'dmd.yaml', targets=['transpile:*'])
+        session.cycle()
+
+        assert {project, project / 'chapters'} <= session.directories()
+        assert project / 'chapters' / 'intro.md' in session.outputs()
+
+    def test_save_during_build(self, project, monkeypatch):
+        """Test that a source saved while a build runs triggers another build"""
+        results_dmd = project / 'chapters' / 'results.dmd'
+        session = WatchSession(project / 'dmd.yaml', targets=['transpile:*'])
+        builds = []
+
+        def on_cycle(validator, results):
+            builds.append([r.status for r in results])
+            if len(builds) == 1:
+                touch(results_dmd, 'See @fig[a] again.\n')
+
+        polls = []
+
+        def sleep(seconds):
+            polls.append(seconds)
+            assert len(polls) < 100, 'the save was not picked up'
+
+        monkeypatch.setattr(dmd.watch.time, 'sleep', sleep)
+        dmd.watch.watch_project(session, on_cycle, on_error=pytest.fail, debounce_ms=0, cycles=1)
+
+        assert builds == [['built', 'built'], ['up-to-date', 'built']]
+        assert 'again' in (project / 'chapters' / 'results.md').read_text()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])